@@ -1,43 +1,231 @@
 # app.py
-from openai import OpenAI
-from flask import Flask, render_template, jsonify, request
+import time
+_import_start = time.perf_counter()
+
+from flask import Flask, Response, render_template, jsonify, request, stream_with_context
+import gc
 import os
 import json
 import random
-from typing import List, Dict
+import sqlite3
+import re
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
 import math
+import story_db
+import learner_model
+import generation_planner
+import metrics
+import profiling
+import coalesce
+import response_parsing
+import circuit_breaker
+import provisional_grading
 
 app = Flask(__name__)
+metrics.init_app(app)
+profiling.init_app(app)
 
 STORIES_DIR = "batch_stories"
+STORY_DB = story_db.STORY_DB
 SENTENCE_SCORING_MODEL = 'gpt-4o'
-client = OpenAI(api_key=os.environ["OPENAI_API_KEY_COGNATEFUL"])
+# Grading against a precomputed reference translation (see reference_translations.py)
+# is a much easier task, so a smaller, faster model is enough for it
+REFERENCE_SCORING_MODEL = 'gpt-4o-mini'
+# Set by gunicorn_config.py: load the catalog into memory at import, which with
+# preload_app happens once in the gunicorn master before the workers fork
+PRELOAD_CATALOG = os.environ.get("PRELOAD_CATALOG", "") not in ("", "0")
+# How often each worker checks batch_stories/ for new or changed stories
+CATALOG_CHECK_INTERVAL = float(os.environ.get("CATALOG_CHECK_INTERVAL", "30"))
+# Built offline by vocab_index.py; without it, story selection only looks at difficulty
+VOCAB_INDEX = os.environ.get("VOCAB_INDEX", "vocab_index")
+VOCAB_TOP_K = 3  # Pick randomly among this many of the stories with the most new vocabulary
+# Bounds on scoring calls, so a slow OpenAI can't tie up gunicorn's two sync workers.
+# Each attempt gets at most LLM_TIMEOUT seconds, and a call with its retries at most
+# LLM_DEADLINE, which keeps it under coalesce.FOLLOWER_WAIT and gunicorn's 30 s timeout.
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "8"))
+LLM_DEADLINE = float(os.environ.get("LLM_DEADLINE", "12"))
+LLM_BATCH_DEADLINE = 25.0  # Batch answers are long, so one attempt may use most of this
+LLM_MAX_ATTEMPTS = 3
+# Shared by every scoring call in this worker. When it is open, answers are graded
+# locally by provisional_grading instead of waiting on OpenAI.
+llm_breaker = circuit_breaker.CircuitBreaker('openai', failure_threshold=5, reset_timeout=30.0)
+
+_client = None
+_client_lock = threading.Lock()
 
-def llm_score_translation(original: str, translation: str) -> Dict:
+def get_client():
     """
-    Scores a translation using the Language Model API.
-    
-    Args:
-        original: The original sentence in the source language
-        translation: The translated sentence in the target language
-        api_key: The OpenAI API key
-        
-    Returns:
-        is_correct: A boolean indicating if the translation is correct
-        wrong_morphemes: A list of morphemes that were incorrect
+    Returns the OpenAI client, building it on the first scoring call. The openai
+    package is only imported then, and each worker gets its own HTTP connection pool.
+    The SDK's own retries are turned off: create_completion retries through llm_breaker,
+    within the call's deadline.
     """
-    system_prompt = f"""
-        You are an expert in French-English translation. I will give you a sentence in French and a sentence in English. (The input will be provided in JSON format as described below.) Your job is to tell me whether the English sentence is a correct translation of the French sentence. If it is not, please identify words/morphemes that were incorrectly translated or are missing in the translation. You will be using a JSON format to provide your response.
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                start = time.perf_counter()
+                from openai import OpenAI
+                _client = OpenAI(api_key=os.environ["OPENAI_API_KEY_COGNATEFUL"], http_client=metrics.instrumented_http_client(),
+                                 timeout=LLM_TIMEOUT, max_retries=0)
+                print(f"OpenAI client ready in {(time.perf_counter() - start) * 1000:.1f} ms (pid {os.getpid()})")
+    return _client
+
+def load_catalog():
+    """Builds the catalog if needed and returns the in-memory or SQLite-backed view of it."""
+    story_db.ensure_catalog(STORIES_DIR, STORY_DB)
+    if PRELOAD_CATALOG:
+        return story_db.MemoryCatalog.load(STORY_DB)
+    return story_db.SQLiteCatalog(STORY_DB)
+
+def vocab_index_mtime() -> Optional[float]:
+    path = VOCAB_INDEX + '.npy'
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+def load_vocab_index():
+    """
+    Returns the memory-mapped vocabulary index, or None if vocab_index.py hasn't built
+    one. NumPy is only imported once there is an index to load.
+    """
+    if vocab_index_mtime() is None:
+        return None
+    import vocab_index
+    return vocab_index.VocabIndex.load(VOCAB_INDEX)
+
+def ensure_vocab_index():
+    """Rebuilds the vocabulary index, if there is one, when it is older than the catalog."""
+    if vocab_index_mtime() is None:
+        return
+    import vocab_index
+    try:
+        vocab_index.ensure_index(STORY_DB, VOCAB_INDEX)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        # The old index keeps being used; get_story_candidates checks its picks against the catalog
+        metrics.inc('errors_total', where='vocab_index', type=type(e).__name__)
+        print(f"Error rebuilding the vocabulary index: {e}")
+
+_imports_done = time.perf_counter()
+catalog = load_catalog()
+ensure_vocab_index()
+_catalog_mtime = os.path.getmtime(STORY_DB)
+try:
+    vocab = load_vocab_index()
+except (OSError, ValueError) as e:
+    print(f"Error loading the vocabulary index: {e}")
+    vocab = None
+# Left unset if loading failed, so refresh_catalog tries again
+_vocab_mtime = vocab_index_mtime() if vocab is not None else None
+_catalog_checked = time.monotonic()
+if PRELOAD_CATALOG:
+    # Keep the preloaded objects out of the workers' garbage collections, so
+    # they stay shared with the master instead of being copied on write
+    gc.freeze()
+print(
+    f"App booted in {(time.perf_counter() - _import_start) * 1000:.1f} ms "
+    f"(imports {(_imports_done - _import_start) * 1000:.1f} ms, "
+    f"catalog {(time.perf_counter() - _imports_done) * 1000:.1f} ms, preload={PRELOAD_CATALOG})"
+)
+
+@app.before_request
+def refresh_catalog():
+    """
+    Every CATALOG_CHECK_INTERVAL seconds, rebuilds the catalog if batch_stories/ has
+    changed and reloads it if another worker already rebuilt it. The vocabulary index
+    is rebuilt along with the catalog and reloaded when it has changed.
+    """
+    global catalog, _catalog_mtime, _catalog_checked, vocab, _vocab_mtime
+    if time.monotonic() - _catalog_checked < CATALOG_CHECK_INTERVAL:
+        return
+    _catalog_checked = time.monotonic()
+    story_db.ensure_catalog(STORIES_DIR, STORY_DB)
+    ensure_vocab_index()
+    mtime = os.path.getmtime(STORY_DB)
+    if mtime != _catalog_mtime:
+        # The SQLite-backed catalog reopens its connections by itself
+        if PRELOAD_CATALOG:
+            catalog = story_db.MemoryCatalog.load(STORY_DB)
+        _catalog_mtime = mtime
+    mtime = vocab_index_mtime()
+    if mtime != _vocab_mtime:
+        try:
+            vocab = load_vocab_index()
+            _vocab_mtime = mtime
+        except (OSError, ValueError) as e:
+            # Keep the old index and try again at the next check
+            print(f"Error loading the vocabulary index: {e}")
+
+def llm_error_is_transient(error: Exception) -> bool:
+    """Whether an error means OpenAI is slow or down (worth a retry, and counted by llm_breaker)."""
+    import openai
+    if isinstance(error, (TimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+def create_completion(prompt: str, model: str = SENTENCE_SCORING_MODEL, timeout: float = LLM_TIMEOUT,
+                      deadline: float = LLM_DEADLINE, **kwargs):
+    """
+    Sends a single-message chat completion request through llm_breaker and records the
+    timing, usage and errors of each attempt.
+
+    Raises:
+        circuit_breaker.CircuitOpenError: At once, if OpenAI has been failing
+        The last attempt's error, if every attempt failed or the deadline ran out
+    """
+    # Built outside the timer, so the first call's lazy import isn't counted as LLM latency
+    client = get_client()
+
+    def attempt(remaining: float):
+        with metrics.timer('llm'):
+            try:
+                completion = client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {'role': 'user', 'content': prompt}
+                    ],
+                    temperature=1,
+                    timeout=min(timeout, remaining),
+                    **kwargs
+                )
+            except Exception as e:
+                metrics.record_llm_call(model, error=e)
+                raise
+        metrics.record_llm_call(model, completion)
+        return completion
+
+    return llm_breaker.call(
+        attempt, deadline, LLM_MAX_ATTEMPTS, is_failure=llm_error_is_transient,
+        on_retry=lambda e: metrics.inc('llm_retries_total', model=model)
+    )
+
+# Structured-output schema for translation_scoring_prompt; properties are generated in
+# this order, so is_correct still comes first for the streaming endpoint
+TRANSLATION_SCORING_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'is_correct': {'type': 'boolean'},
+        'incorrect_morphemes': {'type': 'array', 'items': {'type': 'string'}},
+        'reasoning': {'type': 'string'},
+    },
+    'required': ['is_correct', 'incorrect_morphemes', 'reasoning'],
+    'additionalProperties': False,
+}
+
+def translation_scoring_prompt(original: str, translation: str, language: str = story_db.DEFAULT_LANGUAGE) -> str:
+    """The rubric prompt for grading one translation. The model answers with is_correct first."""
+    language_name = story_db.LANGUAGES[language]
+    return f"""
+        You are an expert in {language_name}-English translation. I will give you a sentence in {language_name} and a sentence in English. (The input will be provided in JSON format as described below.) Your job is to tell me whether the English sentence is a correct translation of the {language_name} sentence. If it is not, please identify words/morphemes that were incorrectly translated or are missing in the translation. You will be using a JSON format to provide your response.
         Here's the input format:
         {{
-            "original": <The original French sentence>,
+            "original": <The original {language_name} sentence>,
             "translation": <The attempted translation in English>
         }}
 
         Here's the output format:
         {{
           "is_correct": <a boolean indicating whether the translation is correct>,
-          "incorrect_morphemes": [A list of morphemes in the original French sentence that were incorrectly translated or are missing in the translation sentence. Make sure that anything you include in the list is a character-for-character match from the original French sentence. Do not include words that the translation got correct or words that are not in the `original` sentence.],
+          "incorrect_morphemes": [A list of morphemes in the original {language_name} sentence that were incorrectly translated or are missing in the translation sentence. Make sure that anything you include in the list is a character-for-character match from the original {language_name} sentence. Do not include words that the translation got correct or words that are not in the `original` sentence.],
           "reasoning": "<Reasoning for your scoring. You may be brief if the translation is correct.>",
         }}
 
@@ -75,70 +263,348 @@ def llm_score_translation(original: str, translation: str) -> Dict:
         Note: Please avoid including Markdown formatting tags (```) in your response, as my parser will not be able to interpret them.
     """
 
-    completion = client.chat.completions.create(
-        model=SENTENCE_SCORING_MODEL,
-        messages=[
-            {'role': 'user', 'content': system_prompt}
-        ],
-        temperature=1
+def reference_scoring_prompt(original: str, translation: str, reference: Dict, language: str = story_db.DEFAULT_LANGUAGE) -> str:
+    """
+    A short grading prompt for sentences with a reference translation. The model only
+    picks the numbers of the alignment pairs the learner got wrong; the original words are
+    looked up locally, so they always match the sentence character for character.
+    """
+    language_name = story_db.LANGUAGES[language]
+    pairs = '\n'.join(
+        f"{i}. {word} = {english or '(no English word)'}"
+        for i, (word, english) in enumerate(reference['alignment'])
+    )
+    return f"""
+        Grade a learner's English translation of a {language_name} sentence.
+        {language_name}: {json.dumps(original, ensure_ascii=False)}
+        Reference translation: {json.dumps(reference['translation'], ensure_ascii=False)}
+        Word alignment:
+        {pairs}
+        Learner's translation: {json.dumps(translation, ensure_ascii=False)}
+
+        The learner's translation is correct if it means the same as the reference; the wording may differ. Extra words in the learner's translation don't count against any pair.
+        Respond with JSON only, no Markdown: {{"is_correct": <boolean>, "wrong_pairs": [<numbers of the alignment pairs whose meaning is wrong or missing in the learner's translation>]}}
+    """
+
+def llm_score_translation_with_reference(original: str, translation: str, reference: Dict,
+                                         language: str = story_db.DEFAULT_LANGUAGE) -> Dict:
+    """
+    Scores a translation against its precomputed reference translation and alignment.
+
+    Returns:
+        The same {"is_correct", "incorrect_morphemes", "reasoning"} dict as llm_score_translation
+    """
+    completion = create_completion(
+        reference_scoring_prompt(original, translation, reference, language), model=REFERENCE_SCORING_MODEL,
+        **response_parsing.response_format(REFERENCE_SCORING_MODEL)
+    )
+    results = response_parsing.parse_json(
+        completion.choices[0].message.content, expect=dict, source='score_translation_reference'
+    )
+    alignment = reference['alignment']
+    wrong_pairs = [i for i in results.get('wrong_pairs', []) if isinstance(i, int) and 0 <= i < len(alignment)]
+    is_correct = bool(results.get('is_correct'))
+    return {
+        'is_correct': is_correct,
+        'incorrect_morphemes': [] if is_correct else [alignment[i][0] for i in wrong_pairs],
+        'reasoning': f"Compared with the reference translation: {reference['translation']}",
+    }
+
+def llm_score_translation(original: str, translation: str, language: str = story_db.DEFAULT_LANGUAGE) -> Dict:
+    """
+    Scores a translation using the Language Model API. Sentences from the catalog that
+    have a reference translation are graded against it with the smaller model.
+    
+    Args:
+        original: The original sentence in the source language
+        translation: The translated sentence in the target language
+        language: Code of the original sentence's language, a key of story_db.LANGUAGES
+        
+    Returns:
+        is_correct: A boolean indicating if the translation is correct
+        wrong_morphemes: A list of morphemes that were incorrect
+    """
+    reference = catalog.get_reference(original)
+    if reference is not None:
+        return llm_score_translation_with_reference(original, translation, reference, language)
+
+    system_prompt = translation_scoring_prompt(original, translation, language)
+
+    completion = create_completion(
+        system_prompt, **response_parsing.response_format(SENTENCE_SCORING_MODEL, TRANSLATION_SCORING_SCHEMA, 'translation_score')
     )
     
-    response_text = completion.choices[0].message.content.strip()
+    results = response_parsing.parse_json(completion.choices[0].message.content, expect=dict, source='score_translation')
+    print("Translation scoring results")
+    print(results)
+    return results
+
+def llm_score_translation_batch(pairs: List[Dict], language: str = story_db.DEFAULT_LANGUAGE) -> List[Dict]:
+    """
+    Scores several translations with a single Language Model API call.
+
+    Args:
+        pairs: List of {"original": ..., "translation": ...} dicts
+        language: Code of the original sentences' language
+
+    Returns:
+        One {"is_correct", "incorrect_morphemes", "reasoning"} dict per pair, in order
+    """
+    language_name = story_db.LANGUAGES[language]
+    system_prompt = f"""
+        You are an expert in {language_name}-English translation. I will give you {len(pairs)} pairs of a sentence in {language_name} and an attempted English translation of it, as a JSON array. For each pair, tell me whether the English sentence is a correct translation of the {language_name} sentence. If it is not, identify words/morphemes that were incorrectly translated or are missing in the translation.
+
+        For each pair, provide a JSON object with these fields:
+        {{
+          "is_correct": <a boolean indicating whether the translation is correct>,
+          "incorrect_morphemes": [A list of morphemes in the original {language_name} sentence that were incorrectly translated or are missing in the translation sentence. Make sure that anything you include in the list is a character-for-character match from the original {language_name} sentence. Do not include words that the translation got correct or words that are not in the `original` sentence.],
+          "reasoning": "<Reasoning for your scoring. You may be brief if the translation is correct.>"
+        }}
+
+        Example: for the pair {{"original": "Voulez-vous aller manger avec moi", "translation": "Does he want to go sing with me tomorrow?"}} you would respond with
+        {{"is_correct": false, "incorrect_morphemes": ["vous", "manger"], "reasoning": "The translation has an incorrect pronoun and verb. It also has an extra word."}}
+        Extraneous words in the translation never go in incorrect_morphemes.
+
+        Please format your response as a JSON array of these objects, in the same order as the input. You should have {len(pairs)} objects in your array.
+
+        Here are the pairs to score:
+        {json.dumps([{'original': p['original'], 'translation': p['translation']} for p in pairs], ensure_ascii=False)}
+        Note: Please do not include Markdown formatting tags (```) in your response, as my parser will not be able to interpret them.
+    """
+
+    # The answer is a top-level array, which JSON mode can't express, so this relies on local repair
+    completion = create_completion(system_prompt, timeout=LLM_BATCH_DEADLINE, deadline=LLM_BATCH_DEADLINE)
+
+    results = response_parsing.parse_json(
+        completion.choices[0].message.content, expect=list, length=len(pairs), source='score_translation_batch'
+    )
+    if not all(isinstance(result, dict) and 'is_correct' in result for result in results):
+        # A malformed item would otherwise be graded as wrong; the caller grades provisionally instead
+        raise response_parsing.ResponseParseError("Batch answer has items without is_correct")
+    return results
+
+_IS_CORRECT_RE = re.compile(r'"is_correct"\s*:\s*(true|false)')
+_MORPHEMES_RE = re.compile(r'"incorrect_morphemes"\s*:\s*(\[[^\]]*\])')
+
+def stream_score_translation(original: str, translation: str, language: str = story_db.DEFAULT_LANGUAGE) -> Iterator[Tuple[str, Dict]]:
+    """
+    Scores a translation with the streaming API and yields (event, data) as soon as each
+    part of the answer can be parsed: "verdict" with isCorrect, then "morphemes" with
+    wrongMorphemes, then "done" with the full response and the reasoning.
+
+    Sentences with a reference translation are graded with the short reference prompt
+    instead, which answers quickly enough that all three events are sent at once.
+    """
+    reference = catalog.get_reference(original)
+    if reference is not None:
+        results = llm_score_translation_with_reference(original, translation, reference, language)
+        response = scoring_response(results)
+        yield 'verdict', {'isCorrect': response['isCorrect']}
+        yield 'morphemes', {'wrongMorphemes': response['wrongMorphemes']}
+        yield 'done', {**response, 'reasoning': results['reasoning']}
+        return
+
+    client = get_client()
+    text = ''
+    sent_verdict = sent_morphemes = False
+    usage = None
+
+    def open_stream(remaining: float):
+        try:
+            return client.chat.completions.create(
+                model=SENTENCE_SCORING_MODEL,
+                messages=[
+                    {'role': 'user', 'content': translation_scoring_prompt(original, translation, language)}
+                ],
+                temperature=1,
+                stream=True,
+                stream_options={'include_usage': True},
+                timeout=min(LLM_TIMEOUT, remaining),
+                **response_parsing.response_format(SENTENCE_SCORING_MODEL, TRANSLATION_SCORING_SCHEMA, 'translation_score')
+            )
+        except Exception as e:
+            metrics.record_llm_call(SENTENCE_SCORING_MODEL, error=e)
+            raise
+
+    start = time.monotonic()
+    stream = None
+    # Seconds spent waiting on OpenAI. Only those waits are timed, not the time this
+    # generator spends suspended at a yield while the client receives an event.
+    upstream = 0.0
+    waiting = time.perf_counter()
     try:
-        results = json.loads(response_text)
-        print("Translation scoring results")
-        print(results)
-        return results
-    except json.JSONDecodeError:
-        print("Error: Failed to decode JSON from the response.")
+        # Only opening the stream is retried; once events have been sent it can't be
+        stream = llm_breaker.call(
+            open_stream, LLM_DEADLINE, LLM_MAX_ATTEMPTS, is_failure=llm_error_is_transient,
+            on_retry=lambda e: metrics.inc('llm_retries_total', model=SENTENCE_SCORING_MODEL)
+        )
+        chunks = iter(stream)
+        while True:
+            if waiting is None:
+                waiting = time.perf_counter()
+            chunk = next(chunks, None)
+            upstream += time.perf_counter() - waiting
+            waiting = None
+            if chunk is None:
+                break
+            if time.monotonic() - start > LLM_DEADLINE:
+                stream.close()
+                raise circuit_breaker.DeadlineExceeded("Scoring stream ran past its deadline")
+            if chunk.usage is not None:
+                usage = chunk
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            if not text:
+                metrics.record_stage('llm_first_token', upstream)
+            text += chunk.choices[0].delta.content
+            if not sent_verdict:
+                match = _IS_CORRECT_RE.search(text)
+                if match:
+                    sent_verdict = True
+                    yield 'verdict', {'isCorrect': match.group(1) == 'true'}
+            if sent_verdict and not sent_morphemes:
+                match = _MORPHEMES_RE.search(text)
+                if match:
+                    try:
+                        morphemes = json.loads(match.group(1))
+                    except json.JSONDecodeError:
+                        continue
+                    sent_morphemes = True
+                    yield 'morphemes', {'wrongMorphemes': list(morphemes)}
+    except Exception as e:
+        if stream is not None:
+            # Failed part way through, after llm_breaker counted the call as a success
+            if llm_error_is_transient(e):
+                llm_breaker.record_failure()
+            metrics.record_llm_call(SENTENCE_SCORING_MODEL, error=e)
         raise
+    finally:
+        if waiting is not None:
+            upstream += time.perf_counter() - waiting
+        metrics.record_stage('llm', upstream)
+    metrics.record_llm_call(SENTENCE_SCORING_MODEL, usage)
+
+    results = response_parsing.parse_json(text, expect=dict, source='score_translation_stream')
+    yield 'done', {**scoring_response(results), 'reasoning': results.get('reasoning', '')}
+
+def scoring_response(scoring_results: Dict) -> Dict:
+    """Turns one LLM scoring result into the JSON the client expects."""
+    try:
+        is_correct, wrong_morphemes = bool(scoring_results['is_correct']), list(scoring_results['incorrect_morphemes'])
+    except (KeyError, TypeError):
+        is_correct = False
+        wrong_morphemes = []
+
+    response = {
+        'isCorrect': is_correct,
+        'wrongMorphemes': wrong_morphemes,
+        'feedback': 'Great job!' if is_correct else 'Try again with a different translation.'
+    }
+    if scoring_results.get('provisional'):
+        response['provisional'] = True
+    return response
+
+def provisional_grade(original: str, translation: str) -> Dict:
+    """Grades a translation locally, against its reference translation if it has one or else its cognates."""
+    reference = catalog.get_reference(original)
+    if reference is not None:
+        return provisional_grading.grade_with_reference(translation, reference)
+    return provisional_grading.grade_with_cognates(original, translation, catalog.get_cognate_words(original))
+
+def provisional_score(route: str, error: Exception, original: str, translation: str) -> Dict:
+    """
+    Grades a translation locally after the LLM call failed or llm_breaker refused it, so
+    the learner gets an answer instead of an error. The result is marked provisional.
+    """
+    metrics.inc('llm_fallbacks_total', route=route, reason=type(error).__name__)
+    print(f"Grading provisionally after {type(error).__name__}: {error}")
+    return provisional_grade(original, translation)
+
+def update_learner(learner_id: Optional[str], original: str, is_correct: bool,
+                   language: str = story_db.DEFAULT_LANGUAGE) -> Optional[float]:
+    """
+    Records an answer in the server-side learner model.
 
-def calculate_story_difficulty(story_data: Dict) -> float:
-    """Calculate average difficulty of a story based on sentence difficulties."""
-    difficulties = [sentence['actual_score'] for sentence in story_data['story']]
-    return sum(difficulties) / len(difficulties)
+    Returns:
+        The learner's new ability, or None if no learner id was sent or the update failed.
+        Grading never fails because of the learner model.
+    """
+    if not learner_id:
+        return None
+    try:
+        with metrics.timer('learner_model'):
+            return learner_model.record_answer(
+                learner_id, original, catalog.get_sentence_score(original), is_correct, language=language
+            )['ability']
+    except Exception as e:
+        metrics.inc('errors_total', where='learner_model', type=type(e).__name__)
+        print(f"Error updating learner model: {e}")
+        return None
+
+def learner_ability(learner_id: Optional[str], language: str = story_db.DEFAULT_LANGUAGE) -> Optional[float]:
+    """
+    The learner's estimated ability, or None if no learner id was sent, the learner
+    hasn't answered anything yet or the lookup failed. Story selection never fails
+    because of the learner model.
+    """
+    if not learner_id:
+        return None
+    try:
+        with metrics.timer('learner_model'):
+            return learner_model.get_ability(learner_id, language=language)
+    except Exception as e:
+        metrics.inc('errors_total', where='learner_model', type=type(e).__name__)
+        print(f"Error reading learner model: {e}")
+        return None
+
+def record_selection(target_difficulty: float, story_difficulty: float, tolerance: float = 0.3,
+                     language: str = story_db.DEFAULT_LANGUAGE) -> None:
+    """Records the demand for a difficulty, and whether the catalog could meet it, for the generation planner."""
+    missed = abs(story_difficulty - target_difficulty) > tolerance
+    metrics.inc('story_selections_total', language=language,
+                band=generation_planner.band_label(generation_planner.band_of(target_difficulty)),
+                outcome='miss' if missed else 'hit')
+    try:
+        generation_planner.record_selection(target_difficulty, missed, language=language)
+    except Exception as e:
+        metrics.inc('errors_total', where='generation_planner', type=type(e).__name__)
+        print(f"Error recording story selection: {e}")
+
+def in_tolerance(summary: Optional[Dict], target_difficulty: float, tolerance: float) -> bool:
+    return summary is not None and abs(summary['difficulty'] - target_difficulty) <= tolerance
 
-def get_story_candidates(target_difficulty: float, seen_stories: List[str], tolerance: float = 0.3) -> str:
+def get_story_candidates(target_difficulty: float, seen_stories: List[str], tolerance: float = 0.3,
+                         language: str = story_db.DEFAULT_LANGUAGE) -> Optional[str]:
     """
     Returns a random story filename that:
     1. Hasn't been seen before
     2. Has difficulty close to target_difficulty
+    3. Is in the requested language
+    4. Once the learner has seen some stories and a vocabulary index is built, is
+       among the VOCAB_TOP_K stories that repeat the fewest cognates they have met
     
     Args:
         target_difficulty: The target difficulty level (0-3)
         seen_stories: List of previously seen story filenames
         tolerance: How far from target difficulty we're willing to go
+        language: Language code, a key of story_db.LANGUAGES
     """
-    story_files = [f for f in os.listdir(STORIES_DIR) if f.endswith('.json')]
-    available_stories = [f for f in story_files if f not in seen_stories]
-    
-    if not available_stories:
-        # If all stories have been seen, reset the seen stories list
-        available_stories = story_files
-    
-    # Calculate difficulties for available stories
-    story_difficulties = {}
-    for filename in available_stories:
-        with open(os.path.join(STORIES_DIR, filename), 'r', encoding='utf-8') as f:
-            story_data = json.load(f)
-            story_difficulties[filename] = calculate_story_difficulty(story_data)
-    
-    # Find stories within tolerance range
-    candidates = [
-        filename for filename, difficulty in story_difficulties.items()
-        if abs(difficulty - target_difficulty) <= tolerance
-    ]
-    
-    if candidates:
-        return random.choice(candidates)
-    else:
-        # If no stories within tolerance, pick the closest one
-        return min(story_difficulties.items(), key=lambda x: abs(x[1] - target_difficulty))[0]
+    with metrics.timer('story_load'):
+        if vocab is not None and seen_stories:
+            # The index may briefly lag behind a rebuilt catalog, so its picks are checked
+            # against the catalog's current stories and difficulties
+            top = [
+                filename for filename, _ in vocab.top_stories(target_difficulty, seen_stories, tolerance, language, VOCAB_TOP_K)
+                if in_tolerance(catalog.get_story_summary(filename), target_difficulty, tolerance)
+            ]
+            if top:
+                return random.choice(top)
+        return catalog.get_story_candidates(target_difficulty, seen_stories, tolerance, language)
 
-def load_story(filename: str) -> Dict:
-    """Loads and returns story data from a JSON file."""
-    with open(os.path.join(STORIES_DIR, filename), 'r', encoding='utf-8') as f:
-        return json.load(f)
+def request_language(value: Optional[str]) -> Optional[str]:
+    """The language code from a request's lang parameter (French if absent), or None if it isn't supported."""
+    language = value or story_db.DEFAULT_LANGUAGE
+    return language if language in story_db.LANGUAGES else None
 
 @app.route('/score_translation', methods=['POST'])
 def score_translation():
@@ -149,20 +615,114 @@ def score_translation():
 
     if not original or not translation:
         return jsonify({'error': 'Missing original or translation text'}), 400
+    language = request_language(data.get('lang'))
+    if language is None:
+        return jsonify({'error': 'Unsupported language'}), 400
 
-    wrong_morphemes = []
-    scoring_results = llm_score_translation(original, translation)
-    try: 
-        is_correct, wrong_morphemes = bool(scoring_results['is_correct']), list(scoring_results['incorrect_morphemes'])
-    except:
-        is_correct = False
-        wrong_morphemes = []
-        feedback = "Error: Could not score the translation."
+    # Learners in the same class often submit the same answer at the same time, so
+    # identical requests share one in-flight LLM call, across workers too
+    try:
+        scoring_results = coalesce.single_flight(
+            'score_translation', (language, original, translation),
+            lambda: llm_score_translation(original, translation, language)
+        )
+    except Exception as e:
+        scoring_results = provisional_score('/score_translation', e, original, translation)
+    response = scoring_response(scoring_results)
+    # Provisional grades are too rough to move the learner's ability
+    if not response.get('provisional'):
+        ability = update_learner(data.get('learnerId'), original, response['isCorrect'], language)
+        if ability is not None:
+            response['userDifficulty'] = ability
+    return jsonify(response)
 
+@app.route('/score_translation_stream', methods=['POST'])
+def score_translation_stream():
+    """
+    Same input as /score_translation, answered as server-sent events so the client can
+    show the verdict before the model has finished writing its reasoning. Streams are
+    not coalesced, since a partly consumed stream can't be shared.
+    """
+    data = request.get_json()
+    original = data.get('original')
+    translation = data.get('translation')
+
+    if not original or not translation:
+        return jsonify({'error': 'Missing original or translation text'}), 400
+    language = request_language(data.get('lang'))
+    if language is None:
+        return jsonify({'error': 'Unsupported language'}), 400
+
+    learner_id = data.get('learnerId')
+
+    def event(name: str, payload: Dict) -> str:
+        return f"event: {name}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    def events():
+        sent = False
+        try:
+            for name, payload in stream_score_translation(original, translation, language):
+                if name == 'done':
+                    ability = update_learner(learner_id, original, payload['isCorrect'], language)
+                    if ability is not None:
+                        payload['userDifficulty'] = ability
+                yield event(name, payload)
+                sent = True
+        except Exception as e:
+            if sent:
+                # A verdict is already out, so a provisional one could contradict it
+                print(f"Error while streaming translation score: {e}")
+                yield event('error', {'error': 'Could not score the translation.'})
+                return
+            results = provisional_score('/score_translation_stream', e, original, translation)
+            response = scoring_response(results)
+            yield event('verdict', {'isCorrect': response['isCorrect'], 'provisional': True})
+            yield event('morphemes', {'wrongMorphemes': response['wrongMorphemes']})
+            yield event('done', {**response, 'reasoning': results['reasoning']})
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+MAX_BATCH_ITEMS = 30  # One story's worth of answers with room to spare
+
+@app.route('/score_translation_batch', methods=['POST'])
+def score_translation_batch():
+    """
+    Grades several translations (e.g. every answer in a story, or a queued offline
+    backlog) in one LLM request. Expects {"items": [{"original", "translation"}, ...]}
+    and returns {"results": [...]} with one /score_translation response per item.
+    """
+    data = request.get_json()
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Missing items'}), 400
+    if len(items) > MAX_BATCH_ITEMS:
+        return jsonify({'error': f'At most {MAX_BATCH_ITEMS} items per batch'}), 400
+    if not all(isinstance(item, dict) and item.get('original') and item.get('translation') for item in items):
+        return jsonify({'error': 'Missing original or translation text'}), 400
+    language = request_language(data.get('lang'))
+    if language is None:
+        return jsonify({'error': 'Unsupported language'}), 400
+
+    try:
+        scoring_results = llm_score_translation_batch(items, language)
+    except Exception as e:
+        metrics.inc('llm_fallbacks_total', route='/score_translation_batch', reason=type(e).__name__)
+        print(f"Grading batch provisionally after {type(e).__name__}: {e}")
+        scoring_results = [provisional_grade(item['original'], item['translation']) for item in items]
+    return jsonify({'results': [scoring_response(result) for result in scoring_results]})
+
+@app.route('/health', methods=['GET'])
+def health():
+    """
+    This worker's view of the scoring upstream. "degraded" while llm_breaker isn't
+    closed, i.e. while answers are being graded provisionally.
+    """
+    breaker = llm_breaker.snapshot()
     return jsonify({
-        'isCorrect': is_correct,
-        'wrongMorphemes': wrong_morphemes,
-        'feedback': 'Great job!' if is_correct else 'Try again with a different translation.'
+        'status': 'ok' if breaker['state'] == circuit_breaker.CLOSED else 'degraded',
+        'pid': os.getpid(),
+        'llm': breaker,
     })
 
 @app.route('/')
@@ -174,21 +734,36 @@ def get_sentence():
     data = request.get_json()
     
     if data.get('needNewStory'):
-        # Get user's current difficulty and seen stories
+        language = request_language(data.get('lang'))
+        if language is None:
+            return jsonify({'error': 'Unsupported language'}), 400
+
+        # Get user's current difficulty and seen stories. The server-side estimate takes
+        # precedence once the learner has answered something.
         user_difficulty = float(data.get('userDifficulty', 3.0))  # Default to middle difficulty
+        ability = learner_ability(data.get('learnerId'), language)
+        if ability is not None:
+            user_difficulty = ability
         seen_stories = data.get('seenStories', [])
         
         # Select appropriate story
-        story_file = get_story_candidates(user_difficulty, seen_stories)
-        story_data = load_story(story_file)
-        sentence_data = story_data['story'][0]
+        story_file = get_story_candidates(user_difficulty, seen_stories, language=language)
+        if story_file is None:
+            return jsonify({'error': 'No stories available in this language'}), 404
+        with metrics.timer('story_load'):
+            story_summary = catalog.get_story_summary(story_file)
+            sentence_data = catalog.get_sentence(story_file, 0)
+        record_selection(user_difficulty, story_summary['difficulty'], language=language)
         
         return jsonify({
             'sentence': sentence_data['sentence'],
+            'html': sentence_data['html'],
+            'cognates': sentence_data['cognates'],
             'storyFile': story_file,
             'isLastSentence': False,
-            'storyDifficulty': calculate_story_difficulty(story_data),
-            'sentenceDifficulty': sentence_data['actual_score']
+            'storyDifficulty': story_summary['difficulty'],
+            'sentenceDifficulty': sentence_data['actual_score'],
+            'userDifficulty': user_difficulty
         })
     
     else:
@@ -196,60 +771,71 @@ def get_sentence():
         story_file = data['storyFile']
         sentence_index = int(data['sentenceIndex'])
         
-        story_data = load_story(story_file)
+        with metrics.timer('story_load'):
+            story_summary = catalog.get_story_summary(story_file)
+        if story_summary is None:
+            return jsonify({'error': 'Story not found'}), 404
         
         # Check if we've reached the end of the story
-        if sentence_index >= len(story_data['story']):
+        if sentence_index >= story_summary['num_sentences']:
             return jsonify({
                 'isLastSentence': True
             })
         
-        sentence_data = story_data['story'][sentence_index]
+        with metrics.timer('story_load'):
+            sentence_data = catalog.get_sentence(story_file, sentence_index)
         return jsonify({
             'sentence': sentence_data['sentence'],
-            'isLastSentence': sentence_index == len(story_data['story']) - 1,
+            'html': sentence_data['html'],
+            'cognates': sentence_data['cognates'],
+            'isLastSentence': sentence_index == story_summary['num_sentences'] - 1,
             'sentenceDifficulty': sentence_data['actual_score']
         })
 
 @app.route('/story_list', methods=['GET'])
 def get_story_list():
-    """Returns a list of all available stories with their metadata."""
-    story_files = [f for f in os.listdir(STORIES_DIR) if f.endswith('.json')]
-    stories = []
-    
-    for filename in story_files:
-        with open(os.path.join(STORIES_DIR, filename), 'r', encoding='utf-8') as f:
-            story_data = json.load(f)
-            stories.append({
-                'title': filename.replace('.json', ''),
-                'difficulty': calculate_story_difficulty(story_data),
-                'num_sentences': len(story_data['story'])
-            })
+    """Returns a list of all available stories with their metadata, or only those in ?lang=."""
+    language = None
+    if request.args.get('lang'):
+        language = request_language(request.args['lang'])
+        if language is None:
+            return jsonify({'error': 'Unsupported language'}), 400
+    with metrics.timer('story_load'):
+        story_list = catalog.get_story_list(language)
+    stories = [
+        {
+            'title': story['filename'].replace('.json', ''),
+            'language': story['language'],
+            'difficulty': story['difficulty'],
+            'num_sentences': story['num_sentences']
+        }
+        for story in story_list
+    ]
     
     return jsonify(stories)
 
 @app.route('/story_list/<story_title>', methods=['GET'])
 def get_story_details(story_title):
     """Returns detailed information about a specific story."""
-    try:
-        filename = f"{story_title}.json"
-        with open(os.path.join(STORIES_DIR, filename), 'r', encoding='utf-8') as f:
-            story_data = json.load(f)
-
-        sentences = [
-            {
-                'text': sentence['sentence'],
-                'difficulty': sentence['actual_score']
-            }
-            for sentence in story_data['story']
-        ]
-
-        return jsonify({
-            'title': story_title,
-            'sentences': sentences
-        })
-    except FileNotFoundError:
+    with metrics.timer('story_load'):
+        story_sentences = catalog.get_story_sentences(f"{story_title}.json")
+    if story_sentences is None:
         return jsonify({'error': 'Story not found'}), 404
 
+    sentences = [
+        {
+            'text': sentence['sentence'],
+            'html': sentence['html'],
+            'cognates': sentence['cognates'],
+            'difficulty': sentence['actual_score']
+        }
+        for sentence in story_sentences
+    ]
+
+    return jsonify({
+        'title': story_title,
+        'sentences': sentences
+    })
+
 if __name__ == '__main__':
     app.run(debug=True)
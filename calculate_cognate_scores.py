@@ -1,6 +1,7 @@
 import os
 import json
 from collections import defaultdict
+import story_db
 
 def calculate_cognate_word_scores(data_dir):
     # Initialize dictionaries to track total scores and occurrences of each cognate word
@@ -35,6 +36,10 @@ def calculate_cognate_word_scores(data_dir):
     
     return cognate_averages
 
+def calculate_cognate_word_scores_db(db_path=story_db.STORY_DB):
+    # Same statistics as calculate_cognate_word_scores, as one indexed query over the story catalog
+    return story_db.get_cognate_averages(story_db.get_connection(db_path))
+
 def save_cognate_averages(cognate_averages, output_file='cognate_averages.json'):
     # Save the cognate averages to a JSON file
     with open(output_file, 'w') as f:
@@ -52,8 +57,9 @@ if __name__ == "__main__":
     # Directory containing the JSON story files
     data_directory = 'batch_stories'
     
-    # Calculate the averages
-    averages = calculate_cognate_word_scores(data_directory)
+    # Calculate the averages from the story catalog, importing it first if needed
+    story_db.ensure_catalog(data_directory)
+    averages = calculate_cognate_word_scores_db()
     
     # Print the sorted averages to the terminal
     print_sorted_cognate_averages(averages)
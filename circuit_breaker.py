@@ -0,0 +1,144 @@
+import time
+import random
+import threading
+from typing import Callable, Dict, Optional, TypeVar
+
+import metrics
+
+T = TypeVar('T')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitOpenError(Exception):
+    """The breaker is open, so the call was not attempted."""
+
+class DeadlineExceeded(TimeoutError):
+    """The call's overall deadline ran out before it succeeded."""
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream that keeps failing, so requests fail fast instead of each
+    waiting out a timeout.
+
+    After failure_threshold consecutive failures the breaker opens and rejects calls
+    for reset_timeout seconds. It then lets a single trial call through (half open):
+    success closes it again, failure reopens it for another reset_timeout.
+
+    State is per process, so each gunicorn worker trips its own breaker. Transitions
+    and rejections are counted in /metrics, which sums them across workers.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+
+    def _transition(self, state: str) -> None:
+        # Called with the lock held
+        if state != self._state:
+            self._state = state
+            metrics.inc('circuit_breaker_transitions_total', breaker=self.name, state=state)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                self._transition(HALF_OPEN)
+            return self._state
+
+    def allow_request(self) -> bool:
+        """True if a call may be made now. In the half open state only one trial call is allowed at a time."""
+        state = self.state
+        with self._lock:
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+        metrics.inc('circuit_breaker_rejections_total', breaker=self.name)
+        return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._trial_running = False
+            self._transition(CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = self.clock()
+                self._transition(OPEN)
+
+    def _release_trial(self) -> None:
+        with self._lock:
+            self._trial_running = False
+
+    def snapshot(self) -> Dict:
+        """This process's view of the breaker, for the /health endpoint."""
+        state = self.state
+        with self._lock:
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'retry_in': round(max(0.0, self._opened_at + self.reset_timeout - self.clock()), 1) if state == OPEN else 0.0,
+            }
+
+    def call(self, fn: Callable[[float], T], deadline: float, max_attempts: int = 3,
+             is_failure: Callable[[Exception], bool] = lambda e: True,
+             base_delay: float = 0.25, max_delay: float = 2.0,
+             on_retry: Optional[Callable[[Exception], None]] = None) -> T:
+        """
+        Calls fn(timeout) through the breaker, retrying failures with full-jitter
+        exponential backoff until max_attempts or the deadline runs out. fn is given the
+        time left before the deadline and must not take longer.
+
+        Args:
+            deadline: Seconds the whole call, retries and backoff included, may take
+            is_failure: Whether an exception means the upstream is unhealthy. Other
+                exceptions (e.g. a rejected request) are raised at once, without a retry,
+                and count as the upstream answering.
+
+        Raises:
+            CircuitOpenError: If the breaker was already open
+            DeadlineExceeded: If no time was left for another attempt
+            The last exception from fn otherwise
+        """
+        start = self.clock()
+        attempt = 0
+        while True:
+            if not self.allow_request():
+                raise CircuitOpenError(f"{self.name} circuit breaker is open")
+            remaining = deadline - (self.clock() - start)
+            if remaining <= 0:
+                self._release_trial()
+                raise DeadlineExceeded(f"{self.name} call ran out of time after {attempt} attempts")
+            try:
+                result = fn(remaining)
+            except Exception as e:
+                if not is_failure(e):
+                    self.record_success()
+                    raise
+                self.record_failure()
+                attempt += 1
+                delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+                if attempt >= max_attempts or self.state == OPEN or self.clock() - start + delay >= deadline:
+                    raise
+                error = e
+            else:
+                self.record_success()
+                return result
+            time.sleep(delay)
+            if on_retry is not None:
+                on_retry(error)
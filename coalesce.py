@@ -0,0 +1,175 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from typing import Any, Callable, Dict, Tuple
+
+import local_db
+import metrics
+
+# Local SQLite file shared by all gunicorn workers on the machine
+COALESCE_DB = os.environ.get("COALESCE_DB", os.path.join(tempfile.gettempdir(), "cognateful_coalesce.db"))
+# Both stay below gunicorn's worker timeout (30 s, see gunicorn_config.py), so a
+# follower is never killed while it waits on someone else's call. A leader's scoring
+# call takes at most app.LLM_DEADLINE (12 s), so a follower that gives up waiting
+# still has time to make the call itself.
+LEASE_SECONDS = 25.0  # How long a leader may hold a key before another caller takes over
+FOLLOWER_WAIT = 15.0  # How long a follower waits before making the call itself
+RESULT_TTL = 10.0  # How long a successful result is handed to identical requests that arrive late
+POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 0.25
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inflight (
+    key TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL,
+    result TEXT
+);
+"""
+
+class CoalescedError(Exception):
+    """The shared call failed; raised in every caller that was waiting on it."""
+
+def normalize_text(text: str) -> str:
+    """Casefolds text and collapses whitespace and trailing punctuation, so trivially different inputs share a call."""
+    text = re.sub(r"\s+", " ", text.casefold()).strip()
+    return re.sub(r"[\s.!?]+$", "", text)
+
+def make_key(namespace: str, parts: Tuple[str, ...]) -> str:
+    payload = json.dumps([namespace] + [normalize_text(part) for part in parts], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _get_connection() -> sqlite3.Connection:
+    return local_db.get_connection(COALESCE_DB, SCHEMA)
+
+def _try_acquire(conn: sqlite3.Connection, key: str, now: float) -> bool:
+    """Makes this caller the leader for key, unless a live call or a fresh result already exists."""
+    conn.execute("DELETE FROM inflight WHERE COALESCE(finished, started) < ?", (now - LEASE_SECONDS * 10,))
+    if conn.execute(
+        "INSERT OR IGNORE INTO inflight (key, status, started) VALUES (?, 'pending', ?)", (key, now)
+    ).rowcount == 1:
+        return True
+    # Take over keys whose leader died, whose call failed or whose result has gone stale.
+    # Errors are never cached: only followers already waiting on a failed call see it.
+    return conn.execute(
+        "UPDATE inflight SET status = 'pending', started = ?, finished = NULL, result = NULL "
+        "WHERE key = ? AND ((status = 'pending' AND started < ?) OR status = 'error' "
+        "OR (status = 'done' AND finished < ?))",
+        (now, key, now - LEASE_SECONDS, now - RESULT_TTL)
+    ).rowcount == 1
+
+def _wait_for_result(conn: sqlite3.Connection, key: str) -> Tuple[bool, Any]:
+    """
+    Polls until the leader for key finishes.
+
+    Returns:
+        (True, result) once it is done, or (False, None) if the leader gave up or
+        FOLLOWER_WAIT ran out
+    """
+    interval = POLL_INTERVAL
+    deadline = time.time() + FOLLOWER_WAIT
+    while time.time() < deadline:
+        row = conn.execute("SELECT status, result FROM inflight WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return False, None
+        status, result = row
+        if status == 'done':
+            return True, json.loads(result)
+        if status == 'error':
+            raise CoalescedError(result)
+        time.sleep(interval)
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+    return False, None
+
+def _run_across_workers(key: str, fn: Callable[[], Any]) -> Any:
+    conn = _get_connection()
+    if not _try_acquire(conn, key, time.time()):
+        done, result = _wait_for_result(conn, key)
+        if done:
+            metrics.inc('coalesced_requests_total', role='follower')
+            return result
+        if not _try_acquire(conn, key, time.time()):
+            # The leader is still busy and we can't wait any longer, so make the call ourselves
+            metrics.inc('coalesced_requests_total', role='uncoalesced')
+            return fn()
+
+    metrics.inc('coalesced_requests_total', role='leader')
+    finished = False
+    try:
+        result = fn()
+        conn.execute(
+            "UPDATE inflight SET status = 'done', finished = ?, result = ? WHERE key = ?",
+            (time.time(), json.dumps(result, ensure_ascii=False), key)
+        )
+        finished = True
+        return result
+    except Exception as e:
+        conn.execute(
+            "UPDATE inflight SET status = 'error', finished = ?, result = ? WHERE key = ?",
+            (time.time(), f"{type(e).__name__}: {e}", key)
+        )
+        finished = True
+        raise
+    finally:
+        if not finished:
+            # Interrupted (e.g. the worker is being shut down): release the key right away
+            # instead of leaving it pending until the lease expires
+            conn.execute("DELETE FROM inflight WHERE key = ? AND status = 'pending'", (key,))
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+_calls: Dict[str, _Call] = {}
+_calls_pid = os.getpid()
+_calls_lock = threading.Lock()
+
+def single_flight(namespace: str, parts: Tuple[str, ...], fn: Callable[[], Any]) -> Any:
+    """
+    Runs fn once for all concurrent callers with the same namespace and normalized parts.
+
+    Threads in the same process wait on the in-process call; other processes find the
+    call in the shared SQLite store and poll it for the result. Either way a caller
+    waits at most FOLLOWER_WAIT before making the call itself. fn must return a
+    JSON-serializable value. If it raises, every waiting caller gets a CoalescedError.
+    """
+    global _calls, _calls_pid
+    key = make_key(namespace, parts)
+    with _calls_lock:
+        if _calls_pid != os.getpid():
+            # Calls in flight in the parent at fork time will never finish here
+            _calls, _calls_pid = {}, os.getpid()
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+
+    if not leader:
+        if not call.done.wait(FOLLOWER_WAIT):
+            # Same as across workers: the leader is still busy, so make the call ourselves
+            metrics.inc('coalesced_requests_total', role='uncoalesced')
+            return fn()
+        metrics.inc('coalesced_requests_total', role='follower')
+        if call.error is not None:
+            raise CoalescedError(str(call.error))
+        return call.result
+
+    try:
+        call.result = _run_across_workers(key, fn)
+        return call.result
+    except BaseException as e:
+        # Including interruptions, so followers never mistake a missing result for None
+        call.error = e
+        raise
+    finally:
+        with _calls_lock:
+            _calls.pop(key, None)
+        call.done.set()
@@ -0,0 +1,173 @@
+import os
+import re
+import csv
+import json
+import random
+import zlib
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+STORIES_DIR = "batch_stories"
+RAW_CSV_DIR = "data/raw_data_for_finetune_uncleaned"
+
+SHINGLE_SIZE = 5  # Character n-gram length used for shingling
+NUM_BANDS = 8
+ROWS_PER_BAND = 4  # 8 bands x 4 rows ~= 0.6 Jaccard detection threshold for LSH candidates
+NUM_PERMUTATIONS = NUM_BANDS * ROWS_PER_BAND
+DUPLICATE_THRESHOLD = 0.8  # Jaccard similarity above which two sentences count as duplicates
+
+# Shingle hashes are permuted by XOR with fixed random masks. This is much cheaper than
+# (a * h + b) % p in pure Python and keeps a query well under a millisecond; candidates
+# are confirmed with the exact Jaccard similarity, so the weaker permutations cost nothing.
+_rng = random.Random(2025)
+_MASKS = [_rng.getrandbits(32) for _ in range(NUM_PERMUTATIONS)]
+
+def normalize_sentence(sentence: str) -> str:
+    """Lowercases a sentence and collapses punctuation and whitespace."""
+    sentence = re.sub(r"[^\w\s']", " ", sentence.lower())
+    return re.sub(r"\s+", " ", sentence).strip()
+
+def shingle_hashes(sentence: str) -> Set[int]:
+    """Returns the set of 32-bit hashes of the character shingles of a sentence."""
+    text = normalize_sentence(sentence)
+    if len(text) <= SHINGLE_SIZE:
+        return {zlib.crc32(text.encode('utf-8'))}
+    return {
+        zlib.crc32(text[i:i + SHINGLE_SIZE].encode('utf-8'))
+        for i in range(len(text) - SHINGLE_SIZE + 1)
+    }
+
+def minhash_signature(hashes: Set[int]) -> Tuple[int, ...]:
+    """Computes the MinHash signature of a set of shingle hashes."""
+    return tuple(min(map(mask.__xor__, hashes)) for mask in _MASKS)
+
+def jaccard(a: Set[int], b: Set[int]) -> float:
+    return len(a & b) / len(a | b)
+
+class NearDuplicateIndex:
+    """
+    MinHash/LSH index over sentences.
+
+    Sentences are split into character shingles, reduced to a MinHash signature and
+    bucketed by band. A query only compares against sentences that share at least one
+    band bucket, so lookups stay constant-time as the corpus grows.
+    """
+
+    def __init__(self, threshold: float = DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        self.sentences: List[str] = []
+        self.shingles: List[Set[int]] = []
+        self.buckets: List[Dict[Tuple[int, ...], List[int]]] = [defaultdict(list) for _ in range(NUM_BANDS)]
+
+    def __len__(self) -> int:
+        return len(self.sentences)
+
+    def _bands(self, signature: Tuple[int, ...]) -> Iterable[Tuple[int, Tuple[int, ...]]]:
+        for band in range(NUM_BANDS):
+            yield band, signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+
+    def _find(self, hashes: Set[int], signature: Tuple[int, ...]) -> Optional[Tuple[str, float]]:
+        seen = set()
+        best = None
+        for band, key in self._bands(signature):
+            for idx in self.buckets[band].get(key, ()):
+                if idx in seen:
+                    continue
+                seen.add(idx)
+                similarity = jaccard(hashes, self.shingles[idx])
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (self.sentences[idx], similarity)
+        return best
+
+    def find_duplicate(self, sentence: str) -> Optional[Tuple[str, float]]:
+        """
+        Looks up the closest near-duplicate of a sentence already in the index.
+
+        Returns:
+            (matching_sentence, similarity), or None if nothing is above the threshold
+        """
+        hashes = shingle_hashes(sentence)
+        return self._find(hashes, minhash_signature(hashes))
+
+    def is_duplicate(self, sentence: str) -> bool:
+        return self.find_duplicate(sentence) is not None
+
+    def add(self, sentence: str) -> bool:
+        """
+        Adds a sentence to the index unless a near-duplicate is already present.
+
+        Returns:
+            True if the sentence was added, False if it was rejected as a duplicate
+        """
+        hashes = shingle_hashes(sentence)
+        signature = minhash_signature(hashes)
+        if self._find(hashes, signature) is not None:
+            return False
+        idx = len(self.sentences)
+        self.sentences.append(sentence)
+        self.shingles.append(hashes)
+        for band, key in self._bands(signature):
+            self.buckets[band][key].append(idx)
+        return True
+
+    def filter_new(self, sentences: List[str]) -> List[str]:
+        """Adds each sentence in turn and returns the ones that were not duplicates."""
+        return [sentence for sentence in sentences if self.add(sentence)]
+
+def iter_story_sentences(stories_dir: str = STORIES_DIR) -> Iterable[Tuple[str, str]]:
+    """Yields (source, sentence) for every sentence in the generated story files."""
+    for filename in sorted(os.listdir(stories_dir)):
+        if not filename.endswith('.json'):
+            continue
+        with open(os.path.join(stories_dir, filename), 'r', encoding='utf-8') as f:
+            story_data = json.load(f)
+        for sentence_data in story_data.get('story', []):
+            yield filename, sentence_data['sentence']
+
+def iter_csv_sentences(csv_dir: str = RAW_CSV_DIR) -> Iterable[Tuple[str, str]]:
+    """Yields (source, sentence) for the first column of every beam-search CSV."""
+    for filename in sorted(os.listdir(csv_dir)):
+        if not filename.endswith('.csv'):
+            continue
+        with open(os.path.join(csv_dir, filename), 'r', encoding='utf-8') as f:
+            first_line = f.readline()
+            f.seek(0)
+            delimiter = '\t' if '\t' in first_line else ','
+            for row in csv.reader(f, delimiter=delimiter):
+                if not row or not row[0].strip() or row[0].strip().lower() == 'sentence':
+                    continue
+                yield filename, row[0].strip()
+
+def build_index(stories_dir: str = STORIES_DIR) -> NearDuplicateIndex:
+    """Builds an index over all sentences in the story corpus, for use by the generators."""
+    index = NearDuplicateIndex()
+    for _, sentence in iter_story_sentences(stories_dir):
+        index.add(sentence)
+    return index
+
+def dedupe_corpus(sources: Iterable[Tuple[str, str]], threshold: float = DUPLICATE_THRESHOLD) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str, str]]]:
+    """
+    Batch dedupe over a corpus of (source, sentence) pairs.
+
+    Returns:
+        kept: (source, sentence) pairs that are not near-duplicates of an earlier sentence
+        duplicates: (source, sentence, matching_sentence) for every rejected sentence
+    """
+    index = NearDuplicateIndex(threshold)
+    kept, duplicates = [], []
+    for source, sentence in sources:
+        match = index.find_duplicate(sentence)
+        if match is None:
+            index.add(sentence)
+            kept.append((source, sentence))
+        else:
+            duplicates.append((source, sentence, match[0]))
+    return kept, duplicates
+
+if __name__ == "__main__":
+    import itertools
+
+    kept, duplicates = dedupe_corpus(itertools.chain(iter_story_sentences(), iter_csv_sentences()))
+    for source, sentence, match in duplicates:
+        print(f"[{source}] {sentence}\n    ~ {match}")
+    print(f"\nKept {len(kept)} sentences, found {len(duplicates)} near-duplicates")
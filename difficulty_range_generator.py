@@ -5,27 +5,45 @@ import json
 import random
 import math
 from utils import *
+from dedupe import NearDuplicateIndex, iter_story_sentences
+import profiling
+from response_parsing import parse_json, summary as parse_summary
+from generation_planner import GenerationPlanner
+from story_db import language_from_args
 
 client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
 language_codes = {
-    'fr': 'French'
+    'fr': 'French',
+    'es': 'Spanish',
+    'it': 'Italian'
 }
 SENTENCE_GENERATION_MODEL = 'gpt-4o'
 SENTENCE_SCORING_MODEL = 'o1-preview' # 'o1' doesn't work for some reason
 data_directory = 'batch_stories_4o_generate_o1_score'
+corpus_directories = ['batch_stories', data_directory]
+MAX_DUPLICATE_FRACTION = 0.2  # Stories with more near-duplicate sentences than this are regenerated
+MAX_GENERATION_ATTEMPTS = 3
 
-def gpt_scored_rubric_batch(sentences):
-    '''
-    Score multiple French sentences at once using GPT-4.
+_dedupe_index = None
 
-    Args:
-        sentences: List of sentences to score
-    Returns:
-        List of scoring results
-    '''
+def get_dedupe_index():
+    """Builds the near-duplicate index over the existing corpus on first use."""
+    global _dedupe_index
+    if _dedupe_index is None:
+        _dedupe_index = NearDuplicateIndex()
+        for directory in corpus_directories:
+            if os.path.isdir(directory):
+                for _, sentence in iter_story_sentences(directory):
+                    _dedupe_index.add(sentence)
+    return _dedupe_index
 
-    system_prompt = f"""
-    You are an expert in French to English translation. I will give you {len(sentences)} sentences in French, and I want you to score each of them on a scale from 0-3 using the following rubric:
+def rubric_prompt(sentences, lang_code='fr'):
+    '''
+    The 0-3 rubric prompt for scoring a batch of sentences. Also used by
+    rescore_stories.py, so that re-scored stories are graded exactly like new ones.
+    '''
+    return f"""
+    You are an expert in {language_codes[lang_code]} to English translation. I will give you {len(sentences)} sentences in {language_codes[lang_code]}, and I want you to score each of them on a scale from 0-3 using the following rubric:
 
     0: Completely unintelligible to English speakers.
     Example: "Je veux manger du pain."
@@ -61,21 +79,27 @@ def gpt_scored_rubric_batch(sentences):
     Note: Please do not include Markdown formatting tags (```) in your response, as my parser will not be able to interpret them.
     """
 
+def gpt_scored_rubric_batch(sentences, lang_code='fr', model=SENTENCE_SCORING_MODEL):
+    '''
+    Score multiple sentences at once using GPT-4.
+
+    Args:
+        sentences: List of sentences to score
+        lang_code: Language of the sentences ('fr' for French)
+        model: Scoring model to use
+    Returns:
+        List of scoring results
+    '''
     completion = client.chat.completions.create(
-        model=SENTENCE_SCORING_MODEL,
+        model=model,
         messages=[
-            {'role': 'user', 'content': system_prompt}
+            {'role': 'user', 'content': rubric_prompt(sentences, lang_code)}
         ],
         temperature=1
     )
     
-    response_text = completion.choices[0].message.content.strip()
-    try:
-        results = json.loads(response_text)
-        return results
-    except json.JSONDecodeError:
-        print("Error: Failed to decode JSON from the response.")
-        raise
+    # o1-preview has no JSON mode, so formatting slips are repaired locally
+    return parse_json(completion.choices[0].message.content, expect=list, length=len(sentences), source='score_batch')
 
 def generate_story(lang_code, num_sentences, target_difficulty):
     system_prompt = f"""
@@ -123,26 +147,29 @@ def generate_story(lang_code, num_sentences, target_difficulty):
     )
     
     # Parse generated sentences
-    return json.loads(response.choices[0].message.content)
+    return parse_json(response.choices[0].message.content, expect=list, length=num_sentences, source='generate_story')
 
-def generate_story_batch(lang_code, story_length):
+def generate_story_batch(lang_code, story_length, target_difficulty=None):
     """
     Generate a story consisting of story_length sentences.
 
     Args:
         lang_code (str): Language code ('fr' for French)
         story_length (int): Target number of sentences in the story
+        target_difficulty (int): Difficulty to aim for, usually from GenerationPlanner;
+            picked at random if None
 
     Returns:
-        tuple: (story_data dictionary, output_filename)
+        tuple: (story_data dictionary, output_filename), or (None, None) if every
+        attempt produced a story with too many near-duplicates of the existing corpus
     """
 
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     output_file = f'{data_directory}/{lang_code}_batch_story_{timestamp}.json'
 
     # Initialize story data structure
-    #target_difficulty = random.randint(0, 3)
-    target_difficulty = random.choice([0, 1, 2, 3, 3, 3])
+    if target_difficulty is None:
+        target_difficulty = random.choice([0, 1, 2, 3, 3, 3])
     story_data = {
         'story': [],
         'metadata': {
@@ -157,10 +184,20 @@ def generate_story_batch(lang_code, story_length):
         }
     }
 
-    sentences = generate_story(lang_code, story_length, target_difficulty)
+    # The sentences form one narrative, so instead of dropping individual sentences we
+    # regenerate the whole story when it repeats too much of the corpus, before paying to score it
+    dedupe_index = get_dedupe_index()
+    for attempt in range(MAX_GENERATION_ATTEMPTS):
+        sentences = generate_story(lang_code, story_length, target_difficulty)
+        num_duplicates = sum(1 for item in sentences if dedupe_index.is_duplicate(item['sentence']))
+        if num_duplicates <= MAX_DUPLICATE_FRACTION * len(sentences):
+            break
+        print(f"{num_duplicates}/{len(sentences)} sentences are near-duplicates of the corpus, regenerating story.")
+    else:
+        return None, None
 
     sentences_to_score = [item['sentence'] for item in sentences]
-    score_results = gpt_scored_rubric_batch(sentences_to_score)
+    score_results = gpt_scored_rubric_batch(sentences_to_score, lang_code)
 
     # Combine generation and scoring data
     timestamp = datetime.datetime.now().isoformat()
@@ -185,16 +222,37 @@ def generate_story_batch(lang_code, story_length):
     
     with open(output_file, 'w', encoding='utf-8') as f:
         json.dump(story_data, f, ensure_ascii=False, indent=2)
+
+    # Only saved sentences become part of the corpus that new stories are checked against
+    for sentence_data in story_data['story']:
+        dedupe_index.add(sentence_data['sentence'])
     
     return story_data, output_file
 
 # New main function for story generation
+# Pass --profile (or set COGNATEFUL_PROFILE=1) to write a collapsed-stack profile of the run,
+# and --lang=es or --lang=it to generate Spanish or Italian stories
 if __name__ == "__main__":
-    for _ in range(40):
-        print("Generating new story batch...")
-        story_data, output_file = generate_story_batch(
-            lang_code='fr',
-            story_length=10
-        )
-        print(f"\nStory batch generated and saved to: {output_file}")
-        print("Story metadata:", story_data['metadata'])
+    import sys
+    lang_code = language_from_args(sys.argv[1:])
+
+    # Aim each story at the difficulty band where learners are most often served a
+    # story far from their level (see generation_planner.py)
+    planner = GenerationPlanner.load(corpus_directories, language=lang_code)
+    print(planner.report())
+    with profiling.profile_run('difficulty_range_generator'):
+        for _ in range(40):
+            target_difficulty = planner.next_target()
+            print(f"Generating new story batch at difficulty {target_difficulty}...")
+            story_data, output_file = generate_story_batch(
+                lang_code=lang_code,
+                story_length=10,
+                target_difficulty=target_difficulty
+            )
+            if story_data is None:
+                continue
+            planner.add_story(story_data['metadata']['actual_difficulty_mean'])
+            print(f"\nStory batch generated and saved to: {output_file}")
+            print("Story metadata:", story_data['metadata'])
+    # How many answers needed repairs or were unusable
+    print(parse_summary())
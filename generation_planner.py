@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import local_db
+from story_db import DEFAULT_LANGUAGE, language_from_args, story_language
+
+# Writable SQLite file where the app records which difficulties learners asked for
+DEMAND_DB = os.environ.get("DEMAND_DB", "demand.db")
+DEMAND_WINDOW_DAYS = 14.0  # Only recent selections count towards demand
+
+# Upper edges of the difficulty bands the planner balances; the last band includes 3.0
+BAND_EDGES = (0.5, 1.0, 1.5, 2.0, 2.5, 3.0)
+MISS_WEIGHT = 3.0  # A selection that had to fall back to a far-away story counts this many times
+GENERATION_TARGETS = (0, 1, 2, 3)  # The difficulty levels the generation prompt understands
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS selections (
+    created REAL NOT NULL,
+    language TEXT NOT NULL,
+    band INTEGER NOT NULL,
+    missed INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_selections_language_created ON selections(language, created);
+"""
+
+def band_of(difficulty: float) -> int:
+    for band, edge in enumerate(BAND_EDGES):
+        if difficulty < edge:
+            return band
+    return len(BAND_EDGES) - 1
+
+def band_label(band: int) -> str:
+    low = BAND_EDGES[band - 1] if band > 0 else 0.0
+    return f"{low:.1f}-{BAND_EDGES[band]:.1f}"
+
+def band_midpoint(band: int) -> float:
+    low = BAND_EDGES[band - 1] if band > 0 else 0.0
+    return (low + BAND_EDGES[band]) / 2
+
+def _get_connection(db_path: str) -> sqlite3.Connection:
+    return local_db.get_connection(db_path, SCHEMA)
+
+def record_selection(target_difficulty: float, missed: bool, db_path: str = DEMAND_DB,
+                     language: str = DEFAULT_LANGUAGE) -> None:
+    """
+    Records one story selection, called by the app each time a learner starts a story.
+
+    Args:
+        missed: True if no unseen story was within tolerance of the target and the
+            selection fell back to the nearest one
+    """
+    _get_connection(db_path).execute(
+        "INSERT INTO selections (created, language, band, missed) VALUES (?, ?, ?, ?)",
+        (time.time(), language, band_of(target_difficulty), int(missed))
+    )
+
+def demand_by_band(db_path: str = DEMAND_DB, window_days: float = DEMAND_WINDOW_DAYS,
+                   language: str = DEFAULT_LANGUAGE) -> Tuple[List[int], List[int]]:
+    """
+    Returns:
+        (selections, misses): counts per band for language over the last window_days
+    """
+    selections = [0] * len(BAND_EDGES)
+    misses = [0] * len(BAND_EDGES)
+    if not os.path.exists(db_path):
+        return selections, misses
+    for band, count, missed in _get_connection(db_path).execute(
+        "SELECT band, COUNT(*), SUM(missed) FROM selections WHERE language = ? AND created >= ? GROUP BY band",
+        (language, time.time() - window_days * 86400)
+    ):
+        if 0 <= band < len(BAND_EDGES):
+            selections[band], misses[band] = count, missed or 0
+    return selections, misses
+
+def iter_story_difficulties(directories: Iterable[str], language: str = DEFAULT_LANGUAGE) -> Iterable[Tuple[Optional[float], float]]:
+    """Yields (target_difficulty, mean sentence score) for every story in language in the directories."""
+    for directory in directories:
+        if not os.path.isdir(directory):
+            continue
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith('.json'):
+                continue
+            with open(os.path.join(directory, filename), 'r', encoding='utf-8') as f:
+                story_data = json.load(f)
+            sentences = story_data.get('story', [])
+            metadata = story_data.get('metadata', {})
+            if not sentences or story_language(filename, metadata) != language:
+                continue
+            mean = sum(s['actual_score'] for s in sentences) / len(sentences)
+            yield metadata.get('target_difficulty'), mean
+
+class GenerationPlanner:
+    """
+    Decides which difficulty to generate next.
+
+    Each band's need is its recent demand (with misses weighted up) divided by the number
+    of stories it already has, so generation goes to the bands where learners are most
+    often served a story far from their level. With no demand recorded yet every band
+    counts as equally wanted, which fills the thinnest bands first.
+    """
+
+    def __init__(self, supply: List[int], selections: List[int], misses: List[int],
+                 calibration: Optional[Dict[int, float]] = None):
+        self.supply = list(supply)
+        self.selections = list(selections)
+        self.misses = list(misses)
+        # Mean score that stories generated for each prompt target actually ended up with
+        self.calibration = calibration or {}
+
+    @classmethod
+    def load(cls, story_directories: Iterable[str], db_path: str = DEMAND_DB,
+             language: str = DEFAULT_LANGUAGE) -> 'GenerationPlanner':
+        supply = [0] * len(BAND_EDGES)
+        totals: Dict[int, List[float]] = {}
+        for target, mean in iter_story_difficulties(story_directories, language):
+            supply[band_of(mean)] += 1
+            if target is not None:
+                total = totals.setdefault(int(target), [0.0, 0])
+                total[0] += mean
+                total[1] += 1
+        calibration = {target: total / count for target, (total, count) in totals.items()}
+        selections, misses = demand_by_band(db_path, language=language)
+        return cls(supply, selections, misses, calibration)
+
+    def need(self, band: int) -> float:
+        demand = self.selections[band] + MISS_WEIGHT * self.misses[band] + 1
+        return demand / (self.supply[band] + 1)
+
+    def next_band(self) -> int:
+        return max(range(len(BAND_EDGES)), key=lambda band: (self.need(band), -self.supply[band]))
+
+    def generation_target(self, band: int) -> int:
+        """
+        The prompt target most likely to produce a story in band. Generated stories tend
+        to score away from their target, so this uses how past targets actually scored.
+        """
+        midpoint = band_midpoint(band)
+        return min(
+            GENERATION_TARGETS,
+            key=lambda target: abs(self.calibration.get(target, target) - midpoint)
+        )
+
+    def next_target(self) -> int:
+        return self.generation_target(self.next_band())
+
+    def add_story(self, mean_difficulty: float) -> None:
+        """Counts a newly generated story, so the next pick accounts for it."""
+        self.supply[band_of(mean_difficulty)] += 1
+
+    def plan(self, count: int) -> List[int]:
+        """Schedules count generations, assuming each story lands in the band it was aimed at."""
+        planned = GenerationPlanner(self.supply, self.selections, self.misses, self.calibration)
+        targets = []
+        for _ in range(count):
+            band = planned.next_band()
+            targets.append(planned.generation_target(band))
+            planned.supply[band] += 1
+        return targets
+
+    def report(self) -> str:
+        lines = [f"{'band':<10}{'stories':>8}{'selections':>12}{'misses':>8}{'need':>8}"]
+        for band in range(len(BAND_EDGES)):
+            lines.append(
+                f"{band_label(band):<10}{self.supply[band]:>8}{self.selections[band]:>12}"
+                f"{self.misses[band]:>8}{self.need(band):>8.2f}"
+            )
+        return '\n'.join(lines)
+
+if __name__ == "__main__":
+    import sys
+
+    language = language_from_args(sys.argv[1:])
+    directories = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    planner = GenerationPlanner.load(['batch_stories'] + directories, language=language)
+    print(planner.report())
+    print(f"\nNext 10 generation targets: {planner.plan(10)}")
@@ -1,2 +1,25 @@
-bind = 0.0.0.0:8080
+import os
+import time
+import uuid
+
+bind = "0.0.0.0:8080"
 workers = 2
+# Kept explicit: coalesce.py keeps its follower waits below this
+timeout = 30
+
+# Import the app and load the story catalog once in the master. Workers are forked
+# from it with everything already in memory, so a (re)started worker is ready at once.
+preload_app = True
+raw_env = ["PRELOAD_CATALOG=1"]
+# Shared by every worker of this run, so /metrics only sums this run's snapshots
+os.environ.setdefault("METRICS_BOOT_ID", uuid.uuid4().hex[:12])
+
+def post_fork(server, worker):
+    worker.fork_time = time.perf_counter()
+
+def post_worker_init(worker):
+    worker.log.info("Worker %s ready in %.1f ms", worker.pid, (time.perf_counter() - worker.fork_time) * 1000)
+
+def child_exit(server, worker):
+    import metrics
+    metrics.remove_worker_snapshot(worker.pid)
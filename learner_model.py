@@ -0,0 +1,135 @@
+import os
+import math
+import time
+import sqlite3
+from typing import Dict, Optional
+
+import local_db
+from story_db import DEFAULT_LANGUAGE
+
+# Writable SQLite file shared by all gunicorn workers; the story catalog is read-only
+LEARNER_DB = os.environ.get("LEARNER_DB", "learners.db")
+
+# Abilities and sentence difficulties share the 0-3 scale of the sentence scores, where
+# 3 is the easiest. A learner's ability is the score of the sentences they currently
+# translate correctly TARGET_SUCCESS of the time, so it can be passed straight to the
+# story selection as the target difficulty.
+MIN_SCORE = 0.0
+MAX_SCORE = 3.0
+INITIAL_ABILITY = 3.0  # New learners start on the easiest stories, like the client does
+TARGET_SUCCESS = 0.75
+SLOPE = 2.0  # How quickly the chance of success changes per point of sentence score
+LEARNER_K = 0.6  # Learning rate for a new learner...
+MIN_LEARNER_K = 0.15  # ...shrinking towards this as they answer more
+SENTENCE_K = 0.05  # Sentence difficulties move slowly, since many learners share them
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS learners (
+    learner_id TEXT NOT NULL,
+    language TEXT NOT NULL,
+    ability REAL NOT NULL,
+    answers INTEGER NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (learner_id, language)
+);
+CREATE TABLE IF NOT EXISTS sentence_difficulty (
+    sentence TEXT NOT NULL,
+    language TEXT NOT NULL,
+    difficulty REAL NOT NULL,
+    answers INTEGER NOT NULL,
+    PRIMARY KEY (sentence, language)
+);
+"""
+# Bumped when SCHEMA changes incompatibly. Version 2 keys sentence_difficulty by language
+# too; the version 1 table is dropped, and the catalog scores are used until it is relearned.
+SCHEMA_VERSION = 2
+
+_TARGET_LOGIT = math.log(TARGET_SUCCESS / (1 - TARGET_SUCCESS))
+
+def success_probability(ability: float, difficulty: float) -> float:
+    """Chance that a learner of this ability translates a sentence of this score correctly."""
+    return 1 / (1 + math.exp(-(SLOPE * (difficulty - ability) + _TARGET_LOGIT)))
+
+def learner_k(answers: int) -> float:
+    return max(MIN_LEARNER_K, LEARNER_K / (1 + answers / 10))
+
+def _clamp(value: float) -> float:
+    return min(MAX_SCORE, max(MIN_SCORE, value))
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            conn.execute("DROP TABLE IF EXISTS sentence_difficulty")
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def _get_connection(db_path: str) -> sqlite3.Connection:
+    return local_db.get_connection(db_path, SCHEMA, _migrate)
+
+def get_ability(learner_id: str, db_path: str = LEARNER_DB, language: str = DEFAULT_LANGUAGE) -> Optional[float]:
+    """Returns the estimated ability of a learner in a language, or None if they haven't answered anything in it yet."""
+    row = _get_connection(db_path).execute(
+        "SELECT ability FROM learners WHERE learner_id = ? AND language = ?", (learner_id, language)
+    ).fetchone()
+    return None if row is None else row[0]
+
+def record_answer(learner_id: str, sentence: str, catalog_score: Optional[float], correct: bool,
+                  db_path: str = LEARNER_DB, language: str = DEFAULT_LANGUAGE) -> Dict:
+    """
+    Updates the learner's ability and the sentence's difficulty after one answer, Elo
+    style: both move by how surprising the outcome was. A correct answer on a sentence
+    the learner was expected to miss lowers their ability score the most (towards
+    harder sentences) and raises the sentence's score (it is easier than rated).
+
+    Two primary-key lookups and two upserts in one transaction, so this is cheap
+    enough to run on every scoring request.
+
+    Args:
+        catalog_score: The sentence's score in the catalog, used until learners' answers
+            have been recorded for it. None for sentences that aren't in the catalog,
+            in which case only the learner is updated.
+        language: Abilities and sentence difficulties are kept per language, since
+            knowing French says little about how well someone reads Italian
+
+    Returns:
+        {"ability", "answers", "expected"} for the learner after the update
+    """
+    conn = _get_connection(db_path)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT ability, answers FROM learners WHERE learner_id = ? AND language = ?", (learner_id, language)
+        ).fetchone()
+        ability, answers = row if row is not None else (INITIAL_ABILITY, 0)
+        difficulty = None
+        if catalog_score is not None:
+            row = conn.execute(
+                "SELECT difficulty FROM sentence_difficulty WHERE sentence = ? AND language = ?", (sentence, language)
+            ).fetchone()
+            difficulty = row[0] if row is not None else catalog_score
+
+        # Sentences outside the catalog are assumed to sit right at the learner's level
+        expected = success_probability(ability, ability if difficulty is None else difficulty)
+        surprise = (1.0 if correct else 0.0) - expected
+        ability = _clamp(ability - learner_k(answers) * surprise)
+        conn.execute(
+            "INSERT INTO learners (learner_id, language, ability, answers, updated) VALUES (?, ?, ?, 1, ?) "
+            "ON CONFLICT(learner_id, language) DO UPDATE SET ability = excluded.ability, answers = answers + 1, "
+            "updated = excluded.updated",
+            (learner_id, language, ability, time.time())
+        )
+        if difficulty is not None:
+            conn.execute(
+                "INSERT INTO sentence_difficulty (sentence, language, difficulty, answers) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT(sentence, language) DO UPDATE SET difficulty = excluded.difficulty, answers = answers + 1",
+                (sentence, language, _clamp(difficulty + SENTENCE_K * surprise))
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return {'ability': ability, 'answers': answers + 1, 'expected': expected}
@@ -0,0 +1,38 @@
+import os
+import sqlite3
+import threading
+from typing import Callable, Optional
+
+# Helpers for the small writable SQLite files the gunicorn workers share (learner
+# abilities, story demand, coalesced calls). The story catalog is read-only and has its
+# own connections in story_db.
+
+_local = threading.local()
+
+def get_connection(db_path: str, schema: str,
+                   migrate: Optional[Callable[[sqlite3.Connection], None]] = None) -> sqlite3.Connection:
+    """
+    Returns this thread's connection to db_path, opening it in WAL mode and creating
+    schema on first use.
+
+    Connections are never reused across a fork, so each gunicorn worker opens its own.
+    They are in autocommit mode: callers that need a transaction issue BEGIN themselves.
+
+    Args:
+        migrate: Called with the new connection before schema is applied, to upgrade
+            databases written by older versions
+    """
+    conns = getattr(_local, 'conns', None)
+    if conns is None or getattr(_local, 'pid', None) != os.getpid():
+        conns = _local.conns = {}
+        _local.pid = os.getpid()
+    conn = conns.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if migrate is not None:
+            migrate(conn)
+        conn.executescript(schema)
+        conns[db_path] = conn
+    return conn
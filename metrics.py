@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import logging
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+from flask import Response, g, request
+
+# Set METRICS_DIR to a directory shared by the gunicorn workers to have /metrics report
+# totals across all of them. Without it each worker only reports its own numbers.
+METRICS_DIR = os.environ.get("METRICS_DIR")
+FLUSH_INTERVAL = 1.0  # Seconds between snapshots written to METRICS_DIR
+# Identifies one run of the server. gunicorn_config.py sets it in the master so all
+# workers share it; snapshots from earlier runs are ignored and deleted.
+BOOT_ID = os.environ.get("METRICS_BOOT_ID") or uuid.uuid4().hex[:12]
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    'http_request_duration_seconds': ('histogram', 'Request latency by route.'),
+    'stage_duration_seconds': ('histogram', 'Time spent in story loading and LLM calls, and until a scoring stream\'s first token.'),
+    'llm_calls_total': ('counter', 'LLM API calls by model and outcome.'),
+    'llm_retries_total': ('counter', 'Retries of failed LLM calls, within their deadline.'),
+    'llm_fallbacks_total': ('counter', 'Answers graded provisionally because the LLM call failed, by route and error.'),
+    'circuit_breaker_transitions_total': ('counter', 'Circuit breaker state changes, by the state entered.'),
+    'circuit_breaker_rejections_total': ('counter', 'Calls refused at once because the circuit breaker was open.'),
+    'llm_tokens_total': ('counter', 'OpenAI tokens by model and kind.'),
+    'errors_total': ('counter', 'Errors by where they happened.'),
+    'story_selections_total': ('counter', 'New stories served by difficulty band, and whether one was within tolerance.'),
+    'llm_parse_total': ('counter', 'Parsed LLM answers by call and outcome (ok, repaired or failed).'),
+    'llm_parse_repairs_total': ('counter', 'Local repairs applied to LLM answers before parsing, by kind.'),
+    'coalesced_requests_total': ('counter', 'Scoring requests that led, joined or gave up waiting on a shared LLM call.'),
+}
+
+request_logger = logging.getLogger('cognateful.requests')
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Labels], float] = {}
+_histograms: Dict[Tuple[str, Labels], List[float]] = {}  # bucket counts..., sum, count
+_last_flush = 0.0
+_attempts = threading.local()
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name: str, value: float, **labels) -> None:
+    key = (name, _labels(labels))
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0.0] * (len(LATENCY_BUCKETS) + 2)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                hist[i] += 1
+                break
+        hist[-2] += value
+        hist[-1] += 1
+
+def counter_values(name: str) -> Dict[Labels, float]:
+    """This process's values of one counter by labels, for scripts that print their own summary."""
+    with _lock:
+        return {labels: value for (metric, labels), value in _counters.items() if metric == name}
+
+def _request_stats() -> Dict:
+    """Per-request accumulators for the structured request log, or a throwaway dict outside a request."""
+    try:
+        stats = g.get('request_stats')
+    except RuntimeError:
+        return {}
+    return stats if stats is not None else {}
+
+@contextmanager
+def timer(stage: str):
+    """Times a block of work, e.g. `with timer('story_load'):` or `with timer('llm'):`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+def record_stage(stage: str, elapsed: float) -> None:
+    """Records time spent in a stage that timer can't wrap, e.g. a generator's work between its yields."""
+    observe('stage_duration_seconds', elapsed, stage=stage)
+    stats = _request_stats()
+    stats[f'{stage}_ms'] = stats.get(f'{stage}_ms', 0) + elapsed * 1000
+
+def record_llm_call(model: str, completion=None, error: Exception = None) -> None:
+    """Records the outcome, token usage and retries of one LLM API call."""
+    retries = max(0, getattr(_attempts, 'count', 1) - 1)
+    _attempts.count = 0
+    if retries:
+        inc('llm_retries_total', retries, model=model)
+    if error is not None:
+        inc('llm_calls_total', model=model, status='error')
+        inc('errors_total', where='llm', type=type(error).__name__)
+        return
+    inc('llm_calls_total', model=model, status='ok')
+    usage = getattr(completion, 'usage', None)
+    if usage is not None:
+        inc('llm_tokens_total', usage.prompt_tokens, model=model, kind='prompt')
+        inc('llm_tokens_total', usage.completion_tokens, model=model, kind='completion')
+        stats = _request_stats()
+        stats['llm_tokens'] = stats.get('llm_tokens', 0) + usage.total_tokens
+
+def instrumented_http_client():
+    """
+    The OpenAI SDK's default httpx client (keeping its timeouts, connection limits and
+    redirect handling) with a hook that counts HTTP attempts, so that any retries the
+    SDK makes show up in llm_retries_total. The app turns those off and retries through
+    its circuit breaker instead, which counts its own.
+    """
+    from openai import DefaultHttpxClient
+
+    def count_attempt(_request):
+        _attempts.count = getattr(_attempts, 'count', 0) + 1
+
+    return DefaultHttpxClient(event_hooks={'request': [count_attempt]})
+
+def _snapshot() -> Dict:
+    with _lock:
+        return {
+            'counters': [[name, list(labels), value] for (name, labels), value in _counters.items()],
+            'histograms': [[name, list(labels), list(hist)] for (name, labels), hist in _histograms.items()],
+        }
+
+def _flush(force: bool = False) -> None:
+    global _last_flush
+    now = time.monotonic()
+    if not METRICS_DIR or (not force and now - _last_flush < FLUSH_INTERVAL):
+        return
+    _last_flush = now
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = _snapshot_path(os.getpid())
+    with open(path + '.tmp', 'w') as f:
+        json.dump(_snapshot(), f)
+    os.replace(path + '.tmp', path)
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(METRICS_DIR, f'metrics_{BOOT_ID}_{pid}.json')
+
+def remove_worker_snapshot(pid: int) -> None:
+    """
+    Deletes the snapshot of a worker that has exited (called from gunicorn's child_exit
+    hook), so a restarted worker, or a new one that reuses the PID, starts from zero
+    instead of overwriting or being summed with the old counts.
+    """
+    if not METRICS_DIR:
+        return
+    try:
+        os.remove(_snapshot_path(pid))
+    except FileNotFoundError:
+        pass
+
+def _collect() -> Tuple[Dict, Dict]:
+    """Merges the snapshots of all workers (or just this one without METRICS_DIR)."""
+    snapshots = []
+    if METRICS_DIR:
+        _flush(force=True)
+        for filename in os.listdir(METRICS_DIR):
+            if not filename.startswith('metrics_') or not filename.endswith('.json'):
+                continue
+            path = os.path.join(METRICS_DIR, filename)
+            try:
+                if not filename.startswith(f'metrics_{BOOT_ID}_'):
+                    # Left over from an earlier run of the server
+                    os.remove(path)
+                    continue
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    else:
+        snapshots.append(_snapshot())
+
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(tuple(label) for label in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, hist in snapshot['histograms']:
+            key = (name, tuple(tuple(label) for label in labels))
+            merged = histograms.setdefault(key, [0.0] * len(hist))
+            for i, value in enumerate(hist):
+                merged[i] += value
+    return counters, histograms
+
+def _escape_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape_label_value(v)}"' for k, v in items) + '}'
+
+def render() -> str:
+    """Renders all metrics in the Prometheus text exposition format."""
+    counters, histograms = _collect()
+    lines = []
+    names = sorted({name for name, _ in counters} | {name for name, _ in histograms})
+    for name in names:
+        kind, description = HELP.get(name, ('untyped', ''))
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f'{name}{_format_labels(labels)} {value:g}')
+        for (metric, labels), hist in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, hist):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, (("le", f"{bound:g}"),))} {cumulative:g}')
+            lines.append(f'{name}_bucket{_format_labels(labels, (("le", "+Inf"),))} {hist[-1]:g}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {hist[-2]:g}')
+            lines.append(f'{name}_count{_format_labels(labels)} {hist[-1]:g}')
+    return '\n'.join(lines) + '\n'
+
+def init_app(app) -> None:
+    """Adds per-request timing, a structured log line per request and the /metrics endpoint."""
+    if not request_logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        request_logger.addHandler(handler)
+        request_logger.setLevel(logging.INFO)
+        request_logger.propagate = False
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+        g.request_stats = {}
+
+    @app.after_request
+    def record_request(response):
+        start = g.get('request_start')
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        if route != '/metrics':
+            observe('http_request_duration_seconds', elapsed, route=route, method=request.method,
+                    status=response.status_code)
+            if response.status_code >= 500:
+                inc('errors_total', where='request', type=str(response.status_code))
+            request_logger.info(json.dumps({
+                'route': route,
+                'method': request.method,
+                'status': response.status_code,
+                'duration_ms': round(elapsed * 1000, 2),
+                **{k: round(v, 2) for k, v in g.request_stats.items()},
+            }))
+            _flush()
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        return Response(render(), mimetype='text/plain; version=0.0.4')
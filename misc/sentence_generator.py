@@ -1,10 +1,15 @@
 from openai import OpenAI
 import os
-import json
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from response_parsing import parse_json, try_parse_json, response_format
 
 client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
 language_codes = {
-    'fr': 'French'
+    'fr': 'French',
+    'es': 'Spanish',
+    'it': 'Italian'
 }
 SENTENCE_GENERATION_MODEL = 'gpt-4o-mini'
 SENTENCE_SCORING_MODEL = 'o1-preview'
@@ -56,11 +61,11 @@ def generate_sentence_no_context(lang_code):
         temperature=1.8,  # Much higher temperature for more variance
         top_p=0.95,      # Allow more diverse token selection
         frequency_penalty=0.3,
-        presence_penalty=1.0    # Maximum presence penalty to force diverse patterns
+        presence_penalty=1.0,    # Maximum presence penalty to force diverse patterns
+        **response_format(SENTENCE_GENERATION_MODEL)
     )
 
-    return [json.loads(choice.message.content) for choice in response.choices 
-            if is_valid_json(choice.message.content)]
+    return parse_choices(response.choices, 'generate_sentence')
 
 def generate_next_sentence(lang_code, existing_sentences):
     '''
@@ -72,7 +77,7 @@ def generate_next_sentence(lang_code, existing_sentences):
     2. Uses many cognate words that English speakers can recognize
     3. Maintains topical and tonal consistency with the previous text
 
-    Output format:
+    Respond with a JSON object in this output format:
     {{
         "sentence": "<The generated sentence>",
         "reasoning": "<Explanation of narrative continuity and cognate usage>",
@@ -106,28 +111,28 @@ def generate_next_sentence(lang_code, existing_sentences):
         temperature=1.3,  # Slightly higher for creative continuation
         top_p=0.9,
         frequency_penalty=0.3,  # Encourage vocabulary variation
-        presence_penalty=0.7    # Discourage repetition while maintaining coherence
+        presence_penalty=0.7,   # Discourage repetition while maintaining coherence
+        **response_format(SENTENCE_GENERATION_MODEL)
     )
 
-    return [json.loads(choice.message.content) for choice in response.choices 
-            if is_valid_json(choice.message.content)]
+    return parse_choices(response.choices, 'generate_next_sentence')
+
+def parse_choices(choices, source):
+    """Parses (and if needed repairs) each choice, skipping the ones that can't be used"""
+    results = [try_parse_json(choice.message.content, expect=dict, source=source) for choice in choices]
+    return [result for result in results if result is not None]
 
 def is_valid_json(content):
-    """Helper function to validate JSON output"""
-    try:
-        json.loads(content)
-        return True
-    except json.JSONDecodeError:
-        print(f"Invalid JSON output: {content}")
-        return False
-
-def gpt_scored_rubric_individual(sentence):
+    """Helper function to validate JSON output, after the same repairs parse_json applies"""
+    return try_parse_json(content) is not None
+
+def gpt_scored_rubric_individual(sentence, lang_code='fr'):
     '''
-    Given a single French sentence, let GPT-4 score it based on a rubric that assigns points between 0 and 3.
+    Given a single sentence in lang_code's language, let GPT-4 score it based on a rubric that assigns points between 0 and 3.
     Returns JSON output with the score, reasoning, and a list of cognate words for the sentence.
     '''
     system_prompt = f"""
-    You are an expert in French to English translation. I will give you one sentence in French, and I want you to assign one of the following scores to it:
+    You are an expert in {language_codes[lang_code]} to English translation. I will give you one sentence in {language_codes[lang_code]}, and I want you to assign one of the following scores to it:
 
     0: Completely unintelligible to English speakers.
     Example: "Je veux manger du pain."
@@ -173,9 +178,4 @@ def gpt_scored_rubric_individual(sentence):
     # Extract and parse the JSON response
     response_text = completion.choices[0].message.content.strip()
     print("Got a response from chatgpt!", response_text)
-    try:
-        result = json.loads(response_text)
-    except json.JSONDecodeError:
-        print("Error: Failed to decode JSON from the response.")
-        raise
-    return result
+    return parse_json(response_text, expect=dict, source='score_individual')
@@ -0,0 +1,155 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Optional, Set
+
+# Profiling is opt-in: set COGNATEFUL_PROFILE=1 (or pass --profile to the generators).
+# When disabled nothing is started and no request hooks are registered.
+PROFILE_ENABLED = os.environ.get("COGNATEFUL_PROFILE", "") not in ("", "0") or "--profile" in sys.argv
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.005"))  # Seconds between samples
+PROFILE_EVERY = int(os.environ.get("PROFILE_EVERY", "100"))  # Requests per output file in the web app
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _collapse(frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+class Sampler:
+    """
+    Wall-clock sampling profiler.
+
+    A background thread snapshots the stacks of the watched threads every interval
+    and counts them. Results are written in the collapsed-stack format
+    ("frame;frame;frame count"), which flamegraph.pl and speedscope both read.
+    """
+
+    def __init__(self, name: str, watched: Optional[Set[int]] = None, interval: float = PROFILE_INTERVAL):
+        self.name = name
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        # Thread idents to sample; None samples the main thread only
+        self.watched = watched
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        main_ident = threading.main_thread().ident
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                watched = {main_ident} if self.watched is None else set(self.watched)
+                if not watched:
+                    continue
+                frames: Dict[int, object] = sys._current_frames()
+                for ident in watched:
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        self.stacks[_collapse(frame)] += 1
+
+    def watch(self, ident: int) -> None:
+        with self._lock:
+            self.watched.add(ident)
+
+    def unwatch(self, ident: int) -> None:
+        with self._lock:
+            self.watched.discard(ident)
+
+    def write(self, path: str) -> None:
+        """Writes the collected stacks to path and resets the counts."""
+        with self._lock:
+            stacks, self.stacks = self.stacks, Counter()
+        if not stacks:
+            return
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"Profile written to {path}")
+
+def start_run(name: str) -> Optional[Sampler]:
+    """Starts profiling the main thread of a script if profiling is enabled."""
+    if not PROFILE_ENABLED:
+        return None
+    sampler = Sampler(name)
+    sampler.start()
+    return sampler
+
+def stop_run(sampler: Optional[Sampler]) -> None:
+    """Stops a profiler started with start_run and writes its output."""
+    if sampler is None:
+        return
+    sampler.stop()
+    timestamp = time.strftime("%Y%m%d_%H%M%S")
+    sampler.write(os.path.join(PROFILE_DIR, f"{sampler.name}_{timestamp}.collapsed"))
+
+@contextmanager
+def profile_run(name: str):
+    """Profiles the enclosed block, e.g. the main loop of a generator script."""
+    sampler = start_run(name)
+    try:
+        yield
+    finally:
+        stop_run(sampler)
+
+def init_app(app) -> None:
+    """
+    Profiles Flask request handling if profiling is enabled. Only threads that are
+    currently handling a request are sampled, and a file is written every
+    PROFILE_EVERY requests.
+    """
+    if not PROFILE_ENABLED:
+        return
+
+    from flask import g
+
+    state = {'sampler': None, 'pid': None, 'requests': 0, 'files': 0}
+    state_lock = threading.Lock()
+
+    def get_sampler() -> Sampler:
+        # The sampler thread doesn't survive a fork, so each worker starts its own
+        if state['pid'] != os.getpid():
+            state['sampler'] = Sampler('app', watched=set())
+            state['sampler'].start()
+            state['pid'] = os.getpid()
+            state['requests'] = 0
+        return state['sampler']
+
+    @app.before_request
+    def start_sampling():
+        with state_lock:
+            sampler = get_sampler()
+        sampler.watch(threading.get_ident())
+        g.profiling = True
+
+    @app.teardown_request
+    def stop_sampling(_exc):
+        if not g.get('profiling'):
+            return
+        with state_lock:
+            sampler = get_sampler()
+            sampler.unwatch(threading.get_ident())
+            state['requests'] += 1
+            if state['requests'] % PROFILE_EVERY != 0:
+                return
+            state['files'] += 1
+            path = os.path.join(PROFILE_DIR, f"app_{os.getpid()}_{state['files']:04d}.collapsed")
+        sampler.write(path)
@@ -0,0 +1,87 @@
+import re
+import difflib
+import unicodedata
+from typing import Dict, List, Optional, Set
+
+# Used by the app when the scoring LLM is unavailable. These grades are rough, so they
+# are marked provisional and never update the learner model.
+
+MIN_COVERAGE = 0.85  # Share of the reference's content words (or the cognates) a translation must keep
+COGNATE_SIMILARITY = 0.7  # difflib ratio above which an English word counts as the cognate's translation
+STEM_LENGTH = 4  # Words sharing this many leading letters count as the same word (want, wants, wanted)
+
+STOPWORDS = {
+    'a', 'an', 'the', 'to', 'of', 'and', 'or', 'in', 'on', 'at', 'for', 'with', 'by', 'from',
+    'is', 'are', 'was', 'were', 'be', 'been', 'it', 'its', 'this', 'that', 'there', 'do', 'does', 'did',
+}
+
+_WORD_RE = re.compile(r"\w+")
+
+def _fold(text: str) -> str:
+    """Lowercases and strips accents, so électrique and electric can be compared."""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+def _words(text: str) -> List[str]:
+    return _WORD_RE.findall(_fold(text))
+
+def _same_word(word: str, candidates: Set[str]) -> bool:
+    if word in candidates:
+        return True
+    return len(word) >= STEM_LENGTH and any(
+        len(candidate) >= STEM_LENGTH and candidate[:STEM_LENGTH] == word[:STEM_LENGTH] for candidate in candidates
+    )
+
+def _result(is_correct: bool, missing: List[str], reasoning: str) -> Dict:
+    return {
+        'is_correct': is_correct,
+        'incorrect_morphemes': [] if is_correct else missing,
+        'reasoning': reasoning,
+        'provisional': True,
+    }
+
+def grade_with_reference(translation: str, reference: Dict) -> Dict:
+    """
+    Grades a translation against a reference alignment: an alignment pair is missing
+    if none of its English content words appear in the translation.
+
+    Returns:
+        The same dict as app.llm_score_translation, plus "provisional": True
+    """
+    translated = set(_words(translation))
+    missing, checked = [], 0
+    for original, english in reference['alignment']:
+        content = [word for word in _words(english or '') if word not in STOPWORDS]
+        if not content:
+            continue
+        checked += 1
+        if not any(_same_word(word, translated) for word in content):
+            missing.append(original)
+    coverage = 1 - len(missing) / checked if checked else 1.0
+    return _result(coverage >= MIN_COVERAGE, missing, "Quick check against the reference translation while the grader is unavailable.")
+
+def _has_cognate(cognate: str, translated: Set[str]) -> bool:
+    # The longest part skips elisions, e.g. the "l" of "l'atmosphère"
+    word = max(_words(cognate), key=len, default='')
+    if not word:
+        return True
+    return _same_word(word, translated) or any(
+        difflib.SequenceMatcher(None, word, candidate).ratio() >= COGNATE_SIMILARITY for candidate in translated
+    )
+
+def grade_with_cognates(original: str, translation: str, cognate_words: Optional[List[str]]) -> Dict:
+    """
+    Grades a translation by whether it keeps the sentence's cognates, the words a
+    learner is expected to recognize. Without known cognates, only checks that the
+    translation is of a plausible length.
+
+    Returns:
+        The same dict as app.llm_score_translation, plus "provisional": True
+    """
+    translated = set(_words(translation))
+    if cognate_words:
+        missing = [cognate for cognate in cognate_words if not _has_cognate(cognate, translated)]
+        is_correct = 1 - len(missing) / len(cognate_words) >= MIN_COVERAGE
+        return _result(is_correct, missing, "Quick check of the cognates while the grader is unavailable.")
+    ratio = len(_words(translation)) / max(1, len(_words(original)))
+    return _result(0.5 <= ratio <= 2.0, [], "Quick length check while the grader is unavailable.")
@@ -0,0 +1,122 @@
+import os
+import sys
+import json
+from typing import Dict, List, Optional
+
+from openai import OpenAI
+
+from response_parsing import ResponseParseError, parse_json
+from story_db import DEFAULT_LANGUAGE, LANGUAGES, story_language, write_story_file
+
+STORIES_DIR = "batch_stories"
+REFERENCE_MODEL = 'gpt-4o'  # Runs once per sentence offline, so use the strong model here
+
+client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+
+def reference_prompt(sentences: List[str], language: str = DEFAULT_LANGUAGE) -> str:
+    name = LANGUAGES[language]
+    return f"""
+    You are an expert in {name}-English translation. I will give you {len(sentences)} {name} sentences from a short story, as a JSON array. For each sentence, give a natural English translation and an alignment between the {name} words and the English words they were translated as.
+
+    For each sentence, provide a JSON object with these fields:
+    {{
+      "sentence": "<The {name} sentence, unchanged>",
+      "translation": "<A natural English translation>",
+      "alignment": [A list of ["<{name} word or group of words>", "<English words it corresponds to>"] pairs, covering the {name} sentence from left to right. Every {name} part must be a character-for-character match from the sentence. Use "" as the English part for {name} words that have no English counterpart.]
+    }}
+
+    Example: for the French sentence "Voulez-vous aller manger avec moi ?" you would respond with
+    {{"sentence": "Voulez-vous aller manger avec moi ?", "translation": "Do you want to go eat with me?", "alignment": [["Voulez", "Do ... want"], ["vous", "you"], ["aller", "to go"], ["manger", "eat"], ["avec", "with"], ["moi", "me"]]}}
+
+    Please format your response as a JSON array of these objects, in the same order as the input. You should have {len(sentences)} objects in your array.
+
+    Here are the sentences:
+    {json.dumps(sentences, ensure_ascii=False)}
+    Note: Please do not include Markdown formatting tags (```) in your response, as my parser will not be able to interpret them.
+    """
+
+def clean_alignment(sentence: str, alignment) -> Optional[List[List[str]]]:
+    """
+    Keeps the alignment pairs whose original-language part really occurs in the sentence, since the
+    app highlights those parts as wrongMorphemes. Returns None if nothing usable is left.
+    """
+    if not isinstance(alignment, list):
+        return None
+    cleaned = [
+        [pair[0], pair[1] or '']
+        for pair in alignment
+        if isinstance(pair, list) and len(pair) == 2 and isinstance(pair[0], str) and pair[0] and pair[0] in sentence
+    ]
+    return cleaned or None
+
+def translate_sentences(sentences: List[str], language: str = DEFAULT_LANGUAGE) -> List[Optional[Dict]]:
+    """
+    Asks the model for a reference translation and alignment of each sentence, all in language.
+
+    Returns:
+        One {"reference_translation", "alignment"} dict per sentence, or None where the
+        model's answer for that sentence was unusable
+    """
+    completion = client.chat.completions.create(
+        model=REFERENCE_MODEL,
+        messages=[
+            {'role': 'user', 'content': reference_prompt(sentences, language)}
+        ],
+        temperature=0
+    )
+    try:
+        results = parse_json(
+            completion.choices[0].message.content, expect=list, length=len(sentences), source='reference_translations'
+        )
+    except ResponseParseError:
+        return [None] * len(sentences)
+
+    references = []
+    for sentence, result in zip(sentences, results):
+        translation = result.get('translation') if isinstance(result, dict) else None
+        alignment = clean_alignment(sentence, result.get('alignment')) if isinstance(result, dict) else None
+        if not translation or alignment is None:
+            references.append(None)
+        else:
+            references.append({'reference_translation': translation.strip(), 'alignment': alignment})
+    return references
+
+def add_references(path: str, overwrite: bool = False) -> int:
+    """
+    Adds reference translations to the sentences of one story file that don't have one yet.
+    The file is rewritten atomically, so the app never reads a half-written story.
+
+    Returns:
+        The number of sentences updated
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        story_data = json.load(f)
+    pending = [
+        sentence_data for sentence_data in story_data.get('story', [])
+        if overwrite or not sentence_data.get('reference_translation')
+    ]
+    if not pending:
+        return 0
+
+    language = story_language(os.path.basename(path), story_data.get('metadata', {}))
+    updated = 0
+    for sentence_data, reference in zip(pending, translate_sentences([s['sentence'] for s in pending], language)):
+        if reference is not None:
+            sentence_data.update(reference)
+            updated += 1
+    if updated:
+        write_story_file(path, story_data)
+    return updated
+
+# Run after generating new stories. The app re-imports the catalog by itself once the
+# story files change, and from then on grades those sentences with the reference.
+if __name__ == "__main__":
+    overwrite = '--overwrite' in sys.argv
+    total = 0
+    for filename in sorted(os.listdir(STORIES_DIR)):
+        if not filename.endswith('.json'):
+            continue
+        count = add_references(os.path.join(STORIES_DIR, filename), overwrite)
+        print(f"{filename}: {count} sentences updated")
+        total += count
+    print(f"Added reference translations to {total} sentences")
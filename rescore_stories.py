@@ -0,0 +1,284 @@
+import os
+import sys
+import json
+import argparse
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from difficulty_range_generator import SENTENCE_SCORING_MODEL, client, gpt_scored_rubric_batch, rubric_prompt
+from response_parsing import ResponseParseError, parse_json, summary as parse_summary
+from story_db import STORIES_DIR, story_language, write_story_file
+
+# Sentences per rubric request. The rubric is most of the prompt, so large batches cost
+# far fewer tokens per sentence than scoring one sentence at a time.
+RESCORE_BATCH_SIZE = 50
+SCORES = (0, 1, 2, 3)
+
+Key = Tuple[str, int]  # (story filename, sentence position)
+
+def iter_sentences(stories_dir: str = STORIES_DIR) -> Iterable[Dict]:
+    """Streams every stored sentence with its story, position, language and current score."""
+    for filename in sorted(os.listdir(stories_dir)):
+        if not filename.endswith('.json'):
+            continue
+        with open(os.path.join(stories_dir, filename), 'r', encoding='utf-8') as f:
+            story_data = json.load(f)
+        language = story_language(filename, story_data.get('metadata', {}))
+        for position, sentence_data in enumerate(story_data.get('story', [])):
+            yield {
+                'filename': filename,
+                'position': position,
+                'sentence': sentence_data['sentence'],
+                'language': language,
+                'old_score': sentence_data.get('actual_score'),
+            }
+
+def pack_requests(sentences: Iterable[Dict], batch_size: int = RESCORE_BATCH_SIZE) -> Iterable[Tuple[str, List[Dict]]]:
+    """Groups the sentence stream into (language, batch) pairs; the rubric prompt names one language."""
+    buffers: Dict[str, List[Dict]] = {}
+    for item in sentences:
+        buffer = buffers.setdefault(item['language'], [])
+        buffer.append(item)
+        if len(buffer) == batch_size:
+            yield item['language'], buffers.pop(item['language'])
+    for language, buffer in buffers.items():
+        if buffer:
+            yield language, buffer
+
+def _valid_result(result) -> Optional[Dict]:
+    """Keeps a rubric result only if it has a usable score."""
+    if not isinstance(result, dict) or result.get('score') not in SCORES:
+        return None
+    return {
+        'score': result['score'],
+        'reasoning': result.get('reasoning', ''),
+        'cognate_words': result.get('cognate_words', []),
+    }
+
+def _collect_results(batch: List[Dict], results: List) -> Dict[Key, Dict]:
+    scores = {}
+    for item, result in zip(batch, results):
+        result = _valid_result(result)
+        if result is not None:
+            scores[(item['filename'], item['position'])] = {**result, 'sentence': item['sentence']}
+    return scores
+
+def score_direct(batches: Iterable[Tuple[str, List[Dict]]], model: str) -> Dict[Key, Dict]:
+    """Scores the batches with one synchronous rubric request each."""
+    scores = {}
+    for i, (language, batch) in enumerate(batches):
+        print(f"Scoring batch {i + 1} ({len(batch)} {language} sentences)...")
+        try:
+            results = gpt_scored_rubric_batch([item['sentence'] for item in batch], language, model)
+        except ResponseParseError:
+            print(f"Skipping batch {i + 1}: the answer could not be parsed")
+            continue
+        scores.update(_collect_results(batch, results))
+    return scores
+
+def write_batch_file(batches: Iterable[Tuple[str, List[Dict]]], model: str, path: str) -> str:
+    """
+    Writes the batches as a Batch API input file, plus a manifest that maps each
+    request back to its sentences.
+
+    Returns:
+        The path of the manifest
+    """
+    manifest = {'model': model, 'requests': {}}
+    with open(path, 'w', encoding='utf-8') as f:
+        for i, (language, batch) in enumerate(batches):
+            custom_id = f"rescore-{i:05d}"
+            f.write(json.dumps({
+                'custom_id': custom_id,
+                'method': 'POST',
+                'url': '/v1/chat/completions',
+                'body': {
+                    'model': model,
+                    'messages': [{'role': 'user', 'content': rubric_prompt([item['sentence'] for item in batch], language)}],
+                },
+            }, ensure_ascii=False) + '\n')
+            manifest['requests'][custom_id] = [[item['filename'], item['position'], item['sentence']] for item in batch]
+    manifest_path = path + '.manifest.json'
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    return manifest_path
+
+def submit_batch_file(path: str) -> str:
+    """Uploads a Batch API input file and starts the batch. Returns the batch id."""
+    with open(path, 'rb') as f:
+        input_file = client.files.create(file=f, purpose='batch')
+    batch = client.batches.create(
+        input_file_id=input_file.id, endpoint='/v1/chat/completions', completion_window='24h'
+    )
+    return batch.id
+
+def download_batch_results(batch_id: str, path: str) -> bool:
+    """Saves a finished batch's output file to path. Returns False if the batch isn't done yet."""
+    batch = client.batches.retrieve(batch_id)
+    if batch.status != 'completed' or not batch.output_file_id:
+        print(f"Batch {batch_id} is {batch.status}")
+        return False
+    with open(path, 'wb') as f:
+        f.write(client.files.content(batch.output_file_id).read())
+    return True
+
+def read_batch_results(results_path: str, manifest: Dict) -> Dict[Key, Dict]:
+    """Parses a Batch API output file using the manifest written by write_batch_file."""
+    scores = {}
+    with open(results_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            output = json.loads(line)
+            items = manifest['requests'].get(output.get('custom_id'))
+            response = output.get('response') or {}
+            if items is None or response.get('status_code') != 200:
+                print(f"Skipping {output.get('custom_id')}: {output.get('error') or response.get('status_code')}")
+                continue
+            try:
+                results = parse_json(
+                    response['body']['choices'][0]['message']['content'],
+                    expect=list, length=len(items), source='rescore_batch_api'
+                )
+            except ResponseParseError:
+                continue
+            batch = [{'filename': filename, 'position': position, 'sentence': sentence} for filename, position, sentence in items]
+            scores.update(_collect_results(batch, results))
+    return scores
+
+def apply_scores(scores: Dict[Key, Dict], model: str, stories_dir: str = STORIES_DIR, dry_run: bool = False) -> List[Tuple[int, int]]:
+    """
+    Writes the new scores into the story files, one atomic rewrite per story. The old
+    score is kept in each sentence's score_history. Sentences whose text changed since
+    they were sent for scoring are left alone.
+
+    Returns:
+        (old_score, new_score) for every sentence that was updated
+    """
+    by_file: Dict[str, Dict[int, Dict]] = defaultdict(dict)
+    for (filename, position), result in scores.items():
+        by_file[filename][position] = result
+
+    pairs = []
+    for filename, results in sorted(by_file.items()):
+        path = os.path.join(stories_dir, filename)
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            story_data = json.load(f)
+        sentences = story_data.get('story', [])
+        metadata = story_data.setdefault('metadata', {})
+        updated = 0
+        for position, result in results.items():
+            if position >= len(sentences) or sentences[position]['sentence'] != result['sentence']:
+                continue
+            sentence_data = sentences[position]
+            old_score = sentence_data.get('actual_score')
+            if old_score is not None:
+                pairs.append((old_score, result['score']))
+                sentence_data.setdefault('score_history', []).append({
+                    'scoring_model': sentence_data.get('scoring_model', metadata.get('scoring_model')),
+                    'actual_score': old_score,
+                })
+            sentence_data['actual_score'] = result['score']
+            sentence_data['actual_score_reasoning'] = result['reasoning']
+            sentence_data['actual_cognate_words'] = result['cognate_words']
+            sentence_data['scoring_model'] = model
+            updated += 1
+        if not updated:
+            continue
+        if all(s.get('scoring_model') == model for s in sentences):
+            metadata['scoring_model'] = model
+        if 'actual_difficulty_mean' in metadata:
+            metadata['actual_difficulty_mean'] = sum(s['actual_score'] for s in sentences) / len(sentences)
+        if not dry_run:
+            write_story_file(path, story_data)
+    return pairs
+
+def agreement(pairs: List[Tuple[int, int]]) -> Dict:
+    """
+    Agreement between the old and new scores: exact and within-one agreement, the mean
+    shift, quadratic-weighted Cohen's kappa and the confusion matrix (rows are old scores).
+    """
+    n = len(pairs)
+    if n == 0:
+        return {'n': 0}
+    k = len(SCORES)
+    confusion = [[0] * k for _ in range(k)]
+    for old, new in pairs:
+        confusion[SCORES.index(int(round(old)))][SCORES.index(int(new))] += 1
+
+    old_totals = [sum(row) for row in confusion]
+    new_totals = [sum(confusion[i][j] for i in range(k)) for j in range(k)]
+    weight = lambda i, j: (i - j) ** 2 / (k - 1) ** 2
+    observed = sum(weight(i, j) * confusion[i][j] for i in range(k) for j in range(k)) / n
+    expected = sum(weight(i, j) * old_totals[i] * new_totals[j] for i in range(k) for j in range(k)) / n ** 2
+    return {
+        'n': n,
+        'exact': sum(1 for old, new in pairs if round(old) == new) / n,
+        'within_one': sum(1 for old, new in pairs if abs(old - new) <= 1) / n,
+        'mean_shift': sum(new - old for old, new in pairs) / n,
+        'weighted_kappa': 1 - observed / expected if expected else 1.0,
+        'confusion': confusion,
+    }
+
+def print_agreement(stats: Dict) -> None:
+    if not stats['n']:
+        print("No sentences were re-scored")
+        return
+    print(f"\nRe-scored {stats['n']} sentences")
+    print(f"Exact agreement:     {stats['exact']:.1%}")
+    print(f"Within one point:    {stats['within_one']:.1%}")
+    print(f"Mean shift (new-old): {stats['mean_shift']:+.2f}")
+    print(f"Weighted kappa:      {stats['weighted_kappa']:.3f}")
+    print("Confusion (rows old 0-3, columns new 0-3):")
+    for score, row in zip(SCORES, stats['confusion']):
+        print(f"  {score}: " + ' '.join(f"{count:>5}" for count in row))
+
+# Overnight: `prepare requests.jsonl --submit`, then the next morning `collect --batch-id ID
+# --manifest requests.jsonl.manifest.json`. `direct` scores synchronously, in large batches.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-score the stored stories with a different scoring model.")
+    parser.add_argument('--stories-dir', default=STORIES_DIR)
+    parser.add_argument('--dry-run', action='store_true', help="Report agreement without writing scores back")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    direct = commands.add_parser('direct', help="Score now with batched rubric requests")
+    direct.add_argument('--model', default=SENTENCE_SCORING_MODEL)
+    direct.add_argument('--batch-size', type=int, default=RESCORE_BATCH_SIZE)
+
+    prepare = commands.add_parser('prepare', help="Write a Batch API input file")
+    prepare.add_argument('path')
+    prepare.add_argument('--model', default=SENTENCE_SCORING_MODEL)
+    prepare.add_argument('--batch-size', type=int, default=RESCORE_BATCH_SIZE)
+    prepare.add_argument('--submit', action='store_true', help="Upload the file and start the batch")
+
+    collect = commands.add_parser('collect', help="Apply the results of a finished batch")
+    collect.add_argument('--manifest', required=True)
+    source = collect.add_mutually_exclusive_group(required=True)
+    source.add_argument('--results', help="A downloaded Batch API output file")
+    source.add_argument('--batch-id', help="Download the output of this batch")
+
+    args = parser.parse_args()
+    if args.command == 'direct':
+        scores = score_direct(pack_requests(iter_sentences(args.stories_dir), args.batch_size), args.model)
+        model = args.model
+    elif args.command == 'prepare':
+        manifest_path = write_batch_file(pack_requests(iter_sentences(args.stories_dir), args.batch_size), args.model, args.path)
+        print(f"Wrote {args.path} and {manifest_path}")
+        if args.submit:
+            print(f"Submitted batch {submit_batch_file(args.path)}")
+        sys.exit(0)
+    else:
+        with open(args.manifest, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        results_path = args.results
+        if args.batch_id:
+            results_path = args.manifest.replace('.manifest.json', '') + '.results.jsonl'
+            if not download_batch_results(args.batch_id, results_path):
+                sys.exit(1)
+        scores = read_batch_results(results_path, manifest)
+        model = manifest['model']
+
+    print_agreement(agreement(apply_scores(scores, model, args.stories_dir, args.dry_run)))
+    print(parse_summary())
@@ -0,0 +1,120 @@
+import re
+import json
+from typing import Any, Dict, List, Optional
+
+import metrics
+
+# Models that accept response_format={"type": "json_schema", ...} (structured outputs)
+STRUCTURED_OUTPUT_MODELS = ('gpt-4o', 'gpt-4o-mini')
+# Models that accept response_format={"type": "json_object"}. The o1 models accept neither.
+JSON_MODE_MODELS = STRUCTURED_OUTPUT_MODELS + ('gpt-4-turbo', 'gpt-3.5-turbo')
+
+_FENCE_RE = re.compile(r"^\s*```[a-zA-Z]*\s*\n?(.*?)\n?\s*```\s*$", re.DOTALL)
+_TRAILING_COMMA_RE = re.compile(r",(\s*[}\]])")
+
+class ResponseParseError(ValueError):
+    """The model's answer couldn't be parsed or repaired into the expected JSON."""
+
+def response_format(model: str, schema: Optional[Dict] = None, name: str = 'response') -> Dict:
+    """
+    Keyword arguments for chat.completions.create that make the model answer in JSON.
+
+    With a schema, models that support structured outputs are held to it exactly; the
+    schema must be an object with every property required and additionalProperties
+    false. Otherwise JSON mode is used where available, which only guarantees a JSON
+    object, so it is never used for prompts that ask for a top-level array.
+    """
+    if schema is not None and model in STRUCTURED_OUTPUT_MODELS:
+        return {'response_format': {'type': 'json_schema', 'json_schema': {'name': name, 'strict': True, 'schema': schema}}}
+    if (schema is None or schema.get('type') == 'object') and model in JSON_MODE_MODELS:
+        return {'response_format': {'type': 'json_object'}}
+    return {}
+
+def _outermost_json(text: str) -> Optional[str]:
+    """The text from the first { or [ to the last matching } or ], dropping any prose around it."""
+    starts = [i for i in (text.find('{'), text.find('[')) if i != -1]
+    if not starts:
+        return None
+    start = min(starts)
+    end = text.rfind('}' if text[start] == '{' else ']')
+    return text[start:end + 1] if end > start else None
+
+def _repairs(text: str):
+    """Yields (repair, candidate) pairs, each building on the previous ones."""
+    match = _FENCE_RE.match(text)
+    if match:
+        text = match.group(1)
+        yield 'fence', text
+    extracted = _outermost_json(text)
+    if extracted is not None and extracted != text.strip():
+        text = extracted
+        yield 'extract', text
+    fixed = _TRAILING_COMMA_RE.sub(r"\1", text)
+    if fixed != text:
+        yield 'trailing_comma', fixed
+
+def parse_json(text: str, expect: Optional[type] = None, length: Optional[int] = None, source: str = 'unknown') -> Any:
+    """
+    Parses a model's JSON answer, repairing the usual formatting slips locally (Markdown
+    fences, prose around the JSON, trailing commas) instead of throwing the call away.
+
+    Args:
+        expect: dict or list, if the answer must be of that type
+        length: The number of items a list answer must have
+        source: Which call this is, for the llm_parse_total and llm_parse_repairs_total metrics
+
+    Raises:
+        ResponseParseError: If no repair yields JSON of the expected shape
+    """
+    text = (text or '').strip()
+    applied: List[str] = []
+    result, error = None, None
+    try:
+        result = json.loads(text)
+    except json.JSONDecodeError as e:
+        error = e
+        for repair, candidate in _repairs(text):
+            applied.append(repair)
+            try:
+                result = json.loads(candidate)
+                error = None
+                break
+            except json.JSONDecodeError as e:
+                error = e
+
+    if error is None:
+        error = _shape_error(result, expect, length)
+    if error is not None:
+        metrics.inc('llm_parse_total', source=source, outcome='failed')
+        print(f"Error: Failed to parse the {source} response ({error}): {text[:500]}")
+        raise ResponseParseError(str(error))
+
+    for repair in applied:
+        metrics.inc('llm_parse_repairs_total', source=source, repair=repair)
+    metrics.inc('llm_parse_total', source=source, outcome='repaired' if applied else 'ok')
+    return result
+
+def _shape_error(result: Any, expect: Optional[type], length: Optional[int]) -> Optional[str]:
+    if expect is not None and not isinstance(result, expect):
+        return f"expected a JSON {expect.__name__}, got {type(result).__name__}"
+    if length is not None and isinstance(result, list) and len(result) != length:
+        return f"expected {length} items, got {len(result)}"
+    return None
+
+def try_parse_json(text: str, expect: Optional[type] = None, length: Optional[int] = None, source: str = 'unknown') -> Any:
+    """Same as parse_json, but returns None instead of raising, for callers that can skip a bad answer."""
+    try:
+        return parse_json(text, expect, length, source)
+    except ResponseParseError:
+        return None
+
+def summary() -> str:
+    """One line per source with the parse outcomes so far in this process, for the generator scripts."""
+    totals: Dict[str, Dict[str, float]] = {}
+    for labels, value in metrics.counter_values('llm_parse_total').items():
+        labels = dict(labels)
+        totals.setdefault(labels['source'], {})[labels['outcome']] = value
+    return '\n'.join(
+        f"{source}: {counts.get('ok', 0):g} ok, {counts.get('repaired', 0):g} repaired, {counts.get('failed', 0):g} failed"
+        for source, counts in sorted(totals.items())
+    )
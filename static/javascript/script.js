@@ -4,6 +4,10 @@ const DIFFICULTY_STEP_UP = 0.1;
 const MAX_DIFFICULTY = 3.0;
 const MIN_DIFFICULTY = 0.0;
 
+// Language of the stories, from ?lang= in the page URL (French by default)
+const LANG = new URLSearchParams(window.location.search).get('lang') || 'fr';
+const LANGUAGE_FLAGS = { fr: '🇫🇷', es: '🇪🇸', it: '🇮🇹' };
+
 // State variables
 let currentSentenceToTranslate = '';
 
@@ -21,6 +25,13 @@ localStorage.setItem('currentSentenceIndex', '0');
 localStorage.setItem('userDifficulty', '3');
 localStorage.setItem('seenStories', JSON.stringify([]));
 
+// Identifies this browser to the server-side learner model, which keeps the
+// difficulty estimate across visits
+if (!localStorage.getItem('learnerId')) {
+    localStorage.setItem('learnerId', crypto.randomUUID ? crypto.randomUUID() :
+        Math.random().toString(36).slice(2) + Date.now().toString(36));
+}
+
 // Set initial stats panel display state explicitly
 document.getElementById('stats-panel').style.display = 'none';
 
@@ -47,15 +58,16 @@ function toggleStats() {
     document.body.classList.toggle('show-stats');
 }
 
-function createSentenceBlock(sentence, difficulty, isActive = false) {
+// sentenceHtml is the pre-rendered sentence from the server, with cognates already highlighted
+function createSentenceBlock(sentenceHtml, difficulty, isActive = false) {
     const block = document.createElement('div');
     block.className = `sentence-block ${isActive ? 'active' : ''}`;
     
     const frenchContainer = document.createElement('div');
     frenchContainer.className = 'french-container';
     frenchContainer.innerHTML = `
-        <span class="flag">🇫🇷</span>
-        <span class="sentence">${sentence}</span>
+        <span class="flag">${LANGUAGE_FLAGS[LANG] || '🏳️'}</span>
+        <span class="sentence">${sentenceHtml}</span>
         <span class="difficulty">📊 ${parseFloat(difficulty).toFixed(2)}</span>
     `;
     block.appendChild(frenchContainer);
@@ -84,8 +96,13 @@ function adjustDifficulty(correct) {
     } else {
         currentDifficulty = Math.min(MAX_DIFFICULTY, currentDifficulty + DIFFICULTY_STEP_UP);
     }
-    localStorage.setItem('userDifficulty', currentDifficulty.toString());
-    document.getElementById('user-difficulty').textContent = currentDifficulty.toFixed(2);
+    setUserDifficulty(currentDifficulty);
+}
+
+// The server's estimate replaces the local one whenever a response carries it
+function setUserDifficulty(difficulty) {
+    localStorage.setItem('userDifficulty', difficulty.toString());
+    document.getElementById('user-difficulty').textContent = difficulty.toFixed(2);
 }
 
 async function handleNext() {
@@ -121,7 +138,9 @@ async function handleSpacePress() {
             { 
                 needNewStory: true,
                 userDifficulty: parseFloat(localStorage.getItem('userDifficulty')),
-                seenStories: JSON.parse(localStorage.getItem('seenStories'))
+                seenStories: JSON.parse(localStorage.getItem('seenStories')),
+                learnerId: localStorage.getItem('learnerId'),
+                lang: LANG
             } :
             { 
                 storyFile: currentStoryFile,
@@ -150,7 +169,7 @@ async function handleSpacePress() {
     }
 
     // Create and append new sentence block
-    const sentenceBlock = createSentenceBlock(data.sentence, data.sentenceDifficulty, true);
+    const sentenceBlock = createSentenceBlock(data.html, data.sentenceDifficulty, true);
     display.appendChild(sentenceBlock);
     currentSentenceToTranslate = data.sentence;
 
@@ -159,6 +178,7 @@ async function handleSpacePress() {
         localStorage.setItem('currentStoryFile', data.storyFile);
         localStorage.setItem('currentSentenceIndex', '1');
         document.getElementById('story-difficulty').textContent = data.storyDifficulty.toFixed(2);
+        if (data.userDifficulty !== undefined) setUserDifficulty(data.userDifficulty);
     } else {
         localStorage.setItem('currentSentenceIndex', (currentSentenceIndex + 1).toString());
     }
@@ -175,75 +195,133 @@ async function startNewStory() {
     await handleSpacePress();
 }
 
+// Reads server-sent events from a POST response, calling onEvent(event, data) for each one
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const message = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let event = 'message';
+            let data = '';
+            message.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            });
+            onEvent(event, data ? JSON.parse(data) : {});
+        }
+    }
+}
+
+// Marks the first occurrence of each wrong morpheme in the rendered sentence. Works on
+// its text nodes, so the cognate highlighting markup is left intact.
+function highlightWrongMorphemes(block, wrongMorphemes) {
+    if (!wrongMorphemes || wrongMorphemes.length === 0) return;
+    const frenchSentence = block.querySelector('.sentence');
+    frenchSentence.querySelectorAll('strong.wrong-morpheme').forEach(strong => {
+        strong.replaceWith(...strong.childNodes);
+    });
+    frenchSentence.normalize();
+    wrongMorphemes.forEach(morpheme => {
+        const walker = document.createTreeWalker(frenchSentence, NodeFilter.SHOW_TEXT);
+        while (walker.nextNode()) {
+            const node = walker.currentNode;
+            if (node.parentElement.classList.contains('wrong-morpheme')) continue;
+            const index = node.data.indexOf(morpheme);
+            if (index === -1) continue;
+            const match = node.splitText(index);
+            match.splitText(morpheme.length);
+            const strong = document.createElement('strong');
+            strong.className = 'wrong-morpheme';
+            match.replaceWith(strong);
+            strong.appendChild(match);
+            break;
+        }
+    });
+}
+
+function flashIncorrect(block) {
+    block.classList.add('incorrect');
+    setTimeout(() => {
+        block.classList.remove('incorrect');
+        block.classList.add('active');
+    }, 1000);
+}
+
 async function checkTranslation(button) {
     const block = button.closest('.sentence-block');
     const input = block.querySelector('.translation-input');
     const translation = input.value.trim();
     
     if (!translation) {
-        block.classList.add('incorrect');
-        setTimeout(() => {
-            block.classList.remove('incorrect');
-            block.classList.add('active');
-        }, 1000);
+        flashIncorrect(block);
         return;
     }
 
     try {
-        const response = await fetch('/score_translation', {
+        // Streamed so the verdict shows up as soon as the model has written it,
+        // with the wrong morphemes following once they arrive
+        const response = await fetch('/score_translation_stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
             },
             body: JSON.stringify({
                 original: currentSentenceToTranslate,
-                translation: translation
+                translation: translation,
+                learnerId: localStorage.getItem('learnerId'),
+                lang: LANG
             })
         });
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
 
-        const data = await response.json();
-        
-        if (data.isCorrect) {
-            adjustDifficulty(true);
-            block.classList.remove('active', 'incorrect');
-            block.classList.add('correct');
-            
-            const completedTranslation = document.createElement('div');
-            completedTranslation.className = 'completed-translation';
-            completedTranslation.textContent = translation;
-            block.appendChild(completedTranslation);
-
-            block.querySelector('.translation-container').remove();
-            handleSpacePress();
-        } else {
-            adjustDifficulty(false);
-            block.classList.remove('correct');
-            block.classList.add('incorrect');
-            
-            if (data.wrongMorphemes && data.wrongMorphemes.length > 0) {
-                const frenchSentence = block.querySelector('.sentence');
-                let sentenceHtml = currentSentenceToTranslate;
-                data.wrongMorphemes.forEach(morpheme => {
-                    sentenceHtml = sentenceHtml.replace(
-                        morpheme,
-                        `<strong style="color: #dc3545">${morpheme}</strong>`
-                    );
-                });
-                frenchSentence.innerHTML = sentenceHtml;
+        let verdictShown = false;
+        // Provisional verdicts come from a quick local check while the grader is
+        // unavailable, and are too rough to change the difficulty
+        const showVerdict = (isCorrect, provisional) => {
+            if (verdictShown) return;
+            verdictShown = true;
+            if (isCorrect) {
+                if (!provisional) adjustDifficulty(true);
+                block.classList.remove('active', 'incorrect');
+                block.classList.add('correct');
+                
+                const completedTranslation = document.createElement('div');
+                completedTranslation.className = 'completed-translation';
+                completedTranslation.textContent = translation;
+                block.appendChild(completedTranslation);
+
+                block.querySelector('.translation-container').remove();
+                handleSpacePress();
+            } else {
+                if (!provisional) adjustDifficulty(false);
+                block.classList.remove('correct');
+                flashIncorrect(block);
             }
-            
-            setTimeout(() => {
-                block.classList.remove('incorrect');
-                block.classList.add('active');
-            }, 1000);
-        }
+        };
+
+        await readEventStream(response, (event, data) => {
+            if (event === 'verdict') {
+                showVerdict(data.isCorrect, data.provisional);
+            } else if (event === 'morphemes') {
+                if (!block.classList.contains('correct')) highlightWrongMorphemes(block, data.wrongMorphemes);
+            } else if (event === 'done') {
+                showVerdict(data.isCorrect, data.provisional);
+                if (!data.isCorrect) highlightWrongMorphemes(block, data.wrongMorphemes);
+                if (data.userDifficulty !== undefined) setUserDifficulty(data.userDifficulty);
+            } else if (event === 'error') {
+                throw new Error(data.error);
+            }
+        });
     } catch (error) {
         console.error('Error checking translation:', error);
-        block.classList.add('incorrect');
-        setTimeout(() => {
-            block.classList.remove('incorrect');
-            block.classList.add('active');
-        }, 1000);
+        flashIncorrect(block);
     }
 }
 
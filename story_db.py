@@ -0,0 +1,529 @@
+import os
+import re
+import html
+import json
+import random
+import bisect
+import math
+import sqlite3
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+STORIES_DIR = "batch_stories"
+STORY_DB = os.environ.get("STORY_DB", "stories.db")
+# Languages the app can serve, by the code used in story metadata and filename prefixes
+LANGUAGES = {
+    'fr': 'French',
+    'es': 'Spanish',
+    'it': 'Italian',
+}
+DEFAULT_LANGUAGE = 'fr'
+# Bumped whenever SCHEMA changes, so catalogs built by an older version are rebuilt
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE stories (
+    id INTEGER PRIMARY KEY,
+    filename TEXT NOT NULL UNIQUE,
+    language TEXT,
+    target_difficulty REAL,
+    mean_difficulty REAL NOT NULL,
+    num_sentences INTEGER NOT NULL,
+    generation_model TEXT,
+    scoring_model TEXT,
+    creation_date TEXT
+);
+CREATE TABLE sentences (
+    id INTEGER PRIMARY KEY,
+    story_id INTEGER NOT NULL REFERENCES stories(id),
+    position INTEGER NOT NULL,
+    sentence TEXT NOT NULL,
+    target_difficulty REAL,
+    actual_score REAL NOT NULL,
+    actual_score_reasoning TEXT,
+    reference_translation TEXT,
+    alignment TEXT, -- JSON list of [french, english] pairs, see reference_translations.py
+    html TEXT NOT NULL, -- The sentence with its cognates wrapped in <span class="highlight">, see render_sentence
+    cognates TEXT NOT NULL -- JSON list of [start, end, word] character offsets of the cognates
+);
+CREATE TABLE cognate_words (
+    sentence_id INTEGER NOT NULL REFERENCES sentences(id),
+    word TEXT NOT NULL
+);
+CREATE INDEX idx_stories_language_difficulty ON stories(language, mean_difficulty);
+CREATE UNIQUE INDEX idx_sentences_story_position ON sentences(story_id, position);
+CREATE INDEX idx_sentences_actual_score ON sentences(actual_score);
+CREATE INDEX idx_sentences_sentence ON sentences(sentence);
+CREATE INDEX idx_cognate_words_word ON cognate_words(word);
+"""
+
+def story_language(filename: str, metadata: Dict) -> str:
+    """The story's language from its metadata, or else from the filename prefix (e.g. fr_batch_story_...)."""
+    language = metadata.get('language') or filename.split('_', 1)[0]
+    return language if language in LANGUAGES else DEFAULT_LANGUAGE
+
+def language_from_args(args: List[str]) -> str:
+    """The language code from a --lang=xx command-line argument, or DEFAULT_LANGUAGE. Exits if it isn't supported."""
+    language = next((arg.split('=', 1)[1] for arg in args if arg.startswith('--lang=')), DEFAULT_LANGUAGE)
+    if language not in LANGUAGES:
+        raise SystemExit(f"Unsupported language {language!r}, expected one of {', '.join(LANGUAGES)}")
+    return language
+
+def find_cognates(sentence: str, cognate_words: List[str]) -> List[Tuple[int, int, str]]:
+    """
+    Finds every whole-word occurrence of the cognate words in the sentence, ignoring case.
+    Longer words win where matches overlap, so "l'atmosphère" isn't split into "atmosphère".
+
+    Returns:
+        Sorted, non-overlapping (start, end, word) character offsets into the sentence
+    """
+    spans: List[Tuple[int, int, str]] = []
+    for word in sorted({w.strip() for w in cognate_words if isinstance(w, str) and w.strip()}, key=len, reverse=True):
+        for match in re.finditer(rf"(?<!\w){re.escape(word)}(?!\w)", sentence, re.IGNORECASE):
+            start, end = match.span()
+            if all(end <= other_start or start >= other_end for other_start, other_end, _ in spans):
+                spans.append((start, end, word))
+    return sorted(spans)
+
+def render_sentence(sentence: str, cognates: List[Tuple[int, int, str]]) -> str:
+    """The sentence as escaped HTML, with each cognate wrapped in <span class="highlight">."""
+    parts, position = [], 0
+    for start, end, _ in cognates:
+        parts.append(html.escape(sentence[position:start], quote=False))
+        parts.append(f'<span class="highlight">{html.escape(sentence[start:end], quote=False)}</span>')
+        position = end
+    parts.append(html.escape(sentence[position:], quote=False))
+    return ''.join(parts)
+
+def write_story_file(path: str, story_data: Dict) -> None:
+    """
+    Rewrites a story file atomically, for offline passes that update stories in place,
+    so the catalog import never reads a half-written story.
+    """
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(story_data, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+
+def import_stories(stories_dir: str = STORIES_DIR, db_path: str = STORY_DB) -> int:
+    """
+    Builds the story catalog from the JSON files in stories_dir.
+
+    The database is written to a temporary file and then renamed over db_path, so
+    workers that already have the old catalog open keep reading a consistent copy.
+
+    Returns:
+        The number of stories imported
+    """
+    db_dir = os.path.dirname(os.path.abspath(db_path))
+    fd, tmp_path = tempfile.mkstemp(suffix='.db', dir=db_dir)
+    os.close(fd)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(SCHEMA)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        count = 0
+        for filename in sorted(os.listdir(stories_dir)):
+            if not filename.endswith('.json'):
+                continue
+            with open(os.path.join(stories_dir, filename), 'r', encoding='utf-8') as f:
+                story_data = json.load(f)
+            sentences = story_data.get('story', [])
+            if not sentences:
+                continue
+            metadata = story_data.get('metadata', {})
+            mean_difficulty = sum(s['actual_score'] for s in sentences) / len(sentences)
+            story_id = conn.execute(
+                "INSERT INTO stories (filename, language, target_difficulty, mean_difficulty, num_sentences, "
+                "generation_model, scoring_model, creation_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (filename, story_language(filename, metadata), metadata.get('target_difficulty'), mean_difficulty,
+                 len(sentences), metadata.get('generation_model'), metadata.get('scoring_model'),
+                 metadata.get('creation_date'))
+            ).lastrowid
+            for position, sentence_data in enumerate(sentences):
+                # Highlighting is rendered here once, so serving a sentence needs no string processing
+                cognates = find_cognates(sentence_data['sentence'], sentence_data.get('actual_cognate_words', []))
+                sentence_id = conn.execute(
+                    "INSERT INTO sentences (story_id, position, sentence, target_difficulty, actual_score, "
+                    "actual_score_reasoning, reference_translation, alignment, html, cognates) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (story_id, position, sentence_data['sentence'], sentence_data.get('target_difficulty'),
+                     sentence_data['actual_score'], sentence_data.get('actual_score_reasoning'),
+                     sentence_data.get('reference_translation'),
+                     json.dumps(sentence_data['alignment'], ensure_ascii=False) if sentence_data.get('alignment') else None,
+                     render_sentence(sentence_data['sentence'], cognates),
+                     json.dumps([list(cognate) for cognate in cognates], ensure_ascii=False))
+                ).lastrowid
+                conn.executemany(
+                    "INSERT INTO cognate_words (sentence_id, word) VALUES (?, ?)",
+                    [(sentence_id, word) for word in sentence_data.get('actual_cognate_words', [])]
+                )
+            count += 1
+        conn.commit()
+    except Exception:
+        conn.close()
+        os.remove(tmp_path)
+        raise
+    conn.close()
+    os.replace(tmp_path, db_path)
+    return count
+
+def catalog_is_stale(stories_dir: str = STORIES_DIR, db_path: str = STORY_DB) -> bool:
+    """
+    True if the catalog is missing, was built with an older schema, or is older than any
+    story file. The directory's own mtime is included because it changes when story files
+    are added or removed.
+    """
+    if not os.path.exists(db_path):
+        return True
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    try:
+        if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            return True
+    finally:
+        conn.close()
+    db_mtime = os.path.getmtime(db_path)
+    if os.path.getmtime(stories_dir) > db_mtime:
+        return True
+    return any(
+        entry.stat().st_mtime > db_mtime
+        for entry in os.scandir(stories_dir)
+        if entry.name.endswith('.json')
+    )
+
+def ensure_catalog(stories_dir: str = STORIES_DIR, db_path: str = STORY_DB) -> bool:
+    """
+    Re-imports the stories if the catalog is stale, so stories added to or edited in
+    stories_dir are picked up without deleting the database or running this module by hand.
+
+    Returns:
+        True if the catalog was rebuilt
+    """
+    if not catalog_is_stale(stories_dir, db_path):
+        return False
+    import_stories(stories_dir, db_path)
+    return True
+
+_local = threading.local()
+
+def get_connection(db_path: str = STORY_DB) -> sqlite3.Connection:
+    """
+    Returns a read-only connection to the catalog for the current thread.
+
+    Connections are never reused across a fork, so each gunicorn worker opens its own,
+    and are reopened when import_stories has renamed a new catalog into place.
+    """
+    key = (os.getpid(), db_path)
+    inode = os.stat(db_path).st_ino
+    conns = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+    cached = conns.get(key)
+    if cached is not None and cached[0] == inode:
+        return cached[1]
+    if cached is not None:
+        cached[1].close()
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    conns[key] = (inode, conn)
+    return conn
+
+def get_story_candidates(conn: sqlite3.Connection, target_difficulty: float, seen_stories: List[str], tolerance: float = 0.3,
+                         language: str = DEFAULT_LANGUAGE) -> Optional[str]:
+    """
+    Returns a random unseen story filename in language whose mean difficulty is within
+    tolerance of target_difficulty, falling back to the closest unseen story (the
+    lower-difficulty one if two are equally close). If every
+    story in the language has been seen, all of them are eligible again.
+
+    Every query is restricted to one language through the (language, mean_difficulty)
+    index, so stories in other languages don't add to the cost.
+    """
+    seen_stories = list(seen_stories)
+    if seen_stories:
+        num_unseen = conn.execute(
+            f"SELECT COUNT(*) FROM stories WHERE language = ? AND filename NOT IN ({','.join('?' * len(seen_stories))})",
+            [language] + seen_stories
+        ).fetchone()[0]
+        if num_unseen == 0:
+            seen_stories = []
+    exclude = f"AND filename NOT IN ({','.join('?' * len(seen_stories))})" if seen_stories else ""
+
+    candidates = [row[0] for row in conn.execute(
+        f"SELECT filename FROM stories WHERE language = ? AND mean_difficulty BETWEEN ? AND ? {exclude}",
+        [language, target_difficulty - tolerance, target_difficulty + tolerance] + seen_stories
+    )]
+    if candidates:
+        return random.choice(candidates)
+
+    # If no stories within tolerance, pick the closest one on either side
+    below = conn.execute(
+        f"SELECT filename, mean_difficulty FROM stories WHERE language = ? AND mean_difficulty < ? {exclude} "
+        "ORDER BY mean_difficulty DESC LIMIT 1",
+        [language, target_difficulty] + seen_stories
+    ).fetchone()
+    above = conn.execute(
+        f"SELECT filename, mean_difficulty FROM stories WHERE language = ? AND mean_difficulty >= ? {exclude} "
+        "ORDER BY mean_difficulty ASC LIMIT 1",
+        [language, target_difficulty] + seen_stories
+    ).fetchone()
+    nearest = [row for row in (below, above) if row is not None]
+    if not nearest:
+        return None
+    # min keeps the first of equally close rows, so ties go to the lower difficulty (below)
+    return min(nearest, key=lambda row: abs(row[1] - target_difficulty))[0]
+
+def get_story_list(conn: sqlite3.Connection, language: Optional[str] = None) -> List[Dict]:
+    """Returns the filename, language, mean difficulty and length of every story, or only those in language."""
+    where, params = ("WHERE language = ?", [language]) if language is not None else ("", [])
+    return [
+        {'filename': row['filename'], 'language': row['language'], 'difficulty': row['mean_difficulty'],
+         'num_sentences': row['num_sentences']}
+        for row in conn.execute(
+            f"SELECT filename, language, mean_difficulty, num_sentences FROM stories {where} ORDER BY filename", params
+        )
+    ]
+
+def get_story_summary(conn: sqlite3.Connection, filename: str) -> Optional[Dict]:
+    """Returns the mean difficulty and length of a story, or None if it doesn't exist."""
+    row = conn.execute(
+        "SELECT id, mean_difficulty, num_sentences FROM stories WHERE filename = ?", (filename,)
+    ).fetchone()
+    if row is None:
+        return None
+    return {'id': row['id'], 'difficulty': row['mean_difficulty'], 'num_sentences': row['num_sentences']}
+
+def _sentence_payload(row: sqlite3.Row) -> Dict:
+    return {'sentence': row['sentence'], 'actual_score': row['actual_score'], 'html': row['html'],
+            'cognates': json.loads(row['cognates'])}
+
+def get_sentence(conn: sqlite3.Connection, filename: str, position: int) -> Optional[Dict]:
+    """
+    Returns one sentence of a story, or None if the story or position doesn't exist.
+    Along with the text and score, html is the pre-rendered sentence with its cognates
+    highlighted and cognates their [start, end, word] offsets, both from import_stories.
+    """
+    row = conn.execute(
+        "SELECT s.sentence, s.actual_score, s.html, s.cognates FROM sentences s JOIN stories st ON st.id = s.story_id "
+        "WHERE st.filename = ? AND s.position = ?",
+        (filename, position)
+    ).fetchone()
+    if row is None:
+        return None
+    return _sentence_payload(row)
+
+def get_story_sentences(conn: sqlite3.Connection, filename: str) -> Optional[List[Dict]]:
+    """Returns all sentences of a story in order, in the same form as get_sentence, or None if the story doesn't exist."""
+    summary = get_story_summary(conn, filename)
+    if summary is None:
+        return None
+    return [
+        _sentence_payload(row)
+        for row in conn.execute(
+            "SELECT sentence, actual_score, html, cognates FROM sentences WHERE story_id = ? ORDER BY position",
+            (summary['id'],)
+        )
+    ]
+
+def get_reference(conn: sqlite3.Connection, sentence: str) -> Optional[Dict]:
+    """
+    Returns the precomputed reference translation and word alignment of a sentence, or
+    None if the sentence isn't in the catalog or hasn't been through reference_translations.py.
+    """
+    row = conn.execute(
+        "SELECT reference_translation, alignment FROM sentences "
+        "WHERE sentence = ? AND reference_translation IS NOT NULL LIMIT 1",
+        (sentence,)
+    ).fetchone()
+    if row is None:
+        return None
+    return {'translation': row['reference_translation'], 'alignment': json.loads(row['alignment'] or '[]')}
+
+def get_sentence_score(conn: sqlite3.Connection, sentence: str) -> Optional[float]:
+    """Returns the catalog score of a sentence, looked up by its text, or None if it isn't in the catalog."""
+    row = conn.execute("SELECT actual_score FROM sentences WHERE sentence = ? LIMIT 1", (sentence,)).fetchone()
+    return None if row is None else row['actual_score']
+
+def get_cognate_words(conn: sqlite3.Connection, sentence: str) -> Optional[List[str]]:
+    """Returns the cognates found in a sentence when the catalog was built, or None if it isn't in the catalog."""
+    row = conn.execute("SELECT cognates FROM sentences WHERE sentence = ? LIMIT 1", (sentence,)).fetchone()
+    return None if row is None else [word for _, _, word in json.loads(row['cognates'])]
+
+def get_cognate_averages(conn: sqlite3.Connection, min_count: int = 2) -> Dict[str, float]:
+    """Returns the average sentence score of each cognate word that appears at least min_count times."""
+    return {
+        row[0]: row[1]
+        for row in conn.execute(
+            "SELECT c.word, AVG(s.actual_score) FROM cognate_words c JOIN sentences s ON s.id = c.sentence_id "
+            "GROUP BY c.word HAVING COUNT(*) >= ?",
+            (min_count,)
+        )
+    }
+
+class SQLiteCatalog:
+    """Serves the catalog with indexed queries against the SQLite file on every call."""
+
+    def __init__(self, db_path: str = STORY_DB):
+        self.db_path = db_path
+
+    def get_story_candidates(self, target_difficulty: float, seen_stories: List[str], tolerance: float = 0.3,
+                             language: str = DEFAULT_LANGUAGE) -> Optional[str]:
+        return get_story_candidates(get_connection(self.db_path), target_difficulty, seen_stories, tolerance, language)
+
+    def get_story_list(self, language: Optional[str] = None) -> List[Dict]:
+        return get_story_list(get_connection(self.db_path), language)
+
+    def get_story_summary(self, filename: str) -> Optional[Dict]:
+        return get_story_summary(get_connection(self.db_path), filename)
+
+    def get_sentence(self, filename: str, position: int) -> Optional[Dict]:
+        return get_sentence(get_connection(self.db_path), filename, position)
+
+    def get_story_sentences(self, filename: str) -> Optional[List[Dict]]:
+        return get_story_sentences(get_connection(self.db_path), filename)
+
+    def get_reference(self, sentence: str) -> Optional[Dict]:
+        return get_reference(get_connection(self.db_path), sentence)
+
+    def get_sentence_score(self, sentence: str) -> Optional[float]:
+        return get_sentence_score(get_connection(self.db_path), sentence)
+
+    def get_cognate_words(self, sentence: str) -> Optional[List[str]]:
+        return get_cognate_words(get_connection(self.db_path), sentence)
+
+class _Partition:
+    """The stories of one language, sorted by mean difficulty so that selection is a binary search."""
+
+    def __init__(self, stories: List[Dict]):
+        self.stories = sorted(stories, key=lambda story: story['difficulty'])
+        self.difficulties = [story['difficulty'] for story in self.stories]
+        self.filenames = {story['filename'] for story in self.stories}
+
+    def get_story_candidates(self, target_difficulty: float, seen_stories: List[str], tolerance: float) -> Optional[str]:
+        seen = set(seen_stories)
+        if sum(1 for filename in seen if filename in self.filenames) >= len(self.stories):
+            seen = set()
+
+        lo = bisect.bisect_left(self.difficulties, target_difficulty - tolerance)
+        hi = bisect.bisect_right(self.difficulties, target_difficulty + tolerance)
+        candidates = [story['filename'] for story in self.stories[lo:hi] if story['filename'] not in seen]
+        if candidates:
+            return random.choice(candidates)
+
+        # If no stories within tolerance, walk outwards from the target to the closest unseen story
+        above = bisect.bisect_left(self.difficulties, target_difficulty)
+        below = above - 1
+        while below >= 0 or above < len(self.stories):
+            below_distance = target_difficulty - self.difficulties[below] if below >= 0 else math.inf
+            above_distance = self.difficulties[above] - target_difficulty if above < len(self.stories) else math.inf
+            # Ties go to the lower difficulty, like story_db.get_story_candidates
+            if below_distance <= above_distance:
+                story, below = self.stories[below], below - 1
+            else:
+                story, above = self.stories[above], above + 1
+            if story['filename'] not in seen:
+                return story['filename']
+        return None
+
+class MemoryCatalog:
+    """
+    The whole catalog loaded into memory, partitioned by language, with each language's
+    stories sorted by mean difficulty so that selection is a binary search over that
+    language only. Meant to be loaded once in the gunicorn master before forking, so
+    the workers share it copy-on-write.
+    """
+
+    def __init__(self, stories: List[Dict], references: Optional[Dict[str, Dict]] = None):
+        self.stories = sorted(stories, key=lambda story: story['filename'])
+        self.by_filename = {story['filename']: story for story in self.stories}
+        by_language: Dict[str, List[Dict]] = {}
+        for story in self.stories:
+            by_language.setdefault(story.get('language', DEFAULT_LANGUAGE), []).append(story)
+        self.partitions = {language: _Partition(stories) for language, stories in by_language.items()}
+        self.references = references or {}
+        self.sentence_scores = {}
+        self.sentence_cognates = {}
+        for story in self.stories:
+            for sentence_data in story.get('sentences', []):
+                self.sentence_scores.setdefault(sentence_data['sentence'], sentence_data['actual_score'])
+                self.sentence_cognates.setdefault(
+                    sentence_data['sentence'], [word for _, _, word in sentence_data.get('cognates', [])]
+                )
+
+    @classmethod
+    def load(cls, db_path: str = STORY_DB) -> 'MemoryCatalog':
+        # A private connection, closed again so no handle is inherited by forked workers
+        conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+        conn.row_factory = sqlite3.Row
+        stories = {}
+        for row in conn.execute("SELECT id, filename, language, mean_difficulty, num_sentences FROM stories"):
+            stories[row['id']] = {
+                'filename': row['filename'],
+                'language': row['language'],
+                'difficulty': row['mean_difficulty'],
+                'num_sentences': row['num_sentences'],
+                'sentences': [],
+            }
+        references = {}
+        for row in conn.execute(
+            "SELECT story_id, sentence, actual_score, html, cognates, reference_translation, alignment "
+            "FROM sentences ORDER BY story_id, position"
+        ):
+            stories[row['story_id']]['sentences'].append(_sentence_payload(row))
+            if row['reference_translation'] is not None and row['sentence'] not in references:
+                references[row['sentence']] = {
+                    'translation': row['reference_translation'],
+                    'alignment': json.loads(row['alignment'] or '[]'),
+                }
+        conn.close()
+        return cls(list(stories.values()), references)
+
+    def __len__(self) -> int:
+        return len(self.stories)
+
+    def get_story_candidates(self, target_difficulty: float, seen_stories: List[str], tolerance: float = 0.3,
+                             language: str = DEFAULT_LANGUAGE) -> Optional[str]:
+        """Same selection rules as story_db.get_story_candidates."""
+        partition = self.partitions.get(language)
+        if partition is None:
+            return None
+        return partition.get_story_candidates(target_difficulty, seen_stories, tolerance)
+
+    def get_story_list(self, language: Optional[str] = None) -> List[Dict]:
+        return [
+            {'filename': story['filename'], 'language': story.get('language', DEFAULT_LANGUAGE),
+             'difficulty': story['difficulty'], 'num_sentences': story['num_sentences']}
+            for story in self.stories
+            if language is None or story.get('language', DEFAULT_LANGUAGE) == language
+        ]
+
+    def get_story_summary(self, filename: str) -> Optional[Dict]:
+        story = self.by_filename.get(filename)
+        if story is None:
+            return None
+        return {'difficulty': story['difficulty'], 'num_sentences': story['num_sentences']}
+
+    def get_sentence(self, filename: str, position: int) -> Optional[Dict]:
+        story = self.by_filename.get(filename)
+        if story is None or not 0 <= position < len(story['sentences']):
+            return None
+        return story['sentences'][position]
+
+    def get_story_sentences(self, filename: str) -> Optional[List[Dict]]:
+        story = self.by_filename.get(filename)
+        return None if story is None else story['sentences']
+
+    def get_reference(self, sentence: str) -> Optional[Dict]:
+        return self.references.get(sentence)
+
+    def get_sentence_score(self, sentence: str) -> Optional[float]:
+        return self.sentence_scores.get(sentence)
+
+    def get_cognate_words(self, sentence: str) -> Optional[List[str]]:
+        return self.sentence_cognates.get(sentence)
+
+# The app rebuilds the catalog on its own when batch_stories/ changes (see
+# catalog_is_stale); running this module forces a rebuild, e.g. as a deploy step.
+if __name__ == "__main__":
+    count = import_stories()
+    print(f"Imported {count} stories from {STORIES_DIR} into {STORY_DB}")
@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+# Keep the app's databases out of the working tree while testing
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault('STORY_DB', os.path.join(_tmp, 'stories.db'))
+os.environ.setdefault('LEARNER_DB', os.path.join(_tmp, 'learners.db'))
+os.environ.setdefault('DEMAND_DB', os.path.join(_tmp, 'demand.db'))
+os.environ.setdefault('COALESCE_DB', os.path.join(_tmp, 'coalesce.db'))
+os.environ.setdefault('OPENAI_API_KEY_COGNATEFUL', 'test')
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+os.chdir(ROOT)
@@ -0,0 +1,193 @@
+import json
+import sqlite3
+import time
+from types import SimpleNamespace
+
+import pytest
+
+app_module = pytest.importorskip('app')
+
+def fake_completion(content):
+    usage = SimpleNamespace(prompt_tokens=10, completion_tokens=5, total_tokens=15)
+    return SimpleNamespace(usage=usage, choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+def test_batch_scoring_uses_one_llm_call(client, monkeypatch):
+    calls = []
+    results = [
+        {'is_correct': True, 'incorrect_morphemes': [], 'reasoning': 'ok'},
+        {'is_correct': False, 'incorrect_morphemes': ['manger'], 'reasoning': 'wrong verb'},
+    ]
+
+    def create_completion(prompt, **kwargs):
+        calls.append(prompt)
+        return fake_completion(json.dumps(results))
+
+    monkeypatch.setattr(app_module, 'create_completion', create_completion)
+    response = client.post('/score_translation_batch', json={'items': [
+        {'original': 'Bonjour', 'translation': 'Hello'},
+        {'original': 'Je veux manger', 'translation': 'I want to sing'},
+    ]})
+
+    assert len(calls) == 1
+    assert [r['isCorrect'] for r in response.json['results']] == [True, False]
+    assert response.json['results'][1]['wrongMorphemes'] == ['manger']
+
+def test_malformed_batch_items_are_graded_provisionally(client, monkeypatch):
+    answer = [{'is_correct': True, 'incorrect_morphemes': []}, "correct"]
+    monkeypatch.setattr(app_module, 'create_completion', lambda prompt, **kwargs: fake_completion(json.dumps(answer)))
+    response = client.post('/score_translation_batch', json={'items': [
+        {'original': 'Bonjour', 'translation': 'Hello'},
+        {'original': 'Je veux manger', 'translation': 'I want to eat'},
+    ]})
+    assert all(result['provisional'] for result in response.json['results'])
+
+def test_batch_scoring_validates_input(client):
+    assert client.post('/score_translation_batch', json={'items': []}).status_code == 400
+    assert client.post('/score_translation_batch', json={'items': [{'original': 'a'}]}).status_code == 400
+
+def fake_stream(content, pieces=4):
+    size = -(-len(content) // pieces)
+    for i in range(0, len(content), size):
+        yield SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=content[i:i + size]))])
+    usage = SimpleNamespace(prompt_tokens=10, completion_tokens=5, total_tokens=15)
+    yield SimpleNamespace(usage=usage, choices=[])
+
+def test_stream_scoring_sends_verdict_first(client, monkeypatch):
+    content = json.dumps({'is_correct': False, 'incorrect_morphemes': ['manger'], 'reasoning': 'wrong verb'})
+    completions = SimpleNamespace(create=lambda **kwargs: fake_stream(content))
+    monkeypatch.setattr(app_module, 'get_client', lambda: SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+
+    response = client.post('/score_translation_stream', json={'original': 'Je veux manger', 'translation': 'I want to sing'})
+    events = [block.split('\n') for block in response.get_data(as_text=True).strip().split('\n\n')]
+
+    assert [lines[0] for lines in events] == ['event: verdict', 'event: morphemes', 'event: done']
+    assert json.loads(events[0][1][len('data: '):]) == {'isCorrect': False}
+    assert json.loads(events[2][1][len('data: '):])['wrongMorphemes'] == ['manger']
+
+def test_stream_timing_excludes_time_spent_at_yields(monkeypatch):
+    content = json.dumps({'is_correct': False, 'incorrect_morphemes': ['manger'], 'reasoning': 'wrong verb'})
+    completions = SimpleNamespace(create=lambda **kwargs: fake_stream(content))
+    monkeypatch.setattr(app_module, 'get_client', lambda: SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    stages = {}
+    monkeypatch.setattr(app_module.metrics, 'record_stage', lambda stage, elapsed: stages.setdefault(stage, elapsed))
+
+    for _ in app_module.stream_score_translation('Je veux manger', 'I want to sing'):
+        time.sleep(0.1)  # A slow client
+    assert set(stages) == {'llm', 'llm_first_token'}
+    assert stages['llm_first_token'] <= stages['llm'] < 0.1
+
+def test_scoring_uses_the_reference_translation(client, monkeypatch):
+    reference = {'translation': 'I want to eat.', 'alignment': [['Je', 'I'], ['veux', 'want'], ['manger', 'to eat']]}
+    monkeypatch.setattr(app_module, 'catalog', app_module.story_db.MemoryCatalog([], {'Je veux manger.': reference}))
+    calls = []
+
+    def create_completion(prompt, model=app_module.SENTENCE_SCORING_MODEL, **kwargs):
+        calls.append(model)
+        return fake_completion(json.dumps({'is_correct': False, 'wrong_pairs': [2, 7]}))
+
+    monkeypatch.setattr(app_module, 'create_completion', create_completion)
+    response = client.post('/score_translation', json={'original': 'Je veux manger.', 'translation': 'I want to sleep.'})
+
+    assert calls == [app_module.REFERENCE_SCORING_MODEL]
+    assert response.json['isCorrect'] is False
+    # Pair numbers are mapped back to the French words locally; out-of-range ones are dropped
+    assert response.json['wrongMorphemes'] == ['manger']
+
+def test_scoring_updates_the_learner_model(client, monkeypatch):
+    monkeypatch.setattr(app_module, 'create_completion', lambda prompt, **kwargs: fake_completion(
+        json.dumps({'is_correct': True, 'incorrect_morphemes': [], 'reasoning': 'ok'})
+    ))
+    response = client.post('/score_translation', json={
+        'original': 'Le docteur arrive.', 'translation': 'The doctor arrives.', 'learnerId': 'learner-1'
+    })
+
+    assert response.json['userDifficulty'] < app_module.learner_model.INITIAL_ABILITY
+    assert app_module.learner_model.get_ability('learner-1') == response.json['userDifficulty']
+
+def test_story_selection_survives_learner_model_errors(client, monkeypatch):
+    def get_ability(*args, **kwargs):
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(app_module.learner_model, 'get_ability', get_ability)
+    response = client.post('/get-sentence', json={
+        'needNewStory': True, 'lang': 'fr', 'userDifficulty': 2.0, 'learnerId': 'learner-3'
+    })
+    assert response.status_code == 200
+    assert response.json['userDifficulty'] == 2.0
+
+def test_unsupported_languages_are_rejected(client):
+    assert client.post('/get-sentence', json={'needNewStory': True, 'lang': 'xx'}).status_code == 400
+    assert client.get('/story_list?lang=xx').status_code == 400
+    assert client.post('/score_translation', json={'original': 'a', 'translation': 'b', 'lang': 'xx'}).status_code == 400
+
+def test_story_list_filters_by_language(client):
+    stories = client.get('/story_list?lang=fr').json
+    assert stories and all(story['language'] == 'fr' for story in stories)
+
+def test_story_details_are_pre_rendered(client):
+    title = client.get('/story_list?lang=fr').json[0]['title']
+    sentences = client.get(f'/story_list/{title}').json['sentences']
+    assert all('html' in sentence and 'cognates' in sentence for sentence in sentences)
+    assert any('<span class="highlight">' in sentence['html'] for sentence in sentences)
+
+def test_vocabulary_index_picks_among_its_top_stories(monkeypatch):
+    filename = app_module.catalog.get_story_list('fr')[0]['filename']
+    index = SimpleNamespace(top_stories=lambda *args: [('missing.json', 1.0), (filename, 0.5)])
+    monkeypatch.setattr(app_module, 'vocab', index)
+    assert app_module.get_story_candidates(1.0, ['seen.json'], 3.0, 'fr') == filename
+    # Stories the rebuilt catalog no longer has fall back to the catalog's own pick
+    monkeypatch.setattr(app_module, 'vocab', SimpleNamespace(top_stories=lambda *args: [('missing.json', 1.0)]))
+    assert app_module.get_story_candidates(1.0, ['seen.json'], 3.0, 'fr') is not None
+    # So do stories whose difficulty changed since the index was built
+    story = app_module.catalog.get_story_list('fr')[0]
+    monkeypatch.setattr(app_module, 'vocab', SimpleNamespace(top_stories=lambda *args: [(story['filename'], 1.0)]))
+    monkeypatch.setattr(app_module.catalog, 'get_story_candidates', lambda *args: 'fallback.json')
+    assert app_module.get_story_candidates(story['difficulty'] + 1.0, ['seen.json'], 0.3, 'fr') == 'fallback.json'
+
+@pytest.fixture
+def failing_llm(monkeypatch):
+    """An OpenAI client whose every call times out, and a fresh breaker in front of it."""
+    import httpx
+    import openai
+
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        raise openai.APITimeoutError(request=httpx.Request('POST', 'https://api.openai.com/v1/chat/completions'))
+
+    monkeypatch.setattr(app_module, 'get_client', lambda: SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create))))
+    monkeypatch.setattr(app_module, 'llm_breaker', app_module.circuit_breaker.CircuitBreaker('openai', failure_threshold=3))
+    monkeypatch.setattr(app_module.circuit_breaker.time, 'sleep', lambda seconds: None)
+    return calls
+
+def test_llm_failures_fall_back_to_a_provisional_grade(client, failing_llm):
+    response = client.post('/score_translation', json={
+        'original': 'Le concert était fantastique.', 'translation': 'The concert was fantastic.', 'learnerId': 'learner-2'
+    })
+    assert response.status_code == 200
+    assert response.json['provisional'] is True
+    assert 'userDifficulty' not in response.json
+    assert app_module.learner_model.get_ability('learner-2') is None
+    assert len(failing_llm) == app_module.LLM_MAX_ATTEMPTS
+    assert all(call['timeout'] <= app_module.LLM_TIMEOUT for call in failing_llm)
+
+    # The breaker is now open: no more calls, and the health check says so
+    assert client.post('/score_translation', json={'original': 'Bonjour', 'translation': 'Hello'}).json['provisional']
+    assert len(failing_llm) == app_module.LLM_MAX_ATTEMPTS
+    health = client.get('/health').json
+    assert health['status'] == 'degraded' and health['llm']['state'] == 'open'
+
+def test_stream_and_batch_scoring_fall_back_too(client, failing_llm):
+    response = client.post('/score_translation_stream', json={'original': 'Bonjour', 'translation': 'Hello'})
+    events = [block.split('\n') for block in response.get_data(as_text=True).strip().split('\n\n')]
+    assert [lines[0] for lines in events] == ['event: verdict', 'event: morphemes', 'event: done']
+    assert json.loads(events[0][1][len('data: '):])['provisional'] is True
+
+    response = client.post('/score_translation_batch', json={'items': [{'original': 'Bonjour', 'translation': 'Hello'}]})
+    assert response.status_code == 200
+    assert response.json['results'][0]['provisional'] is True
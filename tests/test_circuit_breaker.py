@@ -0,0 +1,95 @@
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(circuit_breaker.time, 'sleep', lambda seconds: None)
+
+def failing(error=ConnectionError):
+    def fn(timeout):
+        raise error("upstream down")
+    return fn
+
+def test_breaker_opens_after_consecutive_failures_and_rejects_calls():
+    clock = Clock()
+    breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=10, clock=clock)
+    with pytest.raises(ConnectionError):
+        breaker.call(failing(), deadline=5, max_attempts=3)
+    assert breaker.state == circuit_breaker.OPEN
+
+    calls = []
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda timeout: calls.append(timeout), deadline=5)
+    assert calls == []
+    assert breaker.snapshot()['retry_in'] == 10
+
+def test_half_open_trial_closes_or_reopens_the_breaker():
+    clock = Clock()
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=10, clock=clock)
+    with pytest.raises(ConnectionError):
+        breaker.call(failing(), deadline=5, max_attempts=1)
+
+    clock.now = 10
+    assert breaker.state == circuit_breaker.HALF_OPEN
+    with pytest.raises(ConnectionError):
+        breaker.call(failing(), deadline=5, max_attempts=3)  # the failed trial reopens it at once
+    assert breaker.state == circuit_breaker.OPEN
+
+    clock.now = 20
+    assert breaker.allow_request()
+    assert not breaker.allow_request()  # only one trial at a time
+    breaker.record_success()
+    assert breaker.state == circuit_breaker.CLOSED
+
+def test_transient_failures_are_retried_with_the_remaining_time():
+    clock = Clock()
+    breaker = CircuitBreaker('test', clock=clock)
+    timeouts, retries = [], []
+
+    def flaky(timeout):
+        timeouts.append(timeout)
+        clock.now += 2
+        if len(timeouts) < 3:
+            raise TimeoutError("slow")
+        return 'ok'
+
+    assert breaker.call(flaky, deadline=10, max_attempts=3, on_retry=retries.append) == 'ok'
+    assert timeouts == [10, 8, 6]
+    assert len(retries) == 2
+    assert breaker.snapshot()['consecutive_failures'] == 0
+
+def test_rejected_requests_are_not_retried_or_counted():
+    breaker = CircuitBreaker('test', failure_threshold=1)
+    attempts = []
+
+    def bad_request(timeout):
+        attempts.append(timeout)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        breaker.call(bad_request, deadline=5, is_failure=lambda e: not isinstance(e, ValueError))
+    assert len(attempts) == 1
+    assert breaker.state == circuit_breaker.CLOSED
+
+def test_retries_stop_at_the_deadline():
+    clock = Clock()
+    breaker = CircuitBreaker('test', clock=clock)
+    attempts = []
+
+    def slow(timeout):
+        attempts.append(timeout)
+        clock.now += timeout
+        raise TimeoutError("slow")
+
+    with pytest.raises(TimeoutError):
+        breaker.call(slow, deadline=5, max_attempts=3)
+    assert attempts == [5]
@@ -0,0 +1,122 @@
+import threading
+import time
+
+import pytest
+
+import coalesce
+import local_db
+
+@pytest.fixture(autouse=True)
+def coalesce_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(coalesce, 'COALESCE_DB', str(tmp_path / 'coalesce.db'))
+    monkeypatch.setattr(local_db, '_local', threading.local())
+
+def test_concurrent_identical_calls_share_one_call():
+    calls = []
+
+    def fn():
+        calls.append(1)
+        time.sleep(0.2)
+        return {'is_correct': True}
+
+    results = []
+    inputs = [('Bonjour le monde.', 'Hello world'), ('bonjour  le monde', 'hello world!')] * 3
+    threads = [
+        threading.Thread(target=lambda parts=parts: results.append(coalesce.single_flight('t', parts, fn)))
+        for parts in inputs
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{'is_correct': True}] * len(inputs)
+
+def test_recent_result_is_reused_across_connections():
+    assert coalesce.single_flight('t', ('a', 'b'), lambda: 1) == 1
+    # A fresh connection stands in for another gunicorn worker
+    local_db._local = threading.local()
+    assert coalesce.single_flight('t', ('a', 'b'), lambda: 2) == 1
+
+def test_error_is_not_cached():
+    def fail():
+        raise RuntimeError('upstream down')
+
+    with pytest.raises(RuntimeError):
+        coalesce.single_flight('t', ('a', 'b'), fail)
+    assert coalesce.single_flight('t', ('a', 'b'), lambda: {'ok': True}) == {'ok': True}
+
+def test_waiting_followers_get_the_error():
+    started = threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.2)
+        raise RuntimeError('upstream down')
+
+    errors = []
+
+    def call():
+        try:
+            coalesce.single_flight('t', ('a', 'b'), fail)
+        except Exception as e:
+            errors.append(type(e))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(target=call) for _ in range(2)]
+    for thread in followers:
+        thread.start()
+    for thread in [leader] + followers:
+        thread.join()
+
+    assert sorted(e.__name__ for e in errors) == ['CoalescedError', 'CoalescedError', 'RuntimeError']
+
+def test_interrupted_leader_releases_key():
+    def interrupted():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        coalesce.single_flight('t', ('a', 'b'), interrupted)
+    start = time.time()
+    assert coalesce.single_flight('t', ('a', 'b'), lambda: 3) == 3
+    assert time.time() - start < 1
+
+def test_in_process_followers_stop_waiting_on_a_slow_leader(monkeypatch):
+    monkeypatch.setattr(coalesce, 'FOLLOWER_WAIT', 0.1)
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait()
+        return 'leader'
+
+    leader = threading.Thread(target=coalesce.single_flight, args=('t', ('a', 'b'), slow))
+    leader.start()
+    started.wait()
+    try:
+        assert coalesce.single_flight('t', ('a', 'b'), lambda: 'follower') == 'follower'
+    finally:
+        release.set()
+        leader.join()
+
+def test_followers_of_an_interrupted_leader_get_an_error():
+    started = threading.Event()
+
+    def interrupted():
+        started.set()
+        time.sleep(0.2)
+        raise KeyboardInterrupt
+
+    def lead():
+        with pytest.raises(KeyboardInterrupt):
+            coalesce.single_flight('t', ('a', 'b'), interrupted)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    started.wait()
+    with pytest.raises(coalesce.CoalescedError):
+        coalesce.single_flight('t', ('a', 'b'), lambda: 'follower')
+    leader.join()
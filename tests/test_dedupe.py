@@ -0,0 +1,29 @@
+from dedupe import NearDuplicateIndex, dedupe_corpus
+
+NETFLIX = "Netflix est une plateforme de streaming qui propose un large catalogue de films, séries et documentaires."
+
+def test_finds_known_near_duplicates():
+    index = NearDuplicateIndex()
+    assert index.add(NETFLIX)
+    assert index.add("Un célèbre artiste moderne organise une exposition à Paris.")
+
+    match = index.find_duplicate("Netflix est une plateforme de streaming qui propose un grand catalogue de films, séries et documentaires !")
+    assert match is not None and match[0] == NETFLIX
+    assert index.is_duplicate("Un célèbre artiste moderne organise une grande exposition à Paris.")
+    assert index.is_duplicate(NETFLIX.upper())
+
+def test_distinct_sentences_are_kept():
+    index = NearDuplicateIndex()
+    index.add(NETFLIX)
+    assert not index.is_duplicate("Le pêcheur lève les filets au matin.")
+    assert index.add("Le pêcheur lève les filets au matin.")
+    assert len(index) == 2
+
+def test_batch_dedupe():
+    kept, duplicates = dedupe_corpus([
+        ('a.csv', NETFLIX),
+        ('b.csv', NETFLIX.replace('large', 'grand')),
+        ('c.csv', "Le vent froid souffle du nord."),
+    ])
+    assert [source for source, _ in kept] == ['a.csv', 'c.csv']
+    assert duplicates == [('b.csv', NETFLIX.replace('large', 'grand'), NETFLIX)]
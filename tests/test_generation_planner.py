@@ -0,0 +1,37 @@
+import pytest
+
+import generation_planner
+from generation_planner import GenerationPlanner
+
+def test_bands_cover_the_score_range():
+    assert generation_planner.band_of(0.0) == 0
+    assert generation_planner.band_of(1.0) == 2
+    assert generation_planner.band_of(3.0) == len(generation_planner.BAND_EDGES) - 1
+
+def test_without_demand_the_thinnest_band_is_filled_first():
+    planner = GenerationPlanner(supply=[5, 0, 5, 5, 5, 5], selections=[0] * 6, misses=[0] * 6)
+    assert planner.next_band() == 1
+
+def test_misses_outweigh_supply():
+    planner = GenerationPlanner(supply=[1, 1, 1, 1, 10, 10], selections=[0, 0, 0, 0, 20, 0], misses=[0, 0, 0, 0, 10, 0])
+    assert planner.next_band() == 4
+
+def test_plan_spreads_over_bands_as_they_fill():
+    planner = GenerationPlanner(supply=[0] * 6, selections=[0] * 6, misses=[0] * 6)
+    assert sorted(planner.plan(4)) == [0, 1, 1, 2]
+    # Planning doesn't change the planner itself
+    assert planner.supply == [0] * 6
+
+def test_generation_target_uses_calibration():
+    planner = GenerationPlanner([0] * 6, [0] * 6, [0] * 6, calibration={0: 1.0, 1: 1.8, 2: 2.1, 3: 2.6})
+    assert planner.generation_target(generation_planner.band_of(0.9)) == 0
+    assert planner.generation_target(generation_planner.band_of(2.8)) == 3
+
+def test_selections_are_recorded_per_band(tmp_path):
+    db_path = str(tmp_path / 'demand.db')
+    generation_planner.record_selection(0.2, True, db_path)
+    generation_planner.record_selection(0.3, False, db_path)
+    generation_planner.record_selection(2.9, False, db_path)
+    selections, misses = generation_planner.demand_by_band(db_path)
+    assert selections == [2, 0, 0, 0, 0, 1]
+    assert misses == [1, 0, 0, 0, 0, 0]
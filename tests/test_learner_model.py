@@ -0,0 +1,63 @@
+import sqlite3
+
+import pytest
+
+import learner_model
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'learners.db')
+
+def test_new_learners_have_no_estimate(db_path):
+    assert learner_model.get_ability('nobody', db_path) is None
+
+def test_success_probability_is_target_at_own_level():
+    assert learner_model.success_probability(1.5, 1.5) == pytest.approx(learner_model.TARGET_SUCCESS)
+    # Higher scores are easier sentences
+    assert learner_model.success_probability(1.5, 2.5) > learner_model.success_probability(1.5, 0.5)
+
+def test_correct_answers_move_learners_to_harder_stories(db_path):
+    for _ in range(10):
+        learner_model.record_answer('a', 'Le chat mange.', 1.0, True, db_path)
+        learner_model.record_answer('b', 'Le chat mange.', 1.0, False, db_path)
+    assert learner_model.get_ability('a', db_path) < learner_model.INITIAL_ABILITY
+    assert learner_model.get_ability('b', db_path) == learner_model.MAX_SCORE
+    assert learner_model.get_ability('a', db_path) >= learner_model.MIN_SCORE
+
+def test_surprising_outcomes_update_the_sentence(db_path):
+    learner_model.record_answer('a', 'Le président arrive.', 2.0, False, db_path)
+    conn = learner_model._get_connection(db_path)
+    difficulty, answers = conn.execute(
+        "SELECT difficulty, answers FROM sentence_difficulty WHERE sentence = ?", ('Le président arrive.',)
+    ).fetchone()
+    # A learner at the easiest level missed it: it is harder (lower score) than rated
+    assert difficulty < 2.0 and answers == 1
+
+def test_sentences_outside_the_catalog_only_update_the_learner(db_path):
+    result = learner_model.record_answer('a', 'Not in the catalog.', None, True, db_path)
+    assert result['answers'] == 1
+    conn = learner_model._get_connection(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM sentence_difficulty").fetchone()[0] == 0
+
+def test_abilities_are_kept_per_language(db_path):
+    learner_model.record_answer('a', 'El médico llega.', 2.0, True, db_path, language='es')
+    assert learner_model.get_ability('a', db_path, language='es') < learner_model.INITIAL_ABILITY
+    assert learner_model.get_ability('a', db_path) is None
+
+def test_sentence_difficulties_are_kept_per_language(db_path):
+    learner_model.record_answer('a', 'Hotel Central.', 2.0, False, db_path, language='es')
+    learner_model.record_answer('b', 'Hotel Central.', 2.0, False, db_path, language='it')
+    conn = learner_model._get_connection(db_path)
+    assert conn.execute(
+        "SELECT language, answers FROM sentence_difficulty ORDER BY language"
+    ).fetchall() == [('es', 1), ('it', 1)]
+
+def test_older_sentence_difficulties_are_dropped(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE sentence_difficulty (sentence TEXT PRIMARY KEY, difficulty REAL NOT NULL, answers INTEGER NOT NULL)")
+    conn.execute("INSERT INTO sentence_difficulty VALUES ('Le chat.', 1.0, 3)")
+    conn.commit()
+    conn.close()
+    learner_model.record_answer('a', 'Le chat.', 2.0, True, db_path)
+    conn = learner_model._get_connection(db_path)
+    assert conn.execute("SELECT language, answers FROM sentence_difficulty").fetchall() == [('fr', 1)]
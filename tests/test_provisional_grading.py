@@ -0,0 +1,25 @@
+import provisional_grading
+
+REFERENCE = {
+    'translation': 'Do you want to go eat with me?',
+    'alignment': [['Voulez', 'Do ... want'], ['vous', 'you'], ['aller', 'to go'], ['manger', 'eat'],
+                  ['avec', 'with'], ['moi', 'me']],
+}
+
+def test_reference_grading_finds_missing_words():
+    assert provisional_grading.grade_with_reference('Do you want to go and eat with me?', REFERENCE)['is_correct']
+    result = provisional_grading.grade_with_reference('Do you want to go sing with me?', REFERENCE)
+    assert not result['is_correct']
+    assert result['incorrect_morphemes'] == ['manger']
+    assert result['provisional']
+
+def test_cognate_grading_matches_accented_and_inflected_cognates():
+    original = "Le concert était absolument fantastique"
+    cognates = ['concert', 'absolument', 'fantastique']
+    assert provisional_grading.grade_with_cognates(original, 'The concert was absolutely fantastic', cognates)['is_correct']
+    result = provisional_grading.grade_with_cognates(original, 'The show was great', cognates)
+    assert not result['is_correct'] and result['incorrect_morphemes'] == cognates
+
+def test_without_cognates_only_the_length_is_checked():
+    assert provisional_grading.grade_with_cognates('Je mange une pomme', 'I eat an apple', None)['is_correct']
+    assert not provisional_grading.grade_with_cognates('Je mange une pomme', 'Yes', [])['is_correct']
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+import rescore_stories
+
+def write_story(directory, filename, scores, scoring_model='gpt-4o'):
+    story = {
+        'story': [{'sentence': f"Phrase {i}.", 'actual_score': score} for i, score in enumerate(scores)],
+        'metadata': {'scoring_model': scoring_model, 'actual_difficulty_mean': sum(scores) / len(scores)},
+    }
+    (directory / filename).write_text(json.dumps(story), encoding='utf-8')
+
+def test_agreement_of_identical_scores():
+    stats = rescore_stories.agreement([(0, 0), (1, 1), (2, 2), (3, 3)])
+    assert stats['exact'] == 1.0
+    assert stats['weighted_kappa'] == pytest.approx(1.0)
+    assert stats['confusion'][2] == [0, 0, 1, 0]
+
+def test_agreement_of_shifted_scores():
+    stats = rescore_stories.agreement([(0, 1), (1, 2), (2, 3), (3, 3)])
+    assert stats['exact'] == 0.25
+    assert stats['within_one'] == 1.0
+    assert stats['mean_shift'] == pytest.approx(0.75)
+    assert 0 < stats['weighted_kappa'] < 1
+
+def test_requests_are_packed_per_language():
+    sentences = [{'language': 'fr' if i % 3 else 'es', 'sentence': str(i)} for i in range(7)]
+    batches = list(rescore_stories.pack_requests(sentences, batch_size=2))
+    assert all(len({item['language'] for item in batch}) == 1 for _, batch in batches)
+    assert sorted(len(batch) for _, batch in batches) == [1, 2, 2, 2]
+
+def test_batch_results_are_written_back(tmp_path):
+    write_story(tmp_path, 'fr_story.json', [0, 2])
+    batches = list(rescore_stories.pack_requests(rescore_stories.iter_sentences(str(tmp_path))))
+    manifest_path = rescore_stories.write_batch_file(batches, 'o1-preview', str(tmp_path / 'requests.jsonl'))
+    manifest = json.loads((tmp_path / 'requests.jsonl.manifest.json').read_text(encoding='utf-8'))
+    assert manifest_path.endswith('.manifest.json')
+
+    answer = [{'sentence': 'Phrase 0.', 'score': 1, 'reasoning': '', 'cognate_words': []},
+              {'sentence': 'Phrase 1.', 'score': 2, 'reasoning': '', 'cognate_words': ['phrase']}]
+    output = {'custom_id': 'rescore-00000', 'response': {'status_code': 200, 'body': {
+        'choices': [{'message': {'content': json.dumps(answer)}}]}}}
+    (tmp_path / 'results.jsonl').write_text(json.dumps(output) + '\n', encoding='utf-8')
+
+    scores = rescore_stories.read_batch_results(str(tmp_path / 'results.jsonl'), manifest)
+    pairs = rescore_stories.apply_scores(scores, manifest['model'], str(tmp_path))
+    assert sorted(pairs) == [(0, 1), (2, 2)]
+
+    story = json.loads((tmp_path / 'fr_story.json').read_text(encoding='utf-8'))
+    assert [s['actual_score'] for s in story['story']] == [1, 2]
+    assert story['story'][0]['score_history'] == [{'scoring_model': 'gpt-4o', 'actual_score': 0}]
+    assert story['metadata']['scoring_model'] == 'o1-preview'
+    assert story['metadata']['actual_difficulty_mean'] == 1.5
+
+def test_changed_sentences_and_dry_runs_are_left_alone(tmp_path):
+    write_story(tmp_path, 'fr_story.json', [0, 2])
+    before = (tmp_path / 'fr_story.json').read_text(encoding='utf-8')
+    scores = {('fr_story.json', 0): {'sentence': 'Une autre phrase.', 'score': 3, 'reasoning': '', 'cognate_words': []},
+              ('fr_story.json', 1): {'sentence': 'Phrase 1.', 'score': 3, 'reasoning': '', 'cognate_words': []}}
+    assert rescore_stories.apply_scores(scores, 'o1-preview', str(tmp_path), dry_run=True) == [(2, 3)]
+    assert (tmp_path / 'fr_story.json').read_text(encoding='utf-8') == before
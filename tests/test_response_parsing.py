@@ -0,0 +1,43 @@
+import pytest
+
+import metrics
+import response_parsing
+from response_parsing import ResponseParseError, parse_json
+
+def parse_count(source, outcome):
+    return metrics.counter_values('llm_parse_total').get((('outcome', outcome), ('source', source)), 0)
+
+def test_clean_json_is_parsed_without_repairs():
+    assert parse_json('{"is_correct": true}', expect=dict, source='t_clean') == {'is_correct': True}
+    assert parse_count('t_clean', 'ok') == 1
+
+@pytest.mark.parametrize('text', [
+    '```json\n{"score": 2, "words": ["a", "b",],}\n```',
+    'Here is the result:\n{"score": 2, "words": ["a", "b"]}\nHope this helps!',
+    '```\n{"score": 2, "words": ["a", "b"]}\n```',
+])
+def test_formatting_slips_are_repaired(text):
+    assert parse_json(text, expect=dict, source='t_repair') == {'score': 2, 'words': ['a', 'b']}
+
+def test_repairs_are_counted():
+    parse_json('```json\n[1, 2,]\n```', expect=list, source='t_counted')
+    repairs = metrics.counter_values('llm_parse_repairs_total')
+    assert repairs[(('repair', 'fence'), ('source', 't_counted'))] == 1
+    assert repairs[(('repair', 'trailing_comma'), ('source', 't_counted'))] == 1
+    assert parse_count('t_counted', 'repaired') == 1
+
+def test_wrong_shapes_are_rejected():
+    with pytest.raises(ResponseParseError):
+        parse_json('[1, 2]', expect=list, length=3, source='t_shape')
+    with pytest.raises(ResponseParseError):
+        parse_json('[1, 2]', expect=dict, source='t_shape')
+    with pytest.raises(ResponseParseError):
+        parse_json('not json at all', source='t_shape')
+    assert parse_count('t_shape', 'failed') == 3
+    assert response_parsing.try_parse_json('not json', source='t_shape') is None
+
+def test_response_format_matches_model_support():
+    schema = {'type': 'object', 'properties': {}, 'required': [], 'additionalProperties': False}
+    assert response_parsing.response_format('gpt-4o', schema)['response_format']['type'] == 'json_schema'
+    assert response_parsing.response_format('gpt-4o-mini') == {'response_format': {'type': 'json_object'}}
+    assert response_parsing.response_format('o1-preview', schema) == {}
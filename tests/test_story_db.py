@@ -0,0 +1,145 @@
+import json
+import os
+import random
+import sqlite3
+import time
+
+import pytest
+
+import story_db
+
+def write_story(stories_dir, filename, scores, language='fr'):
+    story = {
+        'story': [
+            {'sentence': f'{filename} phrase {i}.', 'actual_score': score, 'actual_cognate_words': ['phrase']}
+            for i, score in enumerate(scores)
+        ],
+        'metadata': {'language': language},
+    }
+    with open(os.path.join(stories_dir, filename), 'w', encoding='utf-8') as f:
+        json.dump(story, f)
+
+@pytest.fixture
+def catalogs(tmp_path):
+    stories_dir = tmp_path / 'stories'
+    stories_dir.mkdir()
+    for i, scores in enumerate([[0, 0], [1, 1], [1, 2], [2, 2], [3, 3]]):
+        write_story(stories_dir, f'fr_story_{i}.json', scores)
+    db_path = str(tmp_path / 'stories.db')
+    with open(stories_dir / 'fr_story_1.json', encoding='utf-8') as f:
+        story = json.load(f)
+    story['story'][0].update({'reference_translation': 'Sentence 0.', 'alignment': [['phrase', 'sentence'], ['0', '0']]})
+    with open(stories_dir / 'fr_story_1.json', 'w', encoding='utf-8') as f:
+        json.dump(story, f)
+    story_db.import_stories(str(stories_dir), db_path)
+    return str(stories_dir), db_path, story_db.MemoryCatalog.load(db_path), story_db.SQLiteCatalog(db_path)
+
+CASES = [
+    (1.0, []),
+    (1.6, ['fr_story_2.json']),  # nothing unseen within tolerance, closest is story 3
+    (0.9, ['fr_story_1.json', 'fr_story_2.json']),
+    (-1.0, ['fr_story_0.json']),
+    (5.0, []),
+    (0.5, []),  # stories 0 and 1 are equally close: ties go to the lower difficulty
+    # every story seen: all become eligible again
+    (3.0, [f'fr_story_{i}.json' for i in range(5)]),
+]
+
+@pytest.mark.parametrize('target,seen', CASES)
+def test_memory_and_sqlite_catalogs_pick_the_same_story(catalogs, target, seen):
+    _, _, memory, sqlite = catalogs
+    for _ in range(5):
+        random.seed(0)
+        picked_memory = memory.get_story_candidates(target, seen)
+        random.seed(0)
+        picked_sqlite = sqlite.get_story_candidates(target, seen)
+        assert picked_memory == picked_sqlite
+
+def test_candidates_respect_seen_and_tolerance(catalogs):
+    _, _, memory, sqlite = catalogs
+    for catalog in (memory, sqlite):
+        assert catalog.get_story_candidates(1.6, ['fr_story_2.json']) == 'fr_story_3.json'
+        assert catalog.get_story_candidates(3.0, [f'fr_story_{i}.json' for i in range(5)]) == 'fr_story_4.json'
+        assert catalog.get_story_candidates(1.0, []) == 'fr_story_1.json'
+        assert catalog.get_story_candidates(0.5, []) == 'fr_story_0.json'
+
+def test_catalogs_serve_the_same_stories(catalogs):
+    _, _, memory, sqlite = catalogs
+    assert memory.get_story_list() == sqlite.get_story_list()
+    assert memory.get_story_sentences('fr_story_2.json') == sqlite.get_story_sentences('fr_story_2.json')
+    assert memory.get_sentence('fr_story_2.json', 1) == sqlite.get_sentence('fr_story_2.json', 1)
+    assert memory.get_sentence('fr_story_2.json', 2) is None and sqlite.get_sentence('fr_story_2.json', 2) is None
+    assert memory.get_story_summary('missing.json') is None and sqlite.get_story_summary('missing.json') is None
+    assert memory.get_sentence_score('fr_story_2.json phrase 1.') == sqlite.get_sentence_score('fr_story_2.json phrase 1.') == 2
+    assert memory.get_sentence_score('missing') is None and sqlite.get_sentence_score('missing') is None
+
+def test_catalogs_serve_reference_translations(catalogs):
+    _, _, memory, sqlite = catalogs
+    expected = {'translation': 'Sentence 0.', 'alignment': [['phrase', 'sentence'], ['0', '0']]}
+    for catalog in (memory, sqlite):
+        assert catalog.get_reference('fr_story_1.json phrase 0.') == expected
+        assert catalog.get_reference('fr_story_1.json phrase 1.') is None
+        assert catalog.get_reference('not in the catalog') is None
+
+def test_cognates_are_highlighted_at_build_time():
+    sentence = "L'atmosphère du Concert était <électrique>, l'atmosphère !"
+    cognates = story_db.find_cognates(sentence, ["l'atmosphère", 'atmosphère', 'concert', 'électrique', 'absent'])
+    assert cognates == [(0, 12, "l'atmosphère"), (16, 23, 'concert'), (31, 41, 'électrique'), (44, 56, "l'atmosphère")]
+    assert story_db.render_sentence(sentence, cognates) == (
+        '<span class="highlight">L\'atmosphère</span> du <span class="highlight">Concert</span> était '
+        '&lt;<span class="highlight">électrique</span>&gt;, <span class="highlight">l\'atmosphère</span> !'
+    )
+    # Only whole words count
+    assert story_db.find_cognates('Les concerts', ['concert']) == []
+
+def test_catalogs_serve_rendered_sentences(catalogs):
+    _, _, memory, sqlite = catalogs
+    for catalog in (memory, sqlite):
+        sentence_data = catalog.get_sentence('fr_story_2.json', 1)
+        assert sentence_data['html'] == 'fr_story_2.json <span class="highlight">phrase</span> 1.'
+        assert sentence_data['cognates'] == [[16, 22, 'phrase']]
+        assert catalog.get_story_sentences('fr_story_2.json')[1] == sentence_data
+        assert catalog.get_cognate_words('fr_story_2.json phrase 1.') == ['phrase']
+        assert catalog.get_cognate_words('not in the catalog') is None
+
+def test_languages_are_served_separately(tmp_path):
+    stories_dir = tmp_path / 'stories'
+    stories_dir.mkdir()
+    write_story(stories_dir, 'fr_story.json', [1, 1])
+    write_story(stories_dir, 'es_story.json', [1, 1], language='es')
+    write_story(stories_dir, 'it_story.json', [3, 3], language=None)  # language from the filename prefix
+    db_path = str(tmp_path / 'stories.db')
+    story_db.import_stories(str(stories_dir), db_path)
+
+    for catalog in (story_db.MemoryCatalog.load(db_path), story_db.SQLiteCatalog(db_path)):
+        assert catalog.get_story_candidates(1.0, []) == 'fr_story.json'
+        assert catalog.get_story_candidates(1.0, [], language='es') == 'es_story.json'
+        # The only Italian story is far from the target, but French stories are never served instead
+        assert catalog.get_story_candidates(1.0, [], language='it') == 'it_story.json'
+        # Having seen every French story doesn't reset the Spanish ones
+        assert catalog.get_story_candidates(1.0, ['fr_story.json', 'es_story.json'], language='es') == 'es_story.json'
+        assert [story['filename'] for story in catalog.get_story_list('es')] == ['es_story.json']
+        assert len(catalog.get_story_list()) == 3
+
+def test_new_stories_make_the_catalog_stale(catalogs):
+    stories_dir, db_path, _, sqlite = catalogs
+    assert not story_db.catalog_is_stale(stories_dir, db_path)
+    time.sleep(0.01)
+    write_story(stories_dir, 'fr_story_new.json', [2, 3])
+    os.utime(stories_dir, (time.time() + 1, time.time() + 1))
+    assert story_db.catalog_is_stale(stories_dir, db_path)
+    assert story_db.ensure_catalog(stories_dir, db_path)
+    assert sqlite.get_story_summary('fr_story_new.json') is not None
+
+def test_catalogs_from_an_older_schema_are_stale(catalogs):
+    stories_dir, db_path, _, _ = catalogs
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA user_version = 1")
+    conn.close()
+    assert story_db.catalog_is_stale(stories_dir, db_path)
+
+def test_language_from_args():
+    assert story_db.language_from_args(['extra_dir']) == story_db.DEFAULT_LANGUAGE
+    assert story_db.language_from_args(['--profile', '--lang=es']) == 'es'
+    with pytest.raises(SystemExit):
+        story_db.language_from_args(['--lang=xx'])
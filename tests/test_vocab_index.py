@@ -0,0 +1,74 @@
+import os
+import json
+import time
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import story_db
+import vocab_index
+
+def write_story(stories_dir, filename, score, cognates, language='fr'):
+    story = {
+        'story': [{'sentence': ' '.join(cognates) + ' et le chat.', 'actual_score': score, 'actual_cognate_words': cognates}],
+        'metadata': {'language': language},
+    }
+    (stories_dir / filename).write_text(json.dumps(story), encoding='utf-8')
+
+@pytest.fixture
+def index(tmp_path):
+    stories_dir = tmp_path / 'stories'
+    stories_dir.mkdir()
+    write_story(stories_dir, 'fr_sport_1.json', 1.0, ['football', 'match', 'stade'])
+    write_story(stories_dir, 'fr_sport_2.json', 1.1, ['football', 'match', 'champion'])
+    write_story(stories_dir, 'fr_music.json', 0.9, ['concert', 'guitare', 'musique'])
+    write_story(stories_dir, 'fr_hard.json', 3.0, ['restaurant', 'menu'])
+    write_story(stories_dir, 'es_music.json', 1.0, ['concierto', 'guitarra'], language='es')
+    db_path = str(tmp_path / 'stories.db')
+    story_db.import_stories(str(stories_dir), db_path)
+    index_path = str(tmp_path / 'vocab_index')
+    assert vocab_index.build_index(db_path, index_path) == 5
+    return vocab_index.VocabIndex.load(index_path)
+
+def test_index_is_memory_mapped(index):
+    assert isinstance(index.vectors, np.memmap)
+    assert len(index) == 5
+
+def test_stories_with_new_vocabulary_come_first(index):
+    top = index.top_stories(1.0, ['fr_sport_1.json'], tolerance=0.3)
+    assert [filename for filename, _ in top] == ['fr_music.json', 'fr_sport_2.json']
+
+def test_only_unseen_stories_in_language_and_range_are_candidates(index):
+    assert [filename for filename, _ in index.top_stories(1.0, [], language='es')] == ['es_music.json']
+    assert index.top_stories(2.0, [], tolerance=0.3) == []
+    seen = ['fr_sport_1.json', 'fr_sport_2.json', 'fr_music.json']
+    assert index.top_stories(1.0, seen) == []
+    assert len(index.top_stories(1.0, [], k=1)) == 1
+
+def test_rank_profile_uses_frequency_bands():
+    ranks = {'le': 2, 'chat': 700, 'stade': 7000}
+    profile = vocab_index.rank_profile(['Le chat, le stade et xyz.'], ranks)
+    assert profile.sum() == pytest.approx(1.0)
+    assert profile[0] == pytest.approx(2 / 6)  # "le" twice
+    assert profile[-1] == pytest.approx(2 / 6)  # "et" and "xyz" aren't in the list
+    assert vocab_index.rank_profile(['Le chat.'], {}).sum() == 0
+
+def test_each_language_is_sorted_by_difficulty(index):
+    rows, difficulties = index.partitions['fr']
+    assert list(difficulties) == sorted(difficulties)
+    assert [index.filenames[row] for row in rows][-1] == 'fr_hard.json'
+    # The window includes its ends
+    assert [filename for filename, _ in index.top_stories(2.7, [], tolerance=0.3)] == ['fr_hard.json']
+
+def test_index_is_rebuilt_with_the_catalog(tmp_path, index):
+    db_path, index_path = str(tmp_path / 'stories.db'), str(tmp_path / 'vocab_index')
+    assert not vocab_index.ensure_index(db_path, index_path)
+    os.utime(index_path + '.npy', (time.time() - 10, time.time() - 10))
+    write_story(tmp_path / 'stories', 'fr_new.json', 1.0, ['cinema', 'film'])
+    os.utime(tmp_path / 'stories', (time.time() + 1, time.time() + 1))
+    assert story_db.ensure_catalog(str(tmp_path / 'stories'), db_path)
+    assert vocab_index.ensure_index(db_path, index_path)
+    assert 'fr_new.json' in vocab_index.VocabIndex.load(index_path).rows
+    # An index that was never built isn't created
+    assert not vocab_index.ensure_index(db_path, str(tmp_path / 'other_index'))
@@ -1,11 +1,11 @@
+import os
+import json
+import datetime
+from response_parsing import try_parse_json
+
 def is_valid_json(content):
-    """Helper function to validate JSON output"""
-    try:
-        json.loads(content)
-        return True
-    except json.JSONDecodeError:
-        print(f"Invalid JSON output: {content}")
-        return False
+    """Helper function to validate JSON output, after the same repairs parse_json applies"""
+    return try_parse_json(content) is not None
 
 def save_sentences_batch(sentences, output_file):
     """
@@ -0,0 +1,216 @@
+import os
+import re
+import json
+import sqlite3
+import tempfile
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+import story_db
+
+# Built offline by running this module; the app loads it if it exists. VOCAB_INDEX is the
+# path without extension: the vectors go in <path>.npy and the story metadata in <path>.json.
+VOCAB_INDEX = os.environ.get("VOCAB_INDEX", "vocab_index")
+FREQUENCY_LISTS = "data"  # <language>.txt, one word per line from most to least frequent
+
+# Upper rank of each frequency band; words outside the list fall in one more band after these
+RANK_BANDS = (100, 500, 1000, 2500, 5000, 10000)
+# How much matching the learner's usual word frequencies counts against new cognates
+RANK_WEIGHT = 0.5
+
+_WORD_RE = re.compile(r"\w+")
+
+def load_frequency_ranks(language: str, directory: str = FREQUENCY_LISTS) -> Dict[str, int]:
+    """Word -> rank from data/<language>.txt, or an empty dict if there is no list for the language."""
+    path = os.path.join(directory, f"{language}.txt")
+    if not os.path.exists(path):
+        return {}
+    ranks = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for rank, line in enumerate(f):
+            word = line.strip().lower()
+            if word and word not in ranks:
+                ranks[word] = rank
+    return ranks
+
+def rank_profile(sentences: Iterable[str], ranks: Dict[str, int]) -> np.ndarray:
+    """The share of a story's words in each frequency band, with unlisted words in the last one."""
+    counts = np.zeros(len(RANK_BANDS) + 1, dtype=np.float32)
+    if not ranks:
+        return counts
+    for sentence in sentences:
+        for word in _WORD_RE.findall(sentence.lower()):
+            rank = ranks.get(word)
+            counts[len(RANK_BANDS) if rank is None else int(np.searchsorted(RANK_BANDS, rank, side='right'))] += 1
+    total = counts.sum()
+    return counts / total if total else counts
+
+def _normalized(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def build_index(db_path: str = story_db.STORY_DB, index_path: str = VOCAB_INDEX,
+                frequency_dir: str = FREQUENCY_LISTS) -> int:
+    """
+    Builds one feature vector per story from the catalog: its bag of cognate words
+    (actual_cognate_words), L2-normalized, followed by its rank_profile scaled by
+    RANK_WEIGHT. Both files are written to temporary paths and renamed into place.
+
+    Returns:
+        The number of stories indexed
+    """
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    # Rows are grouped by language and sorted by difficulty, so a query's candidates are one contiguous slice
+    stories = conn.execute(
+        "SELECT id, filename, language, mean_difficulty FROM stories ORDER BY language, mean_difficulty, filename"
+    ).fetchall()
+    sentences: Dict[int, List[str]] = {}
+    for story_id, sentence in conn.execute("SELECT story_id, sentence FROM sentences ORDER BY story_id, position"):
+        sentences.setdefault(story_id, []).append(sentence)
+    cognates: Dict[int, List[str]] = {}
+    for story_id, word in conn.execute(
+        "SELECT s.story_id, c.word FROM cognate_words c JOIN sentences s ON s.id = c.sentence_id"
+    ):
+        cognates.setdefault(story_id, []).append(word.strip().lower())
+    conn.close()
+
+    vocabulary = sorted({word for words in cognates.values() for word in words if word})
+    columns = {word: i for i, word in enumerate(vocabulary)}
+    ranks_by_language = {language: load_frequency_ranks(language, frequency_dir) for language in story_db.LANGUAGES}
+    vectors = np.zeros((len(stories), len(vocabulary) + len(RANK_BANDS) + 1), dtype=np.float32)
+    for row, (story_id, _, language, _) in enumerate(stories):
+        words = np.zeros(len(vocabulary), dtype=np.float32)
+        for word in cognates.get(story_id, []):
+            if word:
+                words[columns[word]] += 1
+        vectors[row, :len(vocabulary)] = _normalized(words)
+        vectors[row, len(vocabulary):] = RANK_WEIGHT * rank_profile(
+            sentences.get(story_id, []), ranks_by_language.get(language) or {}
+        )
+
+    metadata = {
+        'vocabulary_size': len(vocabulary),
+        'stories': [
+            {'filename': filename, 'language': language, 'difficulty': difficulty}
+            for _, filename, language, difficulty in stories
+        ],
+    }
+    # Unique temporary names, since several workers may rebuild the index at once
+    index_dir = os.path.dirname(os.path.abspath(index_path))
+    fd, tmp_npy = tempfile.mkstemp(suffix='.npy', dir=index_dir)
+    with os.fdopen(fd, 'wb') as f:
+        np.save(f, vectors)
+    fd, tmp_json = tempfile.mkstemp(suffix='.json', dir=index_dir)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False)
+    os.replace(tmp_json, index_path + '.json')
+    os.replace(tmp_npy, index_path + '.npy')
+    return len(stories)
+
+def index_is_stale(db_path: str = story_db.STORY_DB, index_path: str = VOCAB_INDEX) -> bool:
+    """True if an index has been built but is older than the catalog, e.g. after stories were added or re-scored."""
+    npy_path = index_path + '.npy'
+    return os.path.exists(npy_path) and os.path.getmtime(npy_path) < os.path.getmtime(db_path)
+
+def ensure_index(db_path: str = story_db.STORY_DB, index_path: str = VOCAB_INDEX,
+                 frequency_dir: str = FREQUENCY_LISTS) -> bool:
+    """
+    Rebuilds the index if the catalog has changed since it was built, so new stories
+    can be recommended and filtering uses the current difficulties. Never builds an
+    index that doesn't exist yet; that is left to running this module.
+
+    Returns:
+        True if the index was rebuilt
+    """
+    if not index_is_stale(db_path, index_path):
+        return False
+    build_index(db_path, index_path, frequency_dir)
+    return True
+
+class VocabIndex:
+    """
+    The story vectors, memory-mapped read-only so every gunicorn worker shares the same
+    pages, with each language's rows sorted by difficulty so that a query only touches
+    the rows within its tolerance window.
+
+    A query scores those candidates with one matrix-vector product against a vector that
+    is the negated cognate profile of the stories the learner has seen, followed by their
+    frequency profile. High scores mean few cognates the learner has already met, in
+    words about as common as the ones they have been reading.
+    """
+
+    def __init__(self, vectors: np.ndarray, vocabulary_size: int, stories: List[Dict]):
+        self.vectors = vectors
+        self.vocabulary_size = vocabulary_size
+        self.filenames = [story['filename'] for story in stories]
+        self.rows = {filename: row for row, filename in enumerate(self.filenames)}
+        # language -> (row numbers, their difficulties), both sorted by difficulty
+        by_language: Dict[str, List[int]] = {}
+        for row, story in enumerate(stories):
+            by_language.setdefault(story['language'], []).append(row)
+        self.partitions = {}
+        for language, rows in by_language.items():
+            rows.sort(key=lambda row: stories[row]['difficulty'])
+            self.partitions[language] = (
+                np.array(rows, dtype=np.int64),
+                np.array([stories[row]['difficulty'] for row in rows], dtype=np.float64),
+            )
+
+    @classmethod
+    def load(cls, index_path: str = VOCAB_INDEX) -> 'VocabIndex':
+        with open(index_path + '.json', 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+        vectors = np.load(index_path + '.npy', mmap_mode='r')
+        if vectors.shape != (len(metadata['stories']), metadata['vocabulary_size'] + len(RANK_BANDS) + 1):
+            # Caught between build_index's two renames; the caller should retry later
+            raise ValueError(f"{index_path}.npy doesn't match {index_path}.json")
+        return cls(vectors, metadata['vocabulary_size'], metadata['stories'])
+
+    def __len__(self) -> int:
+        return len(self.filenames)
+
+    def query_vector(self, seen_stories: Iterable[str]) -> np.ndarray:
+        rows = [self.rows[filename] for filename in seen_stories if filename in self.rows]
+        query = np.zeros(self.vectors.shape[1], dtype=np.float32)
+        if not rows:
+            return query
+        profile = np.asarray(self.vectors[rows]).mean(axis=0)
+        query[:self.vocabulary_size] = -_normalized(profile[:self.vocabulary_size])
+        query[self.vocabulary_size:] = profile[self.vocabulary_size:] / RANK_WEIGHT
+        return query
+
+    def top_stories(self, target_difficulty: float, seen_stories: Iterable[str], tolerance: float = 0.3,
+                    language: str = story_db.DEFAULT_LANGUAGE, k: int = 3) -> List[Tuple[str, float]]:
+        """
+        The k unseen stories in language within tolerance of target_difficulty that bring
+        the most new vocabulary, best first. Empty if there are none, in which case the
+        catalog's nearest-story fallback should be used.
+
+        Returns:
+            (filename, score) pairs
+        """
+        seen_stories = list(seen_stories)
+        if language not in self.partitions:
+            return []
+        rows, difficulties = self.partitions[language]
+        lo = int(np.searchsorted(difficulties, target_difficulty - tolerance, side='left'))
+        hi = int(np.searchsorted(difficulties, target_difficulty + tolerance, side='right'))
+        seen = set(seen_stories)
+        candidates = np.array([row for row in rows[lo:hi] if self.filenames[row] not in seen], dtype=np.int64)
+        if len(candidates) == 0:
+            return []
+        scores = np.asarray(self.vectors[candidates]) @ self.query_vector(seen_stories)
+        if len(candidates) > k:
+            best = np.argpartition(-scores, k)[:k]
+        else:
+            best = np.arange(len(candidates))
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(self.filenames[candidates[i]], float(scores[i])) for i in best]
+
+# Run once to build the first index; after that the app rebuilds it whenever it rebuilds
+# the catalog, and reloads it on its next catalog check.
+if __name__ == "__main__":
+    story_db.ensure_catalog()
+    count = build_index()
+    print(f"Indexed {count} stories into {VOCAB_INDEX}.npy")